@@ -4,12 +4,22 @@ from flask import Flask
 
 import auth
 import models
+import sessions
 
 
 def create_app(test_config=None) -> Flask:
     # App initialization.
     app = Flask(__name__, instance_relative_config=True)
-    app.config.from_mapping(SECRET_KEY='dev', DATABASE=os.path.join(app.instance_path, 'market_db.sqlite'))
+    app.config.from_mapping(
+        SECRET_KEY='dev',
+        DATABASE=os.path.join(app.instance_path, 'market_db.sqlite'),
+        DATABASE_POOL_SIZE=8,
+        DATABASE_MMAP_SIZE=256 * 1024 * 1024,
+        DATABASE_STATEMENT_CACHE_SIZE=256,
+        MARKET_PRECOMPUTE_PATHS=False,
+        SESSION_BACKEND='cookie',
+        STOREFRONT_CACHE_SIZE=1024
+    )
 
     # App configuration.
     if test_config is None:
@@ -30,12 +40,17 @@ def create_app(test_config=None) -> Flask:
     # Login Manager setup
     auth.init_app(app)
 
+    # Session storage setup.
+    sessions.init_app(app)
+
     # Database setup.
     import database
     with app.app_context():     # Flask app pre-load tasks. Sets up the database and loads any stateful data required by the system.
         database.init_db()
         models.cache_stalls_from_database()
         models.init_market()
+        models.init_product_index()
+        models.init_fill_latencies()
     database.init_app(app)
 
     # App blueprint assignment.
@@ -45,6 +60,10 @@ def create_app(test_config=None) -> Flask:
     app.register_blueprint(blueprints.shop_blueprint)
     app.register_blueprint(blueprints.market_blueprint)
 
+    # App commands.
+    app.cli.add_command(models.orders.merge_orders_command)
+    app.cli.add_command(models.reports.rebuild_sales_rollups_command)
+
     # Return the created flask app.
     return app
 
@@ -48,8 +48,8 @@ def register():
         db = database.get_db()
         is_valid, data = validate_vendor_registry(db)
         if is_valid:
-            db.execute("""INSERT INTO vendors(vendor_name, vendor_secret, vendor_email) VALUES (?, ?, ?)""", (*data,))
-            db.commit()
+            with database.writer() as db:
+                db.execute("""INSERT INTO vendors(vendor_name, vendor_secret, vendor_email) VALUES (?, ?, ?)""", (*data,))
             flask.flash('Vendor successfully registered.')
             return flask.redirect(flask.url_for(LOGIN))
         flask.flash(data)
@@ -1,8 +1,10 @@
+from datetime import date, datetime, time, timedelta
+
 import flask
 from flask_login import login_required
 
 import models
-from blueprints.routes import DISPLAY_INVENTORY, INDEX
+from blueprints.routes import DISPLAY_INVENTORY, SALES
 from models import Vendor
 
 blueprint = flask.Blueprint('inventory', __name__, url_prefix='/inventory')
@@ -58,16 +60,56 @@ def remove_inventory_bin():
 
 
 @blueprint.route('/sales', methods=['GET', 'POST'])
+@login_required
 def sales():
-    # todo: generate and display all pending and fulfilled orders.
-    # call vendor.get_all_orders, display all orders along with their transactions, provide fill buttons if transaction
-    # not filled, and fill the whole order when every transaction in the order is filled. Display previous filled orders
-    # and transactions.
-    # Update the database as necessary.
-    return flask.redirect(flask.url_for(INDEX))
+    """
+    Dashboard of the vendor's pending transactions, showing whether each bin's stock covers them.
+    Posting fills every checked order and transaction at once.
+    """
+    vendor = Vendor.current_user()
+    if flask.request.method == 'POST':
+        filled = vendor.fill_orders(flask.request.form.getlist('order'))
+        filled += vendor.fill_transactions(
+            tuple(transaction.split('/', 1)) for transaction in flask.request.form.getlist('transaction')
+        )
+        flask.flash(f'Filled {len(filled)} transactions.')
+        return flask.redirect(flask.url_for(SALES))
+    page = max(flask.request.args.get('page', 0, type=int), 0)
+    page_size = Vendor.PENDING_ORDERS_PAGE_SIZE
+    orders = list(vendor.iter_orders(filled=False, limit=page_size + 1, offset=page * page_size))
+    return flask.render_template(
+        'inventory/sales.html',
+        pending_stock=vendor.pending_stock(), orders=orders[:page_size], bins={_bin.bin_id: _bin for _bin in vendor.bins},
+        page=page, has_next=len(orders) > page_size
+    )
 
 
-@blueprint.route('/report', methods=['GET', 'POST'])
+@blueprint.route('/waves', methods=['GET'])
+@login_required
+def pick_waves():
+    """Batches the vendor's pending orders into pick waves, each walked once through the market."""
+    vendor = Vendor.current_user()
+    return flask.render_template(
+        'inventory/waves.html', waves=vendor.plan_pick_waves(), bins={_bin.bin_id: _bin for _bin in vendor.bins}
+    )
+
+
+@blueprint.route('/report', methods=['GET'])
+@login_required
 def generate_report():
-    # todo: generate analysis and performance report.
-    return flask.redirect(flask.url_for(INDEX))
+    """Reports the vendor's sales between the start and end dates given, both inclusive. Defaults to the last week."""
+    today = date.today()
+    try:
+        start = date.fromisoformat(flask.request.args.get('start', (today - timedelta(days=6)).isoformat()))
+        end = date.fromisoformat(flask.request.args.get('end', today.isoformat()))
+    except ValueError:
+        flask.flash('Dates must be given as YYYY-MM-DD.')
+        start, end = today - timedelta(days=6), today
+    vendor = Vendor.current_user()
+    report = vendor.sales_report(datetime.combine(start, time()), datetime.combine(end + timedelta(days=1), time()))
+    # The report only holds the vendor's own bins, so their sketches are read directly instead of through get_bin.
+    fill_latencies = {bin_sales.bin_id: models.get_fill_latencies().bin(bin_sales.bin_id) for bin_sales in report.bins}
+    return flask.render_template(
+        'inventory/report.html',
+        report=report, start=start, end=end, fill_latency=vendor.fill_latency(), fill_latencies=fill_latencies
+    )
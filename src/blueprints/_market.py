@@ -1,14 +1,27 @@
 import flask
 
+import models
 from blueprints.routes import INDEX
+from models import MarketMap
 
 blueprint = flask.Blueprint('market', __name__, url_prefix='/market')
 
 
 @blueprint.route('find', methods=['GET', 'POST'])
 def find_market_stall():
-    # Todo: Implement user interface and Hook into market.py
-    return flask.redirect(flask.url_for(INDEX))
+    """
+    Lists the stalls selling a product. If the bin the customer is standing at is given,
+    the stalls are ranked by walking distance from it.
+    """
+    query = flask.request.values.get('product', '')
+    from_bin = flask.request.values.get('from_bin')
+    from_stall = MarketMap.stall_of(from_bin) if from_bin else None
+    index = models.get_product_index()
+    if from_stall is not None:
+        matches = index.search_near(query, from_stall, models.get_market_map())
+    else:
+        matches = [(_bin, None) for _bin in index.search(query)]
+    return flask.render_template('market/find.html', query=query, from_bin=from_bin, matches=matches)
 
 
 @blueprint.route('configure', methods=['GET', 'POST'])
@@ -1,9 +1,15 @@
+import hashlib
+
 import flask
+from flask_login import current_user
+from markupsafe import Markup
 
-import database
+import models
 from blueprints.routes import ADD_TO_CART, DISPLAY_CART, INDEX
+from cache import LRUCache
 from models import Vendor, Bin
-from models.orders import CustomerCart, CartItem, Order, Transaction
+from errors import InsufficientStockError
+from models.orders import CustomerCart, Customer, checkout as checkout_cart
 
 blueprint = flask.Blueprint('orders', __name__)
 
@@ -22,6 +28,24 @@ to implement with the given system.
 """
 
 
+@blueprint.before_request
+def upgrade_session():
+    """
+    Converts the cart and clicked bin of sessions saved before the session only held ids, so existing cookies keep
+    working. Anything that can not be converted is dropped.
+    """
+    if 'customer' in flask.session and 'items' not in flask.session['customer']:
+        compact_cart = CustomerCart.upgrade_compact(flask.session['customer'])
+        if compact_cart is None:
+            flask.session.pop('customer')
+        else:
+            flask.session['customer'] = compact_cart
+    if 'bin_clicked' in flask.session and not isinstance(flask.session['bin_clicked'], str):
+        bin_clicked = flask.session.pop('bin_clicked')
+        if isinstance(bin_clicked, dict) and isinstance(bin_clicked.get('bin_id'), str):
+            flask.session['bin_clicked'] = bin_clicked['bin_id']
+
+
 @blueprint.route('/', methods=['GET', 'POST'])
 def index():
     """The main front facing shop."""
@@ -30,14 +54,54 @@ def index():
         if 'customer' not in flask.session:
             # A customer corresponds to the current session since there is no customer login.
             # I.e. A customer is a browsing session.
-            flask.session['customer'] = CustomerCart().dict()
-        flask.session['bin_clicked'] = Bin.from_json(flask.request.form['bin_data'])
+            flask.session['customer'] = CustomerCart().compact()
+        flask.session['bin_clicked'] = Bin.from_json(flask.request.form['bin_data']).bin_id
         return flask.redirect(flask.url_for(ADD_TO_CART))
 
     # If promoted vendors were implemented, order of promoted vendors would be determined here.
-    vendors = Vendor.get_all_vendors() or []
-    vendor_bins = [{'vendor': vendor, 'bins': [_bin for _bin in vendor.bins]} for vendor in vendors]
-    return flask.render_template('shop/browse.html', shop=vendor_bins)
+    page = max(flask.request.args.get('page', 0, type=int), 0)
+    vendors, has_next = Vendor.get_page(page)
+    index = models.get_product_index()
+    versions = [(vendor.vendor_id, index.vendor_version(vendor.vendor_id)) for vendor in vendors]
+
+    # The page only differs between anonymous customers when the shop changes, so browsers can revalidate it.
+    # Logged in vendors and pending flash messages change the rest of the page, so those are always rendered.
+    etag = None
+    if not current_user.is_authenticated and '_flashes' not in flask.session:
+        etag = hashlib.sha1(repr((index.epoch, page, has_next, versions)).encode()).hexdigest()
+        if etag in flask.request.if_none_match:
+            response = flask.Response(status=304)
+            response.set_etag(etag)
+            return response
+
+    fragment_cache = _get_fragment_cache()
+    fragments = {key: fragment_cache.get(key) for key in versions}
+    missing = [vendor_id for (vendor_id, _), fragment in fragments.items() if fragment is None]
+    if missing:
+        storefronts, _ = Vendor.storefront(vendor_ids=missing)
+        for storefront in storefronts:
+            key = (storefront.vendor.vendor_id, index.vendor_version(storefront.vendor.vendor_id))
+            fragments[key] = Markup(flask.render_template('shop/_storefront.html', storefront=storefront))
+            fragment_cache.put(key, fragments[key])
+
+    response = flask.make_response(flask.render_template(
+        'shop/browse.html', shop=[fragments[key] for key in versions if fragments[key] is not None], page=page, has_next=has_next
+    ))
+    if etag is not None:
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+    return response
+
+
+def _get_fragment_cache() -> LRUCache[tuple[int, int], Markup]:
+    """
+    Rendered storefront blocks keyed by vendor id and the vendor's version in the product index.
+    A vendor's version changes whenever one of its bins does, so stale blocks are never looked up again and age out.
+    """
+    app = flask.current_app
+    if 'storefront_fragments' not in app.extensions:
+        app.extensions['storefront_fragments'] = LRUCache(app.config['STOREFRONT_CACHE_SIZE'])
+    return app.extensions['storefront_fragments']
 
 
 @blueprint.route('/cart', methods=['GET'])
@@ -46,7 +110,7 @@ def display_cart():
     if 'bin_clicked' in flask.session:
         return flask.redirect(flask.url_for(ADD_TO_CART))
     if 'customer' in flask.session:
-        cart: CustomerCart = CustomerCart(**flask.session['customer'])
+        cart = CustomerCart.from_compact(flask.session['customer'])
         return flask.render_template('shop/cart.html', cart=cart.cart_items, total_price=cart.cart_total)
     else:
         return flask.render_template('shop/cart.html')
@@ -55,11 +119,12 @@ def display_cart():
 @blueprint.route('/remove-cart', methods=['GET'])
 def remove_item():
     if 'customer' in flask.session:
-        cart: CustomerCart = CustomerCart.parse_obj(flask.session['customer'])
+        # The compact cart is edited directly, no bins need to be loaded.
+        compact_cart = flask.session['customer']
         bin_id = flask.request.args['bin_id']
-        if bin_id in cart.cart_items:
-            cart.cart_items.pop(bin_id)
-            flask.session['customer'] = cart.dict()
+        if bin_id in compact_cart['items']:
+            compact_cart['items'].pop(bin_id)
+            flask.session['customer'] = compact_cart
     return flask.redirect(flask.url_for(DISPLAY_CART))
 
 
@@ -69,19 +134,21 @@ def add_to_cart():
     if 'bin_clicked' not in flask.session or 'customer' not in flask.session:
         return flask.redirect(flask.url_for(DISPLAY_CART))
 
-    bin_clicked: Bin = Bin(**flask.session['bin_clicked'])
-    cart: CustomerCart = CustomerCart.parse_obj(flask.session['customer'])
+    compact_cart = flask.session['customer']
     if flask.request.method == 'POST':
         if 'canceled' in flask.request.form:
             flask.session.pop('bin_clicked')
             return flask.redirect(flask.url_for(DISPLAY_CART))
 
+        bin_id = flask.session.pop('bin_clicked')
         quantity = float(flask.request.form['quantity'])
-        if bin_clicked.bin_id in cart.cart_items:
-            cart.cart_items[bin_clicked.bin_id].quantity += quantity
-        else:
-            cart.cart_items[bin_clicked.bin_id] = CartItem(item_bin=bin_clicked, quantity=quantity)
-        flask.session['customer'] = cart.dict()
+        compact_cart['items'][bin_id] = compact_cart['items'].get(bin_id, 0.0) + quantity
+        flask.session['customer'] = compact_cart
+        return flask.redirect(flask.url_for(DISPLAY_CART))
+
+    cart = CustomerCart.from_compact(compact_cart)
+    bin_clicked = models.load_bins([flask.session['bin_clicked']]).get(flask.session['bin_clicked'])
+    if bin_clicked is None:
         flask.session.pop('bin_clicked')
         return flask.redirect(flask.url_for(DISPLAY_CART))
     return flask.render_template('shop/cart.html', bin_clicked=bin_clicked, cart=cart.cart_items, total_price=cart.cart_total)
@@ -91,35 +158,22 @@ def add_to_cart():
 def checkout():
     if 'customer' not in flask.session:
         return flask.redirect(flask.url_for(INDEX))
-    cart: CustomerCart = CustomerCart.parse_obj(flask.session['customer'])
+    cart = CustomerCart.from_compact(flask.session['customer'])
     if len(cart.cart_items) == 0:
         return flask.redirect(flask.url_for(INDEX))
 
-    db = database.get_db()
-    is_subscribed = 'is_subscribed' in flask.session
-    customer_email = flask.session.get('customer_email')
-    customer_name = flask.session.get('customer_name')
-    customer_exists = db.execute(
-        """SELECT customer_id FROM customers WHERE customer_id = ?""",
-        (cart.customer_id,)
-    ).fetchone()
-    if customer_exists is None:
-        db.execute(
-            """INSERT INTO customers(customer_id, name, email, newsletter_subscription) VALUES (?, ?, ?, ?)""",
-            (cart.customer_id, customer_name, customer_email, is_subscribed)
-        )
-    for cart_item in cart.cart_items.values():
-        order = Order(customer_id=cart.customer_id)
-        transaction = Transaction(bin_id=cart_item.item_bin.bin_id, order_id=order.order_id, units_purchased=cart_item.quantity)
-        db.execute("""INSERT INTO orders(customer_id, order_id, order_filled, order_filled_at) VALUES (?, ?, ?, ?)""", order.tuple())
-        db.execute(
-            """
-            INSERT INTO transactions(order_id, bin_id, units_purchased, transaction_filled, time_of_sale, transaction_filled_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            transaction.tuple()
-        )
-    db.commit()
+    customer = Customer(
+        customer_id=cart.customer_id,
+        name=flask.session.get('customer_name'),
+        email=flask.session.get('customer_email'),
+        newsletter_subscription='is_subscribed' in flask.session
+    )
+    try:
+        checkout_cart(cart, customer)
+    except InsufficientStockError as e:
+        for bin_id, stock in e.shortfalls.items():
+            flask.flash(f'Only {stock:g} left of {cart.cart_items[bin_id].item_bin.product_name}.')
+        return flask.redirect(flask.url_for(DISPLAY_CART))
     cart.cart_items.clear()
-    flask.session['customer'] = cart.dict()
+    flask.session['customer'] = cart.compact()
     return flask.redirect(flask.url_for(INDEX))
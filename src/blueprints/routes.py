@@ -10,9 +10,15 @@ CREATE_BIN: Final = 'inventory.create_inventory_bin'
 EDIT_BIN: Final = 'inventory.edit_inventory_bin'
 REMOVE_BIN: Final = 'inventory.remove_inventory_bin'
 DISPLAY_INVENTORY: Final = 'inventory.display_inventory'
+SALES: Final = 'inventory.sales'
+PICK_WAVES: Final = 'inventory.pick_waves'
+SALES_REPORT: Final = 'inventory.generate_report'
 
 # orders:
 INDEX: Final = 'orders.index'
 ADD_TO_CART: Final = 'orders.add_to_cart'
 DISPLAY_CART: Final = 'orders.display_cart'
 CHECKOUT: Final = 'orders.checkout'
+
+# market:
+FIND_STALL: Final = 'market.find_market_stall'
@@ -1,5 +1,9 @@
+import pathlib
 import sqlite3
+import threading
 import uuid
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple
 
 from flask import current_app, g
 
@@ -11,28 +15,194 @@ def gen_uuid(int_val: int = None) -> str:
     return str(uuid.uuid4())
 
 
+class PoolInfo(NamedTuple):
+    opened: int
+    reused: int
+    connections: int
+    maxsize: int
+
+
+class ConnectionPool:
+    """
+    Keeps one open connection per thread to an app's database so requests served by the same thread reuse it,
+    instead of connecting and setting up a new connection for every request.
+    Performance pragmas are applied once, when a connection is opened. The database is switched to WAL journaling,
+    so readers never block the writer and the writer never blocks readers.
+    Threads beyond maxsize are handed a connection that is closed when it is released.
+    read_only: Open read only connections that can not change the database, e.g. for reporting and browsing.
+    """
+
+    def __init__(
+            self,
+            database: str, *,
+            read_only: bool = False,
+            maxsize: int = 8,
+            mmap_size: int = 0,
+            statement_cache_size: int = 128
+    ):
+        self.database = database
+        self.read_only = read_only
+        self.maxsize = maxsize
+        self.mmap_size = mmap_size
+        self.statement_cache_size = statement_cache_size
+        self.opened = 0
+        self.reused = 0
+        self._local = threading.local()
+        self._connections: dict[threading.Thread, sqlite3.Connection] = {}
+        self._lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        """Held by writer() for the duration of a write transaction."""
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            # as_uri() percent-encodes characters that mean something in a URI, such as '#', '?' and '%'.
+            db = sqlite3.connect(
+                pathlib.Path(self.database).resolve().as_uri() + '?mode=ro', uri=True,
+                detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=self.statement_cache_size
+            )
+            db.execute("""PRAGMA query_only = ON""")
+        else:
+            db = sqlite3.connect(
+                self.database, detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=self.statement_cache_size
+            )
+            db.execute("""PRAGMA journal_mode = WAL""")
+        db.row_factory = sqlite3.Row
+        db.execute("""PRAGMA synchronous = NORMAL""")     # Durable against app crashes, WAL keeps the database consistent.
+        db.execute("""PRAGMA temp_store = MEMORY""")
+        db.execute(f"""PRAGMA mmap_size = {int(self.mmap_size)}""")
+        db.execute("""PRAGMA busy_timeout = 5000""")      # Wait for the writer instead of failing with 'database is locked'.
+        self.opened += 1
+        return db
+
+    def acquire(self) -> sqlite3.Connection:
+        """Returns the current thread's connection, opening it if the thread has none."""
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            self.reused += 1
+            return db
+        db = self._connect()
+        with self._lock:
+            if len(self._connections) >= self.maxsize:
+                # Connections of finished threads can not be closed from this thread. Dropping them lets them close
+                # once they are garbage collected.
+                for thread in [thread for thread in self._connections if not thread.is_alive()]:
+                    self._connections.pop(thread)
+            if len(self._connections) < self.maxsize:
+                self._connections[threading.current_thread()] = db
+                self._local.db = db
+        return db
+
+    def release(self, db: sqlite3.Connection):
+        """Hands a connection back once a request is done with it. Anything left uncommitted is rolled back."""
+        if db is getattr(self._local, 'db', None):
+            if db.in_transaction:
+                db.rollback()
+        else:
+            db.close()
+
+    def close(self):
+        """Closes every pooled connection. Threads open a new connection the next time they acquire one."""
+        with self._lock:
+            for db in self._connections.values():
+                # Connections can only be closed by the thread that opened them.
+                # Other threads' connections are closed once they are garbage collected.
+                try:
+                    db.close()
+                except sqlite3.ProgrammingError:
+                    pass
+            self._connections.clear()
+        self._local = threading.local()
+
+    def pool_info(self) -> PoolInfo:
+        return PoolInfo(self.opened, self.reused, len(self._connections), self.maxsize)
+
+
+def get_pool(app=None, *, read_only: bool = False) -> ConnectionPool:
+    """Returns the connection pool of the app, or the current app if none is given."""
+    app = app or current_app
+    name = 'database_read_pool' if read_only else 'database_pool'
+    if name not in app.extensions:
+        app.extensions[name] = ConnectionPool(
+            app.config['DATABASE'],
+            read_only=read_only,
+            maxsize=app.config['DATABASE_POOL_SIZE'],
+            mmap_size=app.config['DATABASE_MMAP_SIZE'],
+            statement_cache_size=app.config['DATABASE_STATEMENT_CACHE_SIZE']
+        )
+    return app.extensions[name]
+
+
 def get_db() -> sqlite3.Connection:
     """
     Returns the current connection to the app's sqlite database.
-    Opens a new connection if there is no current connection.
+    Takes a connection from the app's connection pool if there is no current connection.
     :return: The connection to the app's sqlite database.
     """
     if 'db' not in g:
-        g.db = sqlite3.connect(current_app.config['DATABASE'], detect_types=sqlite3.PARSE_DECLTYPES)
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().acquire()
     return g.db
 
 
+def get_read_db() -> sqlite3.Connection:
+    """
+    Returns the current read only connection to the app's sqlite database, for queries that never write.
+    Reads on it see every committed write and never wait for, or hold up, a writer.
+    :return: The read only connection to the app's sqlite database.
+    """
+    if 'read_db' not in g:
+        g.read_db = get_pool(read_only=True).acquire()
+    return g.read_db
+
+
+@contextmanager
+def writer() -> Iterator[sqlite3.Connection]:
+    """
+    Runs a write transaction on the current connection. Writers of the app take turns, so concurrent writes queue
+    up here instead of polling SQLite's busy timeout.
+    The transaction is committed when the block finishes, and rolled back if it raises.
+    """
+    db = get_db()
+    with get_pool().write_lock:
+        db.execute("""BEGIN IMMEDIATE""")
+        try:
+            yield db
+        except BaseException:
+            db.rollback()
+            raise
+        db.commit()
+
+
+def identity_map(name: str) -> dict:
+    """
+    Returns a dictionary of already loaded rows stored on the current app context, i.e. the current request.
+    Lets a request reuse the same object instead of querying the same row again.
+    Whatever changes or deletes the underlying row is responsible for updating or dropping its entry.
+    :param name: The kind of row stored in the map, e.g. 'bins'.
+    """
+    maps = g.setdefault('identity_maps', {})
+    return maps.setdefault(name, {})
+
+
+def close_pools(app):
+    """Closes every connection the app's connection pools hold open, e.g. before the database file is removed."""
+    # Readers go first, so the last connection to close is a writer that can clean up the WAL files.
+    for name in ('database_read_pool', 'database_pool'):
+        if name in app.extensions:
+            app.extensions[name].close()
+
+
 def close_db(err=None):
     """
-    Closes the current connection to the database.
+    Hands the current connections back to the app's connection pools.
+    The connection is closed unless the pool keeps it for the next request of this thread.
     :param err: A supplied error from the Flask app's teardown call.
-    :return: Returns True if the current connection was successfully closed.
-             Returns False if there is no current connection.
     """
     db: sqlite3.Connection = g.pop('db', None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
+    read_db: sqlite3.Connection = g.pop('read_db', None)
+    if read_db is not None:
+        get_pool(read_only=True).release(read_db)
 
 
 def init_db():
@@ -44,6 +214,39 @@ def init_db():
     db = get_db()
     with current_app.open_resource('sql/schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
+    # The schema turns foreign keys on for itself. Connections are pooled, so it must not carry over to the requests
+    # that reuse this connection. Foreign keys have never been enforced for them.
+    db.execute("""PRAGMA foreign_keys = OFF""")
+    upgrade_schema(db)
+
+
+def upgrade_schema(db: sqlite3.Connection):
+    """
+    Brings a database created with an earlier version of the schema up to date.
+    CREATE TABLE IF NOT EXISTS leaves existing tables as they were, so columns added to them since are added here.
+    """
+    columns = {row[1] for row in db.execute("""PRAGMA table_info(transactions)""")}
+    if 'unit_price' not in columns:
+        # Sales made before prices were recorded are priced at their bin's current price, as reports used to.
+        with writer() as db:
+            db.execute("""ALTER TABLE transactions ADD COLUMN unit_price FLOAT""")
+            db.execute("""ALTER TABLE transactions ADD COLUMN price_code TEXT""")
+            db.execute(
+                """UPDATE transactions SET (unit_price, price_code) = (
+                       SELECT unit_price, price_code FROM bins WHERE bins.bin_id = transactions.bin_id
+                   )"""
+            )
+    if 'stock_reserved' not in columns:
+        # Sales placed before checkout reserved stock were never taken out of their bin's stock.
+        with writer() as db:
+            db.execute("""ALTER TABLE transactions ADD COLUMN stock_reserved BOOLEAN NOT NULL DEFAULT FALSE""")
+    if db.execute(
+        """SELECT NOT EXISTS (SELECT 1 FROM sales_hourly) AND EXISTS (SELECT 1 FROM transactions WHERE transaction_filled)"""
+    ).fetchone()[0]:
+        # The rollups were just created, so the sales filled before them are rolled up once here. The triggers keep
+        # the rollups up to date from now on.
+        from models.reports import rebuild_sales_rollups
+        rebuild_sales_rollups()
 
 
 def init_app(app):
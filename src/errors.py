@@ -3,3 +3,12 @@ class UniquenessError(Exception):
         super().__init__(f'Issue occurred when gathering a unique resource. Multiple instances hit'
                          f'\nelements: {elems}.'
                          f'\n{message}.')
+
+
+class InsufficientStockError(Exception):
+    def __init__(self, shortfalls: dict[str, float], message: str=''):
+        """shortfalls: The id of every bin that could not cover its purchase mapped to the stock it has left."""
+        self.shortfalls = shortfalls
+        super().__init__(f'Not enough stock to fill the purchase.'
+                         f'\nbins: {shortfalls}.'
+                         f'\n{message}.')
@@ -1,15 +1,90 @@
+import os
+from typing import Optional
+
+from flask import current_app
+
+import database
+from . import orders
 from .market import MarketMap
 from .bin import Bin, PriceCode, price_codes
+from .latency import FillLatencies
+from .search import ProductIndex
 from .vendor import Vendor
 
 cache_stalls_from_database = MarketMap.cache_stalls_from_database
 _market_map: MarketMap
+_product_index = ProductIndex()
+_fill_latencies = FillLatencies()
 
 
 def init_market():
+    """
+    Loads the market map from the database. Requires an app context.
+    If MARKET_PRECOMPUTE_PATHS is set, the paths between every pair of stalls are computed up front and saved to
+    the instance folder, so following restarts only recompute them if the map changed.
+    """
     global _market_map
     _market_map = MarketMap()
+    if current_app.config.get('MARKET_PRECOMPUTE_PATHS'):
+        _market_map.precompute_all_pairs(os.path.join(current_app.instance_path, 'market_paths.npz'))
 
 
 def get_market_map() -> MarketMap:
     return _market_map
+
+
+def plan_pick_waves(vendor_id: Optional[int] = None, from_stall: MarketMap.VendorStall = None) -> list[MarketMap.PickWave]:
+    """
+    Plans pick waves over every unfilled transaction of the market, or of a single vendor if vendor_id is given.
+    See MarketMap.plan_pick_waves.
+    """
+    return _market_map.plan_pick_waves(orders.pending_transactions(vendor_id), from_stall)
+
+
+def init_product_index():
+    """Indexes every bin in the database by product name. Requires an app context."""
+    _product_index.clear()
+    for data in database.get_read_db().execute("""SELECT * FROM bins"""):
+        _product_index.add(Bin(*data))
+
+
+def get_product_index() -> ProductIndex:
+    return _product_index
+
+
+def init_fill_latencies():
+    """Builds the fill time sketches from every filled transaction in the database. Requires an app context."""
+    _fill_latencies.load()
+
+
+def get_fill_latencies() -> FillLatencies:
+    return _fill_latencies
+
+
+def bin_changed(data) -> Bin:
+    """
+    Brings the request's identity map and the product index up to date with a bin row read after an update.
+    Returns the identity mapped bin.
+    """
+    changed = Bin(*data)
+    bins = database.identity_map('bins')
+    _bin = bins.setdefault(changed.bin_id, changed)
+    if _bin is not changed:
+        vars(_bin).update(vars(changed))
+    _product_index.update(_bin)
+    return _bin
+
+
+def load_bins(bin_ids) -> dict[str, Bin]:
+    """
+    Returns the bins with the given ids, keyed by bin id. Bins that do not exist are left out.
+    Bins not yet in the request's identity map are loaded with a single query.
+    """
+    bins = database.identity_map('bins')
+    missing = [bin_id for bin_id in bin_ids if bin_id not in bins]
+    if missing:
+        for data in database.get_db().execute(
+                f"""SELECT * FROM bins WHERE bin_id IN ({', '.join('?' * len(missing))})""", missing
+        ):
+            bins.setdefault(data['bin_id'], Bin(*data))
+    return {bin_id: bins[bin_id] for bin_id in bin_ids if bin_id in bins}
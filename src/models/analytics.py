@@ -0,0 +1,113 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+import database
+from models.bin import PriceCode
+from models.reports import BinSales
+
+PRICE_CODES = list(PriceCode)
+"""Price codes by the index stored in SalesColumns.price_codes."""
+
+FETCH_SIZE = 4096
+"""Rows fetched from the database at a time while loading columns."""
+
+
+@dataclass
+class SalesColumns:
+    """
+    The filled sales of a vendor loaded as NumPy columns, one entry per transaction.
+    Bins are stored once, and each transaction refers to its bin by index, so no per row Python objects are made.
+    """
+    bin_ids: list[str]
+    product_names: list[str]
+    bins: np.ndarray
+    """Index of the bin each transaction sold from."""
+    units: np.ndarray
+    """Units purchased by each transaction."""
+    unit_prices: np.ndarray
+    """Unit price each transaction was sold at."""
+    price_codes: np.ndarray
+    """Index into PRICE_CODES of the currency each transaction was sold in."""
+    sold_at: np.ndarray
+    """Time of each sale in seconds since the epoch."""
+
+    def __len__(self) -> int:
+        return len(self.units)
+
+    def revenue(self, currency: Optional[PriceCode] = None, rates: dict[PriceCode, float] = None) -> np.ndarray:
+        """
+        Revenue of each transaction, in the currency it was sold in.
+        currency, rates: Convert revenue to currency instead, using rates given as the value of each currency in a
+                         common unit, e.g. US dollars per unit. Rates change, so they must always be passed in.
+        """
+        revenue = self.units * self.unit_prices
+        if currency is not None:
+            if rates is None:
+                raise ValueError(f'Exchange rates are needed to convert revenue to {currency.name}.')
+            to_currency = np.array([rates[code] / rates[currency] for code in PRICE_CODES])
+            revenue = revenue * to_currency[self.price_codes]
+        return revenue
+
+    def by_bin(self, currency: Optional[PriceCode] = None, rates: dict[PriceCode, float] = None) -> list[BinSales]:
+        """
+        Units sold and revenue of each bin that sold anything, in the same shape as a SalesReport's bins.
+        Unless revenue is converted to currency, a bin that sold in several currencies is listed once per currency.
+        """
+        groups = self.bins * len(PRICE_CODES) + (self.price_codes if currency is None else 0)
+        size = len(self.bin_ids) * len(PRICE_CODES)
+        units = np.bincount(groups, weights=self.units, minlength=size)
+        revenue = np.bincount(groups, weights=self.revenue(currency, rates), minlength=size)
+        return sorted(
+            (
+                BinSales(
+                    self.bin_ids[group // len(PRICE_CODES)], self.product_names[group // len(PRICE_CODES)],
+                    currency or PRICE_CODES[group % len(PRICE_CODES)], float(units[group]), float(revenue[group])
+                )
+                for group in np.flatnonzero(units)
+            ),
+            key=lambda bin_sales: (bin_sales.product_name, bin_sales.bin_id, bin_sales.price_code.name)
+        )
+
+
+def load_sales_columns(vendor_id: int, start: datetime, end: datetime) -> SalesColumns:
+    """
+    Loads the filled transactions of a vendor sold within [start, end) straight into NumPy columns.
+    Rows are fetched in batches of FETCH_SIZE into a buffer that doubles in size as it fills.
+    """
+    db = database.get_read_db()
+    bins = db.execute(
+        """SELECT rowid, bin_id, product_name FROM bins WHERE vendor_id = ? ORDER BY rowid""", (vendor_id,)
+    ).fetchall()
+    bin_rows = np.array([row[0] for row in bins], dtype=np.int64)
+
+    price_code_index = ' '.join(f"WHEN '{code.name}' THEN {i}" for i, code in enumerate(PRICE_CODES))
+    query = f"""
+        SELECT bins.rowid, transactions.units_purchased, (julianday(transactions.time_of_sale) - 2440587.5) * 86400.0,
+               transactions.unit_price, CASE transactions.price_code {price_code_index} END
+        FROM bins INNER JOIN transactions ON transactions.bin_id = bins.bin_id
+        WHERE bins.vendor_id = ? AND transactions.transaction_filled
+            AND transactions.time_of_sale >= ? AND transactions.time_of_sale < ?
+    """
+    # The buffer starts at one batch and doubles whenever it fills up, so the join only runs once.
+    buffer = np.empty((FETCH_SIZE, 5), dtype=np.float64)
+    cursor = db.execute(query, (vendor_id, start, end))
+    loaded = 0
+    while rows := cursor.fetchmany(FETCH_SIZE):
+        if loaded + len(rows) > len(buffer):
+            buffer = np.resize(buffer, (2 * len(buffer), 5))
+        buffer[loaded:loaded + len(rows)] = rows
+        loaded += len(rows)
+    buffer = buffer[:loaded]
+
+    return SalesColumns(
+        bin_ids=[row[1] for row in bins],
+        product_names=[row[2] for row in bins],
+        bins=np.searchsorted(bin_rows, buffer[:, 0].astype(np.int64)),
+        units=buffer[:, 1].copy(),
+        unit_prices=buffer[:, 3].copy(),
+        price_codes=buffer[:, 4].astype(np.int8),
+        sold_at=buffer[:, 2].copy()
+    )
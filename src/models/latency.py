@@ -0,0 +1,127 @@
+import math
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Union
+
+import database
+
+
+class DDSketch:
+    """
+    A mergeable streaming quantile sketch (DDSketch, Masson et al. 2019).
+    Positive values are counted in logarithmically sized buckets, so every quantile is answered within a relative
+    error of relative_accuracy using memory that grows with the log of the value range instead of the number of values.
+    Values at or below min_value, e.g. 0, are counted together and reported as 0.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-3):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._buckets: dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value: float):
+        if value <= self.min_value:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self._buckets[key] = self._buckets.get(key, 0) + 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: 'DDSketch'):
+        """Adds every value counted by another sketch with the same relative accuracy to this one."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Only sketches with the same relative accuracy can be merged.')
+        for key, count in other._buckets.items():
+            self._buckets[key] = self._buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count > 0 else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Returns the value at quantile q, between 0 and 1, or None if the sketch is empty."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self._buckets):
+            seen += self._buckets[key]
+            if rank < seen:
+                # The middle of the bucket (gamma^(key - 1), gamma^key] in terms of relative error.
+                return 2 * self._gamma ** key / (self._gamma + 1)
+        return 2 * self._gamma ** max(self._buckets) / (self._gamma + 1)
+
+
+@dataclass
+class LatencySummary:
+    """How long transactions took to fill, in seconds."""
+    count: int
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+
+    @classmethod
+    def of(cls, sketch: Optional[DDSketch]) -> Optional['LatencySummary']:
+        if sketch is None or sketch.count == 0:
+            return None
+        return cls(sketch.count, sketch.mean, sketch.quantile(0.5), sketch.quantile(0.95), sketch.quantile(0.99))
+
+
+class FillLatencies:
+    """
+    Sketches of how long each vendor and each bin takes to fill a transaction, from sale to fill.
+    Loaded once from the filled transactions and then updated as transactions are filled, so percentiles are
+    answered from memory without sorting a vendor's history.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self._vendors: dict[int, DDSketch] = {}
+        self._bins: dict[str, DDSketch] = {}
+
+    def clear(self):
+        self._vendors.clear()
+        self._bins.clear()
+
+    def add(self, vendor_id: int, bin_id: str, time_of_sale: Union[datetime, str], filled_at: Union[datetime, str]):
+        """Counts a filled transaction. Timestamps may be given as stored by the database."""
+        if isinstance(time_of_sale, str):
+            time_of_sale = datetime.fromisoformat(time_of_sale)
+        if isinstance(filled_at, str):
+            filled_at = datetime.fromisoformat(filled_at)
+        seconds = max((filled_at - time_of_sale).total_seconds(), 0.0)
+        for sketches, key in ((self._vendors, vendor_id), (self._bins, bin_id)):
+            if key not in sketches:
+                sketches[key] = DDSketch(self.relative_accuracy)
+            sketches[key].add(seconds)
+
+    def vendor(self, vendor_id: int) -> Optional[LatencySummary]:
+        return LatencySummary.of(self._vendors.get(vendor_id))
+
+    def bin(self, bin_id: str) -> Optional[LatencySummary]:
+        return LatencySummary.of(self._bins.get(bin_id))
+
+    def load(self):
+        """Replaces the sketches with ones built from every filled transaction in the database. Requires an app context."""
+        self.clear()
+        rows = database.get_read_db().execute(
+            """
+            SELECT bins.vendor_id, transactions.bin_id, transactions.time_of_sale, transactions.transaction_filled_at
+            FROM transactions INNER JOIN bins ON transactions.bin_id = bins.bin_id
+            WHERE transactions.transaction_filled AND transactions.transaction_filled_at IS NOT NULL
+            """
+        )
+        for row in rows:
+            self.add(*row)
@@ -1,8 +1,16 @@
-import functools
-from collections import deque
-from dataclasses import dataclass
+import heapq
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Collection, Iterable, Optional
+
+import numpy as np
 
 import database
+from cache import CacheInfo, LRUCache
+from models import routing
+from models.orders import Transaction
+from models.routing import AllPairsPaths, CompactGraph, ShortestPathTree
 
 
 class MarketMap:
@@ -36,126 +44,573 @@ class MarketMap:
         def __contains__(self, item) -> bool:
             return item == self.vendor_bin_id or item == self.neighbor_bin_id
 
+    @dataclass
+    class PickRoute:
+        """
+        The order in which to visit the stalls of an order along with the full walk between them.
+        Stalls that are not on the map or cannot be reached from the rest of the route are listed in unreachable.
+        """
+        stops: list['MarketMap.VendorStall']
+        path: list['MarketMap.VendorStall']
+        distance: float
+        unreachable: list['MarketMap.VendorStall'] = field(default_factory=list)
+
+    @dataclass
+    class PickWave:
+        """A batch of orders picked together in a single walk that visits each of their stalls once."""
+        order_ids: list[str]
+        route: 'MarketMap.PickRoute'
+        quantities: dict['MarketMap.VendorStall', float]
+        """The units to pick at each stop, summed across every order of the wave."""
+
+    @dataclass(frozen=True)
+    class _Snapshot:
+        """A version of the map's routing state that is never changed, for routing without holding the map's lock."""
+        graph: CompactGraph
+        stall_index: dict['MarketMap.VendorStall', int]
+        indexed_stalls: list[Optional['MarketMap.VendorStall']]
+        all_pairs: Optional[AllPairsPaths]
+
     _vendor_stalls: dict[str, VendorStall] = {}
     """
     Values contained in this set are managed by the Vendor class as bins are created and removed.
     Ensures read-only access so bins are not modified in an unauthorized context.
     """
 
-    def __init__(self, from_database: bool = True):
-        self._market_map: dict[MarketMap.VendorStall, set[MarketMap.VendorStall]] = {}
-        self._distance_map: dict[frozenset[MarketMap.VendorStall, MarketMap.VendorStall], float] = {}
+    PATH_CACHE_SIZE = 128
+    """The default number of starting stalls whose shortest path trees are kept per map."""
+
+    WAVE_ORDER_LIMIT = 20
+    """The default largest number of orders picked in one wave."""
+
+    WAVE_STOP_LIMIT = 12
+    """The default largest number of stops in one wave, unless a single order has more."""
+
+    def __init__(self, from_database: bool = True, path_cache_size: int = PATH_CACHE_SIZE):
+        self._market_map: dict[MarketMap.VendorStall, dict[MarketMap.VendorStall, float]] = {}
+        """Each stall mapped to its neighbors and the distance to each neighbor. Used for editing the map."""
+        self._stall_index: dict[MarketMap.VendorStall, int] = {}
+        self._indexed_stalls: list[Optional[MarketMap.VendorStall]] = []
+        """Stalls by their index in the compact graph. Removed stalls leave a None hole until the map is re-indexed."""
+        self._compact_graph: Optional[CompactGraph] = None
+        """Routing snapshot of the map. Rebuilt on demand after the map has changed."""
+        self._version = 0
+        """Bumped by every change to the graph."""
+        self._path_cache: LRUCache[MarketMap.VendorStall, ShortestPathTree] = LRUCache(path_cache_size)
+        """Shortest path trees by starting stall. Kept up to date in place as the map changes."""
+        self._all_pairs: Optional[AllPairsPaths] = None
+        """Precomputed paths between every pair of stalls. Kept up to date as long as possible."""
+        self._snapshot: Optional[MarketMap._Snapshot] = None
+        """What routing without the lock needs of the current version of the map. Taken on demand."""
+        self._lock = threading.RLock()
+        """
+        Held while reading or changing the map, its cached trees and its indices. Requests share the map across
+        threads, and even reads grow the cached trees. See _take_snapshot for routing that does not hold it.
+        """
         if from_database:
-            for item in database.get_db().execute("""SELECT * FROM market_map"""):
+            for item in database.get_read_db().execute("""SELECT * FROM market_map"""):
                 self.add_edge(MarketMap.MapEdge(*item))
 
     @property
     def edges(self):
-        _edges = set()
-        for stall, neighbors in self._market_map.items():
-            for neighbor in neighbors:
-                _edges.add(frozenset((stall.bin_id, neighbor.bin_id, self._distance_map[frozenset((stall, neighbor))])))
-        return [MarketMap.MapEdge(*edge) for edge in _edges]
+        with self._lock:
+            _edges: dict[frozenset[str], MarketMap.MapEdge] = {}
+            for stall, neighbors in self._market_map.items():
+                for neighbor, distance in neighbors.items():
+                    key = frozenset((stall.bin_id, neighbor.bin_id))
+                    if key not in _edges:
+                        _edges[key] = MarketMap.MapEdge(stall.bin_id, neighbor.bin_id, distance)
+            return list(_edges.values())
 
     @property
     def stalls(self) -> set[VendorStall]:
         """Returns a set containing all the stall nodes in the market map graph."""
-        return set(self._market_map.keys())
+        with self._lock:
+            return set(self._market_map.keys())
+
+    @property
+    def version(self) -> int:
+        """A counter that is bumped every time a stall or edge of the map changes."""
+        return self._version
+
+    def _graph_changed(self):
+        self._version += 1
+        self._compact_graph = None
+        self._snapshot = None
+
+    def _compact(self) -> CompactGraph:
+        """
+        Returns the compact routing snapshot of the current version of the map, building it if the map changed.
+        Stalls are re-indexed first if removed stalls left more holes than there are stalls.
+        """
+        if self._compact_graph is None:
+            if len(self._indexed_stalls) > 2 * len(self._stall_index):
+                self._indexed_stalls = list(self._market_map)
+                self._stall_index = {stall: i for i, stall in enumerate(self._indexed_stalls)}
+                # Every cached path refers to the old indices.
+                self._path_cache.clear()
+                self._all_pairs = None
+            self._compact_graph = CompactGraph(
+                ((self._stall_index[neighbor], distance) for neighbor, distance in self._market_map[stall].items())
+                if stall is not None else ()
+                for stall in self._indexed_stalls
+            )
+        return self._compact_graph
+
+    def _take_snapshot(self) -> _Snapshot:
+        """
+        Returns the snapshot of the current version of the map, taking it if the map changed. Requires the lock.
+        Nothing in a snapshot is ever changed, so routing on one needs no lock while the map changes.
+        """
+        if self._snapshot is None:
+            graph = self._compact()
+            self._snapshot = MarketMap._Snapshot(
+                graph, dict(self._stall_index), list(self._indexed_stalls), self._all_pairs
+            )
+        return self._snapshot
+
+    def _shortest_paths(self, from_stall: VendorStall) -> ShortestPathTree:
+        """
+        Returns the cached shortest path tree rooted at from_stall for the current version of the map.
+        The returned tree is only grown as far as previous queries needed it.
+        """
+        graph = self._compact()
+        paths = self._path_cache.get(from_stall)
+        if paths is None:
+            paths = ShortestPathTree(graph, self._stall_index[from_stall])
+            self._path_cache.put(from_stall, paths)
+        elif paths.graph is not graph:
+            paths.rebase(graph)
+        return paths
+
+    def precompute_all_pairs(self, cache_file: str = None):
+        """
+        Computes the shortest paths between every pair of stalls so that path_to_bin becomes a lookup.
+        cache_file: A .npz file to load the matrices from if they were saved for the same map, and to save them to
+                    otherwise. Lets restarts skip the computation as long as the map has not changed.
+
+        Added stalls and added or shortened edges update the matrices. Removing a stall that other
+        paths pass through, or lengthening an edge, drops them and routing falls back to searching until this
+        is called again.
+        The matrices are computed without holding the map's lock, so routing carries on in the meantime. They are
+        dropped if the map changed before they were done.
+        """
+        with self._lock:
+            graph = self._compact()
+            fingerprint = AllPairsPaths.fingerprint(
+                graph, (s.bin_id if s is not None else '' for s in self._indexed_stalls)
+            )
+            all_pairs = self._all_pairs
+        if cache_file is not None and os.path.exists(cache_file):
+            all_pairs = AllPairsPaths.load(cache_file, fingerprint)
+        if all_pairs is None:
+            all_pairs = AllPairsPaths.compute(graph, fingerprint)
+            if cache_file is not None:
+                all_pairs.save(cache_file)
+        with self._lock:
+            if self._compact_graph is graph:
+                self._all_pairs = all_pairs
+                self._snapshot = None
+
+    @property
+    def has_all_pairs(self) -> bool:
+        """True if path_to_bin is currently served from precomputed paths."""
+        return self._all_pairs is not None
+
+    def path_cache_info(self) -> CacheInfo:
+        """Returns the hit and miss counters of the shortest path cache."""
+        with self._lock:
+            return self._path_cache.cache_info()
 
-    @functools.cache
     def calc_paths(self, from_stall: VendorStall) -> tuple[dict[VendorStall, float], dict[VendorStall, VendorStall]]:
         """
-        An implementation of Dijkstra's algorithm made to work with the MarketMap graph implementation.
-        Uses functools.cache to hopefully speed up results of the algorithm if a certain starting vendor stall
-        is hit frequently.
-        """
-        stalls = self.stalls
-        distance_to_stall: dict[MarketMap.VendorStall, float] = {stall: float('Inf') for stall in stalls}
-        shortest_neighbor: dict[MarketMap.VendorStall, MarketMap.VendorStall] = {stall: None for stall in stalls}
-        distance_to_stall[from_stall] = 0.0
-        while len(stalls) > 0:
-            min_stall = min(stalls, key=distance_to_stall.get)
-            stalls.remove(min_stall)
-            for neighbor in self._market_map[min_stall]:
-                if neighbor not in stalls:
-                    continue
-                new_distance = distance_to_stall[min_stall] + self._distance_map[frozenset((neighbor, min_stall))]
-                if new_distance < distance_to_stall[neighbor]:
-                    distance_to_stall[neighbor] = new_distance
-                    shortest_neighbor[neighbor] = min_stall
-        return distance_to_stall, shortest_neighbor
+        Computes the shortest distance and previous stall on the shortest path from a stall to every stall
+        reachable from it. Stalls that cannot be reached from from_stall are not included.
+        """
+        with self._lock:
+            if from_stall not in self._market_map:
+                return {}, {}
+            paths = self._shortest_paths(from_stall)
+            paths.settle_all()
+            distance_to_stall: dict[MarketMap.VendorStall, float] = {}
+            shortest_neighbor: dict[MarketMap.VendorStall, Optional[MarketMap.VendorStall]] = {}
+            for i, distance in enumerate(paths.distance):
+                if distance != float('inf'):
+                    stall = self._indexed_stalls[i]
+                    distance_to_stall[stall] = distance
+                    previous = paths.previous[i]
+                    shortest_neighbor[stall] = self._indexed_stalls[previous] if previous != -1 else None
+            return distance_to_stall, shortest_neighbor
 
     def path_to_bin(self, from_stall: VendorStall, to_stall: VendorStall) -> tuple[list[VendorStall], float]:
         """
         Returns a path from a stall to another stall and the total distance between the two stalls.
         Returns an empty list and float('inf') if there is no path between the stalls.
+        Served from precomputed paths if precompute_all_pairs() was called and they are still up to date.
+        Otherwise the search stops as soon as to_stall is settled.
         """
-        if not from_stall.exists() or not to_stall.exists():
-            return [], float('inf')
-
-        distance_to_stall, shortest_neighbor = self.calc_paths(from_stall)
-        path_to = deque()
-        current_stall = to_stall
-        if shortest_neighbor[current_stall] is not None or current_stall == from_stall:
-            while current_stall is not None:
-                path_to.appendleft(current_stall)
-                current_stall = shortest_neighbor[current_stall]
-        total_dist = distance_to_stall[to_stall]
-        if total_dist == float('inf'):
-            path_to.clear()
-        return list(path_to), total_dist
+        with self._lock:
+            if not from_stall.exists() or not to_stall.exists():
+                return [], float('inf')
+            if from_stall not in self._market_map or to_stall not in self._market_map:
+                return [], float('inf')
+
+            if self._all_pairs is not None:
+                source, target = self._stall_index[from_stall], self._stall_index[to_stall]
+                total_dist = float(self._all_pairs.distance[source, target])
+                return [self._indexed_stalls[i] for i in self._all_pairs.path(source, target)], total_dist
+
+            paths = self._shortest_paths(from_stall)
+            target = self._stall_index[to_stall]
+            total_dist = paths.settle(target)
+            if total_dist == float('inf'):
+                return [], total_dist
+            return [self._indexed_stalls[i] for i in paths.path_to(target)], total_dist
+
+    def distances_from(self, from_stall: VendorStall, to_stalls: Iterable[VendorStall]) -> dict[VendorStall, float]:
+        """
+        Returns the shortest distance from a stall to each of to_stalls.
+        Stalls that are not on the map or cannot be reached get float('inf').
+        """
+        with self._lock:
+            if from_stall not in self._market_map:
+                return {stall: float('inf') for stall in to_stalls}
+            if self._all_pairs is not None:
+                source = self._stall_index[from_stall]
+                return {
+                    stall: float(self._all_pairs.distance[source, self._stall_index[stall]])
+                    if stall in self._stall_index else float('inf')
+                    for stall in to_stalls
+                }
+            paths = self._shortest_paths(from_stall)
+            return {
+                stall: paths.settle(self._stall_index[stall]) if stall in self._stall_index else float('inf')
+                for stall in to_stalls
+            }
+
+    def nearest(self, from_stall: VendorStall, wanted: Collection[VendorStall], k: int = 1) -> list[tuple[VendorStall, float]]:
+        """
+        Returns up to k of the wanted stalls closest to from_stall along with the distance to each, closest first.
+        Runs a single Dijkstra search from from_stall that stops as soon as k wanted stalls have been reached,
+        instead of finding a path to every wanted stall.
+        """
+        with self._lock:
+            if from_stall not in self._market_map or k <= 0 or len(wanted) == 0:
+                return []
+            if self._all_pairs is not None:
+                distances = self._all_pairs.distance[self._stall_index[from_stall]]
+                reachable = [
+                    (stall, float(distances[self._stall_index[stall]]))
+                    for stall in wanted
+                    if stall in self._stall_index and distances[self._stall_index[stall]] != float('inf')
+                ]
+                return heapq.nsmallest(k, reachable, key=lambda found: found[1])
+
+            found: list[tuple[MarketMap.VendorStall, float]] = []
+            paths = ShortestPathTree(self._compact(), self._stall_index[from_stall])
+            for node in paths.expand():
+                stall = self._indexed_stalls[node]
+                if stall in wanted:
+                    found.append((stall, paths.distance[node]))
+                    if len(found) == k:
+                        break
+            return found
+
+    def plan_pick_route(self, transactions: Iterable[Transaction], from_stall: VendorStall = None) -> PickRoute:
+        """
+        Plans a short walk that visits the stall of every bin in an order's transactions once.
+        from_stall: Where the walk starts, e.g. the picker's current stall. If None, the route may start at any stop.
+
+        One distance matrix is computed per order from the shortest path trees of each stop and reused for both
+        ordering the stops and assembling the full path. See routing.plan_route for how the stops are ordered.
+        """
+        with self._lock:
+            stops: list[MarketMap.VendorStall] = []
+            unreachable: list[MarketMap.VendorStall] = []
+            for transaction in transactions:
+                stall = MarketMap._vendor_stalls.get(transaction.bin_id)
+                if stall is None or stall in stops or stall in unreachable:
+                    continue
+                (stops if stall in self._market_map else unreachable).append(stall)
+            return self._route(self._take_snapshot(), stops, unreachable, from_stall, self._tree_paths)
+
+    def _route(
+            self,
+            snapshot: _Snapshot,
+            stops: list[VendorStall],
+            unreachable: list[VendorStall],
+            from_stall: Optional[VendorStall],
+            paths_between: Callable[[list[VendorStall]], tuple[np.ndarray, Callable[[int, int], list[int]]]]
+    ) -> PickRoute:
+        """
+        Plans the walk over stops, which must all be on the map. See plan_pick_route.
+        snapshot: The version of the map to route on.
+        paths_between: Returns the distances between every pair of a list of stalls, and a function returning the graph
+            nodes walked from one of them to another, by their positions in the list. Unless all pairs are precomputed.
+        """
+        anchor = from_stall if from_stall is not None and from_stall in snapshot.stall_index else None
+        if anchor is None and from_stall is None and len(stops) > 0:
+            anchor = stops[0]
+        if anchor is None:
+            return MarketMap.PickRoute([], [], float('inf') if stops else 0.0, unreachable + stops)
+
+        fixed_start = from_stall is not None
+        points = [anchor] + [stall for stall in stops if stall != anchor]
+        if snapshot.all_pairs is not None:
+            nodes = [snapshot.stall_index[point] for point in points]
+            distance = snapshot.all_pairs.distance[np.ix_(nodes, nodes)]
+            all_pairs = snapshot.all_pairs
+            path_between = lambda a, b: all_pairs.path(nodes[a], nodes[b])
+        else:
+            distance, path_between = paths_between(points)
+        # Stops in another part of the map than the start of the route can never be walked to.
+        walkable: list[int] = []
+        for i, point in enumerate(points):
+            if distance[0, i] < float('inf'):
+                walkable.append(i)
+            else:
+                stops.remove(point)
+                unreachable.append(point)
+        matrix = distance[np.ix_(walkable, walkable)].tolist()
+
+        order = routing.plan_route(matrix, fixed_start=fixed_start)
+        path: list[MarketMap.VendorStall] = [points[walkable[order[0]]]]
+        for a, b in zip(order, order[1:]):
+            path.extend(snapshot.indexed_stalls[i] for i in path_between(walkable[a], walkable[b])[1:])
+        stop_set = set(stops)
+        return MarketMap.PickRoute(
+            [points[walkable[i]] for i in order if points[walkable[i]] in stop_set],
+            path,
+            routing.route_length(order, matrix),
+            unreachable
+        )
+
+    def _tree_paths(self, stalls: list[VendorStall]) -> tuple[np.ndarray, Callable[[int, int], list[int]]]:
+        """The shortest distances and paths between stalls, from their cached shortest path trees. See _route."""
+        trees = [self._shortest_paths(stall) for stall in stalls]
+        nodes = [self._stall_index[stall] for stall in stalls]
+        distance = np.zeros((len(stalls), len(stalls)))
+        for i, tree in enumerate(trees):
+            for j in range(i + 1, len(stalls)):
+                distance[i, j] = distance[j, i] = tree.settle(nodes[j])
+        return distance, lambda a, b: trees[a].path_to(nodes[b])
+
+    def plan_pick_waves(
+            self,
+            transactions: Iterable[Transaction],
+            from_stall: VendorStall = None,
+            order_limit: int = WAVE_ORDER_LIMIT,
+            stop_limit: int = WAVE_STOP_LIMIT
+    ) -> list[PickWave]:
+        """
+        Batches the orders of many transactions into waves of nearby orders and plans one pick route per wave,
+        so a picker walks the market once per wave instead of once per order.
+        transactions: The transactions to pick, oldest first. Orders are never split across waves.
+        from_stall: Where every wave starts. See plan_pick_route.
+        order_limit, stop_limit: Bound the orders and distinct stops of each wave.
+
+        Each wave is seeded with the oldest order not yet in a wave, then grows by repeatedly taking the order whose
+        stops are closest to the stops already in the wave. Stops shared with the wave cost nothing, so orders for the
+        same stalls are picked together. Orders that can not be walked to from the wave start a wave of their own.
+        The distance from each stall to the closest stop of the wave comes from a single search outwards from the
+        wave's stops, which is only grown until the best order to take is certain, and the wave's costs are updated with
+        vector operations. The route of the wave is planned on the same search, grown over the whole map, instead of a
+        shortest path tree from every stop. See routing.RegionPaths. Planning stays fast for hundreds of orders across
+        a whole market. Waves are planned on a snapshot of the map without holding its lock, so the map can change
+        and other requests route as usual in the meantime.
+        """
+        with self._lock:
+            snapshot = self._take_snapshot()
+        orders: dict[str, list[Transaction]] = {}
+        stall_numbers: dict[MarketMap.VendorStall, int] = {}
+        for transaction in transactions:
+            stall = MarketMap._vendor_stalls.get(transaction.bin_id)
+            if stall is None:
+                continue
+            orders.setdefault(transaction.order_id, []).append(transaction)
+            stall_numbers.setdefault(stall, len(stall_numbers))
+        if len(orders) == 0:
+            return []
+
+        order_ids = list(orders)
+        # The graph node of every stall, or -1 for stalls that are not on the map.
+        nodes = np.array([snapshot.stall_index.get(stall, -1) for stall in stall_numbers], dtype=np.intp)
+        on_map = nodes >= 0
+        # Every stop of every order, as the order it belongs to and the number of its stall.
+        stop_orders = np.array([o for o, order_id in enumerate(order_ids) for _ in orders[order_id]], dtype=np.intp)
+        stop_stalls = np.array([
+            stall_numbers[MarketMap._vendor_stalls[transaction.bin_id]]
+            for order_id in order_ids for transaction in orders[order_id]
+        ], dtype=np.intp)
+
+        waves: list[MarketMap.PickWave] = []
+        waiting = np.ones(len(order_ids), dtype=bool)
+        for seed in range(len(order_ids)):
+            if not waiting[seed]:
+                continue
+            wave = [seed]
+            waiting[seed] = False
+            in_wave = np.zeros(len(nodes), dtype=bool)
+            nearest = routing.NearestSourceSearch(snapshot.graph)
+            added = stop_stalls[stop_orders == seed]
+            while True:
+                in_wave[added] = True
+                for node in nodes[added[on_map[added]]]:
+                    nearest.add_source(node)
+                if len(wave) == order_limit:
+                    break
+                # The distance from each stall to the closest stop of the wave, or a lower bound on it until the search
+                # has grown far enough.
+                closest, exact = np.full(len(nodes), float('inf')), np.ones(len(nodes), dtype=bool)
+                if snapshot.all_pairs is not None:
+                    closest[on_map] = snapshot.all_pairs.distance[np.ix_(nodes[in_wave & on_map], nodes[on_map])].min(
+                        axis=0, initial=float('inf')
+                    )
+                else:
+                    closest[on_map], exact[on_map] = nearest.distances_to(nodes[on_map])
+                closest[in_wave], exact[in_wave] = 0.0, True
+                cost = np.bincount(stop_orders, weights=closest[stop_stalls], minlength=len(order_ids))
+                new_stops = np.bincount(stop_orders, weights=~in_wave[stop_stalls], minlength=len(order_ids))
+                candidates = waiting & (new_stops + in_wave.sum() <= stop_limit) & (cost < float('inf'))
+                if not candidates.any():
+                    break
+                best = int(np.argmin(np.where(candidates, cost, float('inf'))))
+                added = stop_stalls[stop_orders == best]
+                if not exact[added].all():
+                    # No order costs less than its lower bound, so once the search is past the lowest bound the best
+                    # order is known. The radius at least doubles so that the search takes few steps.
+                    nearest.search_within(max(cost[best], 2.0 * nearest.bound))
+                    added = added[:0]
+                    continue
+                wave.append(best)
+                waiting[best] = False
+
+            quantities: dict[MarketMap.VendorStall, float] = {}
+            for o in wave:
+                for transaction in orders[order_ids[o]]:
+                    stall = MarketMap._vendor_stalls[transaction.bin_id]
+                    quantities[stall] = quantities.get(stall, 0.0) + transaction.units_purchased
+            route = self._route(
+                snapshot,
+                [stall for stall in quantities if stall in snapshot.stall_index],
+                [stall for stall in quantities if stall not in snapshot.stall_index],
+                from_stall,
+                lambda stalls: self._region_paths(snapshot, nearest, stalls)
+            )
+            waves.append(MarketMap.PickWave([order_ids[o] for o in wave], route, quantities))
+        return waves
+
+    def _region_paths(
+            self,
+            snapshot: _Snapshot,
+            search: routing.NearestSourceSearch,
+            stalls: list[VendorStall]
+    ) -> tuple[np.ndarray, Callable[[int, int], list[int]]]:
+        """
+        Walks between stalls through the regions of a search from all of them, without a shortest path tree from
+        each stall. search may have been grown from some of the stalls already. See _route.
+        """
+        nodes = [snapshot.stall_index[stall] for stall in stalls]
+        for node in nodes:
+            search.add_source(node)
+        search.search_within(float('inf'))
+        paths = routing.RegionPaths(search, nodes)
+        return paths.distance, paths.path
 
     def add_stall(self, stall: VendorStall) -> bool:
         """
         Add a stand-alone stall to the map. Can be connected with another stall via add_edge(...).
         Returns True if the stall was added to the map. Returns False if the stall is already in the map.
         """
-        if stall in self._market_map:
-            return False
-        self._market_map[stall] = set()
-        return True
+        with self._lock:
+            if stall in self._market_map:
+                return False
+            self._market_map[stall] = {}
+            self._stall_index[stall] = len(self._indexed_stalls)
+            self._indexed_stalls.append(stall)
+            self._graph_changed()
+            # Cached trees pick up the new stall the next time they are used.
+            if self._all_pairs is not None:
+                self._all_pairs = self._all_pairs.grow(len(self._indexed_stalls))
+            return True
 
     def remove_stall(self, stall: VendorStall) -> bool:
         """
         Removes a stall and all of its connecting edges from the market map graph.
         Returns True if the stall was removed from the map. Returns false if the stall is not in the map.
+        Only cached paths that went through the stall are dropped.
         """
-        if stall not in self._market_map:
-            return False
-        # Remove all connections that reference stall since the graph is undirected.
-        for neighbor in self._market_map[stall]:
-            self._market_map[neighbor].remove(stall)
-        self._market_map.pop(stall)
-        return True
+        with self._lock:
+            if stall not in self._market_map:
+                return False
+            index = self._stall_index[stall]
+            for from_stall, paths in self._path_cache.items():
+                if not paths.node_removed(index):
+                    self._path_cache.pop(from_stall)
+            if self._all_pairs is not None:
+                self._all_pairs = self._all_pairs.node_removed(index)
+            self._stall_index.pop(stall)
+            # Remove all connections that reference stall since the graph is undirected.
+            for neighbor in self._market_map[stall]:
+                self._market_map[neighbor].pop(stall)
+            self._market_map.pop(stall)
+            self._indexed_stalls[index] = None
+            self._graph_changed()
+            return True
 
     def add_edge(self, edge: MapEdge) -> bool:
         """
-        Adds a connecting edge to the market map graph.
+        Adds a connecting edge to the market map graph, or changes the distance of an existing one.
         Returns True if the edge was added to the map.
         Returns False if the distance between the stalls is less than 0, either of the stalls were never created by an
         endpoint, or if the edge refers to a stall that connects to itself.
+
+        A new or shorter edge updates cached paths in place, only visiting the stalls it brings closer.
+        A longer edge only drops the cached paths that used it.
         """
-        vendor_stall = MarketMap._vendor_stalls[edge.vendor_bin_id]
-        neighbor_stall = MarketMap._vendor_stalls[edge.neighbor_bin_id]
-        if edge.distance < 0 or not vendor_stall.exists() or not neighbor_stall.exists() or edge.self_connecting:
-            return False
-        if vendor_stall not in self._market_map:
-            self._market_map[vendor_stall] = set()
-        if neighbor_stall not in self._market_map:
-            self._market_map[neighbor_stall] = set()
-        self._market_map[vendor_stall].add(neighbor_stall)
-        self._market_map[neighbor_stall].add(vendor_stall)
-        self._distance_map[frozenset((vendor_stall, neighbor_stall))] = edge.distance
-        return True
+        with self._lock:
+            vendor_stall = MarketMap._vendor_stalls[edge.vendor_bin_id]
+            neighbor_stall = MarketMap._vendor_stalls[edge.neighbor_bin_id]
+            if edge.distance < 0 or not vendor_stall.exists() or not neighbor_stall.exists() or edge.self_connecting:
+                return False
+            self.add_stall(vendor_stall)
+            self.add_stall(neighbor_stall)
+            previous_distance = self._market_map[vendor_stall].get(neighbor_stall)
+            if previous_distance == edge.distance:
+                return True
+            self._market_map[vendor_stall][neighbor_stall] = edge.distance
+            self._market_map[neighbor_stall][vendor_stall] = edge.distance
+            self._graph_changed()
+            if len(self._path_cache) == 0 and self._all_pairs is None:
+                return True
+
+            graph = self._compact()
+            a, b = self._stall_index[vendor_stall], self._stall_index[neighbor_stall]
+            shortened = previous_distance is None or edge.distance < previous_distance
+            for from_stall, paths in self._path_cache.items():
+                paths.rebase(graph)
+                if not (paths.edge_shortened(a, b, edge.distance) if shortened else not paths.uses_edge(a, b)):
+                    self._path_cache.pop(from_stall)
+            if self._all_pairs is not None:
+                if shortened:
+                    self._all_pairs = self._all_pairs.edge_shortened(a, b, edge.distance)
+                else:
+                    self._all_pairs = None
+            return True
 
     @staticmethod
     def cache_stalls_from_database():
         """Refreshes _vendor_stalls with the current state of the database."""
         MarketMap._vendor_stalls.clear()
-        for item in database.get_db().execute("""SELECT bin_id, vendor_id FROM bins"""):
+        for item in database.get_read_db().execute("""SELECT bin_id, vendor_id FROM bins"""):
             bin_id = item['bin_id']
             MarketMap._vendor_stalls[bin_id] = MarketMap.VendorStall(item['vendor_id'], bin_id)
 
+    @staticmethod
+    def stall_of(bin_id: str) -> Optional[VendorStall]:
+        """Returns the stall of a bin, or None if no such bin exists."""
+        return MarketMap._vendor_stalls.get(bin_id)
+
     @staticmethod
     def cache_stall(bin_id: str, vendor_id: int):
         """Puts a vendor stall in the cache of vendor stall id pairs."""
@@ -1,10 +1,15 @@
 from dataclasses import dataclass, field, astuple
-from datetime import datetime
+from datetime import datetime, timedelta
+from itertools import groupby
 from typing import Optional
 
+import click
+from flask.cli import with_appcontext
 from pydantic import BaseModel, Field
 
 import database
+import models
+from errors import InsufficientStockError
 from models.bin import Bin
 
 
@@ -26,6 +31,45 @@ class CustomerCart(BaseModel):
     def cart_total(self):
         return sum(cart_item.item_bin.unit_price * cart_item.quantity for cart_item in self.cart_items.values())
 
+    def compact(self) -> dict:
+        """
+        The cart as it is kept in the session. Only the quantity of each bin is stored, keyed by bin id,
+        so the session stays small however many items the cart holds.
+        """
+        return {'customer_id': self.customer_id, 'items': {bin_id: item.quantity for bin_id, item in self.cart_items.items()}}
+
+    @staticmethod
+    def upgrade_compact(saved: dict) -> Optional[dict]:
+        """
+        Returns a cart saved in the session in the format of compact(). Carts saved before compact() existed held
+        the whole cart, with every bin embedded, and are converted. Returns None if the cart can not be read.
+        """
+        if 'items' in saved:
+            return saved
+        try:
+            return {
+                'customer_id': saved['customer_id'],
+                'items': {bin_id: float(item['quantity']) for bin_id, item in saved.get('cart_items', {}).items()}
+            }
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    @classmethod
+    def from_compact(cls, compact: dict) -> 'CustomerCart':
+        """
+        Rebuilds a cart stored with compact(), loading every bin in it with one query.
+        Items whose bin no longer exists are dropped.
+        """
+        bins = models.load_bins(compact['items'].keys())
+        # The bins come straight from the database, so construct() skips re-validating them.
+        return cls.construct(
+            customer_id=compact['customer_id'],
+            cart_items={
+                bin_id: CartItem.construct(item_bin=bins[bin_id], quantity=quantity)
+                for bin_id, quantity in compact['items'].items() if bin_id in bins
+            }
+        )
+
 
 @dataclass
 class Customer:
@@ -62,7 +106,166 @@ class Transaction:
     transaction_filled: bool = field(default=False)
     time_of_sale: datetime = field(default_factory=datetime.now, compare=False)
     transaction_filled_at: datetime = field(default=None, compare=False)
+    unit_price: Optional[float] = field(default=None, compare=False)
+    """The price the units were sold at. Recorded from the bin when the transaction is inserted without one."""
+    price_code: Optional[str] = field(default=None, compare=False)
+    stock_reserved: bool = field(default=False, compare=False)
+    """True if the units were taken out of the bin's stock when the transaction was placed."""
 
     def tuple(self):
         """Convert to tuple so this can be inserted into the database."""
         return astuple(self)
+
+
+def checkout(cart: CustomerCart, customer: Customer) -> list[Order]:
+    """
+    Places one order per vendor for the items in a customer's cart and takes the purchased units out of stock.
+    The whole cart is written in one transaction with a fixed number of statements regardless of its size.
+    If any bin does not hold enough stock, nothing is written and InsufficientStockError is raised.
+    Returns the placed orders.
+    """
+    vendor_orders: dict[int, Order] = {}
+    transactions = []
+    for cart_item in cart.cart_items.values():
+        order = vendor_orders.setdefault(cart_item.item_bin.vendor_id, Order(customer_id=customer.customer_id))
+        transactions.append(Transaction(
+            bin_id=cart_item.item_bin.bin_id, order_id=order.order_id, units_purchased=cart_item.quantity, stock_reserved=True
+        ))
+    orders = list(vendor_orders.values())
+
+    # The writer takes the write lock up front, so stock can not change between reserving it and placing the orders.
+    with database.writer() as db:
+        reserved = db.executemany(
+            """UPDATE bins SET stock = stock - ? WHERE bin_id = ? AND stock >= ?""",
+            ((t.units_purchased, t.bin_id, t.units_purchased) for t in transactions)
+        ).rowcount
+        if reserved == len(transactions):
+            db.execute(
+                """INSERT OR IGNORE INTO customers(customer_id, name, email, newsletter_subscription) VALUES (?, ?, ?, ?)""",
+                customer.tuple()
+            )
+            db.executemany(
+                """INSERT INTO orders(customer_id, order_id, order_filled, order_filled_at) VALUES (?, ?, ?, ?)""",
+                (order.tuple() for order in orders)
+            )
+            db.executemany(
+                """
+                INSERT INTO transactions(
+                    order_id, bin_id, units_purchased, transaction_filled, time_of_sale, transaction_filled_at, unit_price, price_code,
+                    stock_reserved
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (transaction.tuple() for transaction in transactions)
+            )
+        else:
+            db.rollback()
+
+    bin_ids = [t.bin_id for t in transactions]
+    stock = {
+        _bin.bin_id: _bin.stock for _bin in (
+            models.bin_changed(data) for data in database.get_db().execute(
+                f"""SELECT * FROM bins WHERE bin_id IN ({', '.join('?' * len(bin_ids))})""", bin_ids
+            )
+        )
+    }
+    if reserved != len(transactions):
+        raise InsufficientStockError({
+            t.bin_id: stock.get(t.bin_id, 0.0) for t in transactions if stock.get(t.bin_id, 0.0) < t.units_purchased
+        })
+    return orders
+
+
+def pending_transactions(vendor_id: Optional[int] = None) -> list[Transaction]:
+    """
+    Returns the unfilled transactions of the whole market, or only those for the bins of vendor_id if given,
+    oldest sale first. Read through the pending_transactions index, so filled sales are never read.
+    """
+    columns = """transactions.order_id, transactions.bin_id, transactions.units_purchased,
+                 transactions.transaction_filled, transactions.time_of_sale, transactions.transaction_filled_at"""
+    if vendor_id is None:
+        rows = database.get_read_db().execute(
+            f"""SELECT {columns} FROM transactions WHERE NOT transaction_filled
+                ORDER BY transactions.time_of_sale, transactions.order_id"""
+        )
+    else:
+        rows = database.get_read_db().execute(
+            f"""SELECT {columns} FROM bins INNER JOIN transactions ON transactions.bin_id = bins.bin_id
+                WHERE bins.vendor_id = ? AND NOT transactions.transaction_filled
+                ORDER BY transactions.time_of_sale, transactions.order_id""",
+            (vendor_id,)
+        )
+    return [Transaction(*row) for row in rows]
+
+
+MERGE_WINDOW = timedelta(seconds=1)
+"""How long after the first sale of a split cart its other orders were placed at most."""
+
+
+def merge_orders() -> int:
+    """
+    Merges the orders placed before checkout grouped carts by vendor, which held a single transaction each.
+    Orders of the same customer and vendor sold within MERGE_WINDOW of the first of them are merged into that order.
+    Orders that would end up with the same bin twice are left alone.
+    Returns the number of orders merged away.
+    """
+    merged = []
+    filled = []
+    # Read under the write lock, so a transaction filled meanwhile is not written back as unfilled.
+    with database.writer() as db:
+        rows = db.execute(
+            """
+            SELECT orders.order_id, orders.customer_id, orders.order_filled, orders.order_filled_at,
+                   MIN(bins.vendor_id) AS vendor_id, MIN(transactions.time_of_sale) AS sold_at,
+                   group_concat(transactions.bin_id) AS bin_ids
+            FROM orders
+                INNER JOIN transactions ON orders.order_id = transactions.order_id
+                INNER JOIN bins ON transactions.bin_id = bins.bin_id
+            GROUP BY orders.order_id
+            HAVING COUNT(DISTINCT bins.vendor_id) = 1
+            ORDER BY orders.customer_id, vendor_id, sold_at, orders.order_id
+            """
+        ).fetchall()
+
+        for _, orders in groupby(rows, key=lambda row: (row['customer_id'], row['vendor_id'])):
+            for group in _sold_together(list(orders)):
+                into, *others = group
+                bin_ids = set(into['bin_ids'].split(','))
+                kept = [into]
+                for row in others:
+                    if bin_ids.isdisjoint(row['bin_ids'].split(',')):
+                        bin_ids.update(row['bin_ids'].split(','))
+                        merged.append((into['order_id'], row['order_id']))
+                        kept.append(row)
+                if len(kept) > 1:
+                    order_filled = all(row['order_filled'] for row in kept)
+                    order_filled_at = max(row['order_filled_at'] or '' for row in kept) if order_filled else None
+                    filled.append((order_filled, order_filled_at or None, into['order_id']))
+
+        db.executemany("""UPDATE transactions SET order_id = ? WHERE order_id = ?""", merged)
+        db.executemany("""DELETE FROM orders WHERE order_id = ?""", ((order_id,) for _, order_id in merged))
+        db.executemany("""UPDATE orders SET order_filled = ?, order_filled_at = ? WHERE order_id = ?""", filled)
+    return len(merged)
+
+
+def _sold_together(rows: list) -> list[list]:
+    """
+    Splits the orders of one customer and vendor, oldest sale first, into the groups sold within MERGE_WINDOW
+    of the first order of their group.
+    """
+    groups = []
+    first_sale = None
+    for row in rows:
+        sold_at = datetime.fromisoformat(row['sold_at'])
+        if first_sale is None or sold_at - first_sale >= MERGE_WINDOW:
+            groups.append([])
+            first_sale = sold_at
+        groups[-1].append(row)
+    return groups
+
+
+@click.command('merge-orders')
+@with_appcontext
+def merge_orders_command():
+    """Merges orders that were split up by item into one order per customer and vendor."""
+    click.echo(f'Merged {merge_orders()} orders.')
@@ -0,0 +1,144 @@
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta
+from typing import Optional
+
+import click
+from flask.cli import with_appcontext
+
+import database
+from models.bin import PriceCode
+
+
+@dataclass
+class BinSales:
+    bin_id: str
+    product_name: Optional[str]
+    """None if the bin has since been removed."""
+    price_code: PriceCode
+    units_sold: float
+    revenue: float
+
+    def __post_init__(self):
+        if not isinstance(self.price_code, PriceCode):
+            self.price_code = PriceCode[self.price_code]
+
+
+@dataclass
+class SalesReport:
+    """The filled sales of a vendor made within [start, end)."""
+    start: datetime
+    end: datetime
+    bins: list[BinSales] = field(default_factory=list)
+
+    @property
+    def units_sold(self) -> float:
+        return sum(bin_sales.units_sold for bin_sales in self.bins)
+
+    @property
+    def revenue(self) -> dict[PriceCode, float]:
+        """Total revenue per currency. No costs are recorded, so this is also the vendor's profit."""
+        revenue: dict[PriceCode, float] = {}
+        for bin_sales in self.bins:
+            revenue[bin_sales.price_code] = revenue.get(bin_sales.price_code, 0.0) + bin_sales.revenue
+        return revenue
+
+
+def _hour(moment: datetime) -> str:
+    """Formats an hour the way sales_hourly stores it."""
+    return moment.strftime('%Y-%m-%d %H:00:00')
+
+
+def sales_report(vendor_id: int, start: datetime, end: datetime) -> SalesReport:
+    """
+    Reports the units sold and revenue of each of a vendor's bins from the transactions filled so far and sold within
+    [start, end).
+    Whole days of the range are read from the daily rollups and whole hours at either end from the hourly rollups.
+    Only the transactions of the partial hours at either end of the range are read from the transactions table.
+    Sales of bins removed since are reported like the rest: the rollups keep whose bins they were, and the
+    transactions of the partial hours are found through the rollups of those hours instead of the bins.
+    """
+    # The range is split into [start, first_hour) [first_hour, first_day) [first_day, last_day) [last_day, last_hour)
+    # and [last_hour, end). Parts the range is too short to hold are left empty.
+    first_hour = start.replace(minute=0, second=0, microsecond=0)
+    if first_hour < start:
+        first_hour += timedelta(hours=1)
+    last_hour = end.replace(minute=0, second=0, microsecond=0)
+    if first_hour >= last_hour:
+        first_hour = last_hour = end
+    first_day = datetime.combine(first_hour.date(), time())
+    if first_day < first_hour:
+        first_day += timedelta(days=1)
+    last_day = datetime.combine(last_hour.date(), time())
+    if first_day >= last_day:
+        first_day = last_day = last_hour
+
+    rows = database.get_read_db().execute(
+        """
+        SELECT sales.bin_id, bins.product_name, sales.price_code, SUM(sales.units_sold), SUM(sales.revenue) FROM (
+            SELECT bin_id, price_code, units_sold, revenue FROM sales_daily
+            WHERE vendor_id = ? AND day >= ? AND day < ?
+            UNION ALL
+            SELECT bin_id, price_code, units_sold, revenue FROM sales_hourly
+            WHERE vendor_id = ? AND (hour >= ? AND hour < ? OR hour >= ? AND hour < ?)
+            UNION ALL
+            SELECT transactions.bin_id, transactions.price_code, transactions.units_purchased,
+                   transactions.units_purchased * transactions.unit_price
+            FROM sales_hourly INNER JOIN transactions
+                ON transactions.bin_id = sales_hourly.bin_id AND transactions.price_code = sales_hourly.price_code
+                    AND strftime('%Y-%m-%d %H:00:00', transactions.time_of_sale) = sales_hourly.hour
+            WHERE sales_hourly.vendor_id = ? AND sales_hourly.hour IN (?, ?) AND transactions.transaction_filled
+                AND (transactions.time_of_sale >= ? AND transactions.time_of_sale < ?
+                     OR transactions.time_of_sale >= ? AND transactions.time_of_sale < ?)
+        ) AS sales LEFT JOIN bins ON bins.bin_id = sales.bin_id
+        GROUP BY sales.bin_id, sales.price_code
+        HAVING SUM(sales.units_sold) != 0
+        ORDER BY bins.product_name, sales.bin_id
+        """,
+        (
+            vendor_id, first_day.date().isoformat(), last_day.date().isoformat(),
+            vendor_id, _hour(first_hour), _hour(first_day), _hour(last_day), _hour(last_hour),
+            vendor_id, _hour(start), _hour(end), start, first_hour, last_hour, end
+        )
+    )
+    return SalesReport(start, end, [BinSales(*row) for row in rows])
+
+
+def rebuild_sales_rollups():
+    """
+    Recomputes the sales rollups from every filled transaction.
+    Only needed for transactions filled before the rollups existed, the triggers keep them up to date afterwards.
+    Sales of removed bins are kept as long as the rollups already recorded whose bins they were.
+    """
+    with database.writer() as db:
+        db.execute(
+            """CREATE TEMP TABLE bin_vendors AS SELECT bin_id, vendor_id FROM bins UNION SELECT bin_id, vendor_id FROM sales_hourly"""
+        )
+        db.execute("""DELETE FROM sales_hourly""")
+        db.execute("""DELETE FROM sales_daily""")
+        db.execute(
+            """
+            INSERT INTO sales_hourly(vendor_id, bin_id, hour, price_code, units_sold, revenue)
+            SELECT bin_vendors.vendor_id, bin_vendors.bin_id, strftime('%Y-%m-%d %H:00:00', transactions.time_of_sale),
+                   transactions.price_code, SUM(transactions.units_purchased),
+                   SUM(transactions.units_purchased * transactions.unit_price)
+            FROM transactions INNER JOIN temp.bin_vendors ON transactions.bin_id = bin_vendors.bin_id
+            WHERE transactions.transaction_filled
+            GROUP BY 1, 2, 3, 4
+            """
+        )
+        db.execute(
+            """
+            INSERT INTO sales_daily(vendor_id, bin_id, day, price_code, units_sold, revenue)
+            SELECT vendor_id, bin_id, date(hour), price_code, SUM(units_sold), SUM(revenue) FROM sales_hourly
+            GROUP BY 1, 2, 3, 4
+            """
+        )
+        db.execute("""DROP TABLE temp.bin_vendors""")
+
+
+@click.command('rebuild-sales-rollups')
+@with_appcontext
+def rebuild_sales_rollups_command():
+    """Recomputes the hourly and daily sales rollups from the transactions table."""
+    rebuild_sales_rollups()
+    click.echo('Rebuilt sales rollups.')
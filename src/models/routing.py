@@ -0,0 +1,536 @@
+import hashlib
+import heapq
+from array import array
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+INFINITY = float('inf')
+
+
+class CompactGraph:
+    """
+    An immutable compressed sparse row (CSR) snapshot of an undirected, weighted graph.
+
+    Nodes are numbered 0 to node_count - 1. The neighbors of node i are stored in
+    neighbors[offsets[i]:offsets[i + 1]] and the distance to each of them at the same positions in weights.
+    Every undirected edge is stored once in each direction.
+    """
+
+    def __init__(self, adjacency: Iterable[Iterable[tuple[int, float]]]):
+        """adjacency: The (neighbor, weight) pairs of every node, in node order."""
+        self.offsets = array('i', [0])
+        self.neighbors = array('i')
+        self.weights = array('d')
+        for edges in adjacency:
+            for neighbor, weight in edges:
+                self.neighbors.append(neighbor)
+                self.weights.append(weight)
+            self.offsets.append(len(self.neighbors))
+
+    @property
+    def node_count(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        """The memory held by the graph's arrays."""
+        return sum(a.itemsize * len(a) for a in (self.offsets, self.neighbors, self.weights))
+
+
+class ShortestPathTree:
+    """
+    A shortest path tree rooted at a source node of a CompactGraph, grown on demand with Dijkstra's algorithm.
+
+    The frontier is a binary heap using lazy decrease-key: a shorter distance to a node pushes a new heap
+    entry and the outdated entry is skipped once it is popped. Nodes are only settled as far as a query needs,
+    so a search for a nearby target stops early, and a later search for a farther target resumes from the
+    remaining frontier instead of starting over.
+    """
+
+    def __init__(self, graph: CompactGraph, source: int):
+        self.graph = graph
+        self.source = source
+        node_count = graph.node_count
+        self.distance = array('d', [INFINITY]) * node_count
+        self.previous = array('i', [-1]) * node_count
+        self.distance[source] = 0.0
+        self._settled = bytearray(node_count)
+        self._frontier: list[tuple[float, int]] = [(0.0, source)]
+        self._radius = 0.0
+        """The distance of the last settled node. No unsettled node is closer to the source than this."""
+
+    @property
+    def complete(self) -> bool:
+        """True once every node reachable from the source has been settled."""
+        return len(self._frontier) == 0
+
+    def is_settled(self, node: int) -> bool:
+        return self._settled[node] == 1
+
+    def _settle_next(self) -> int:
+        """Settles the closest node on the frontier and relaxes its edges. Returns -1 if the frontier is empty."""
+        frontier, settled, distance = self._frontier, self._settled, self.distance
+        offsets, neighbors, weights = self.graph.offsets, self.graph.neighbors, self.graph.weights
+        while frontier:
+            node_distance, node = heapq.heappop(frontier)
+            if settled[node]:
+                # Outdated entry left behind by a lazy decrease-key.
+                continue
+            settled[node] = 1
+            self._radius = node_distance
+            for k in range(offsets[node], offsets[node + 1]):
+                neighbor = neighbors[k]
+                if settled[neighbor]:
+                    continue
+                new_distance = node_distance + weights[k]
+                if new_distance < distance[neighbor]:
+                    distance[neighbor] = new_distance
+                    self.previous[neighbor] = node
+                    heapq.heappush(frontier, (new_distance, neighbor))
+            return node
+        return -1
+
+    def settle(self, target: int) -> float:
+        """
+        Grows the tree until target is settled or every reachable node has been settled.
+        Returns the shortest distance to target, or float('inf') if target is unreachable.
+        """
+        while not self._settled[target]:
+            if self._settle_next() == -1:
+                return INFINITY
+        return self.distance[target]
+
+    def expand(self) -> Iterator[int]:
+        """
+        Grows the tree one node at a time, yielding each node as it is settled.
+        On a new tree the nodes come closest first, so a bounded search can stop as soon as it has what it needs.
+        """
+        node = self._settle_next()
+        while node != -1:
+            yield node
+            node = self._settle_next()
+
+    def settle_all(self):
+        """Grows the tree until every node reachable from the source has been settled."""
+        while self._settle_next() != -1:
+            pass
+
+    def path_to(self, target: int) -> list[int]:
+        """
+        Returns the nodes on the shortest path from the source to target, both ends included.
+        Returns an empty list if target is unreachable.
+        """
+        if self.settle(target) == INFINITY:
+            return []
+        path = []
+        node = target
+        while node != -1:
+            path.append(node)
+            node = self.previous[node]
+        path.reverse()
+        return path
+
+    def rebase(self, graph: CompactGraph):
+        """Points the tree at a newer snapshot of the same graph, extending it with any nodes added since."""
+        added = graph.node_count - len(self.distance)
+        if added > 0:
+            self.distance.extend(array('d', [INFINITY]) * added)
+            self.previous.extend(array('i', [-1]) * added)
+            self._settled.extend(bytes(added))
+        self.graph = graph
+
+    def uses_edge(self, a: int, b: int) -> bool:
+        """True if the edge between a and b is part of the tree."""
+        return self.previous[b] == a or self.previous[a] == b
+
+    def edge_shortened(self, a: int, b: int, weight: float) -> bool:
+        """
+        Updates the tree after the edge between a and b was added or shortened to weight. The tree must already be
+        rebased onto a graph containing the new weight. Only nodes whose distance shrinks are visited.
+        Returns False if the tree can not be kept consistent and has to be recomputed.
+        """
+        distance, previous, settled = self.distance, self.previous, self._settled
+        if distance[b] + weight < distance[a]:
+            a, b = b, a
+        new_distance = distance[a] + weight
+        if not new_distance < distance[b] or not settled[a]:
+            # An unsettled end relaxes the edge itself once it is settled.
+            return True
+        if not self.complete:
+            if settled[b] or new_distance < self._radius:
+                # Settled distances could now improve through nodes that were never settled.
+                return False
+            distance[b] = new_distance
+            previous[b] = a
+            heapq.heappush(self._frontier, (new_distance, b))
+            return True
+
+        distance[b] = new_distance
+        previous[b] = a
+        offsets, neighbors, weights = self.graph.offsets, self.graph.neighbors, self.graph.weights
+        changed = [(new_distance, b)]
+        while changed:
+            node_distance, node = heapq.heappop(changed)
+            if node_distance > distance[node]:
+                continue
+            settled[node] = 1
+            for k in range(offsets[node], offsets[node + 1]):
+                neighbor = neighbors[k]
+                neighbor_distance = node_distance + weights[k]
+                if neighbor_distance < distance[neighbor]:
+                    distance[neighbor] = neighbor_distance
+                    previous[neighbor] = node
+                    heapq.heappush(changed, (neighbor_distance, neighbor))
+        return True
+
+    def node_removed(self, node: int) -> bool:
+        """
+        Updates the tree after a node and its edges were removed from the graph.
+        Returns False if any other node's shortest path went through the removed node.
+        """
+        if node >= len(self.distance):
+            # Added after the tree was last rebased, so the tree never reached it.
+            return True
+        if node == self.source or node in self.previous:
+            return False
+        self.distance[node] = INFINITY
+        self.previous[node] = -1
+        # Marked settled so that outdated frontier entries for the node are skipped.
+        self._settled[node] = 1
+        return True
+
+
+class NearestSourceSearch:
+    """
+    The distance from every node of a CompactGraph to the closest of a set of source nodes that can grow at any time,
+    searched with Dijkstra's algorithm only as far as queries need.
+
+    Nodes are never marked settled: a node is searched again whenever a shorter distance to it is found, so adding a
+    source only revisits the nodes it brings closer. Every distance up to the bound of the search is exact.
+    Each reached node also records the source it is closest to, which splits the map into one region per source.
+    """
+
+    def __init__(self, graph: CompactGraph):
+        self.graph = graph
+        node_count = graph.node_count
+        self.distance = array('d', [INFINITY]) * node_count
+        """The shortest distance found so far to each node. Exact for every node no farther than bound."""
+        self.source = array('i', [-1]) * node_count
+        """The source each node is closest to, or -1 if the node has not been reached."""
+        self.previous = array('i', [-1]) * node_count
+        self._frontier: list[tuple[float, int]] = []
+
+    def add_source(self, node: int):
+        if self.distance[node] > 0.0:
+            self.distance[node] = 0.0
+            self.source[node] = node
+            self.previous[node] = -1
+            heapq.heappush(self._frontier, (0.0, node))
+
+    @property
+    def bound(self) -> float:
+        """No node is closer to the sources than this unless its distance is already exact. float('inf') once complete."""
+        return self._frontier[0][0] if self._frontier else INFINITY
+
+    def search_within(self, radius: float):
+        """Grows the search until every node within radius of the closest source has its exact distance."""
+        frontier, distance, source, previous = self._frontier, self.distance, self.source, self.previous
+        offsets, neighbors, weights = self.graph.offsets, self.graph.neighbors, self.graph.weights
+        while frontier and frontier[0][0] <= radius:
+            node_distance, node = heapq.heappop(frontier)
+            if node_distance > distance[node]:
+                # Outdated entry left behind by a lazy decrease-key.
+                continue
+            for k in range(offsets[node], offsets[node + 1]):
+                neighbor = neighbors[k]
+                new_distance = node_distance + weights[k]
+                if new_distance < distance[neighbor]:
+                    distance[neighbor] = new_distance
+                    source[neighbor] = source[node]
+                    previous[neighbor] = node
+                    heapq.heappush(frontier, (new_distance, neighbor))
+
+    def distances_to(self, nodes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the distance from each of nodes to the closest source, and whether each distance is exact.
+        Distances that are not exact yet are given as the bound of the search, which they are at least.
+        """
+        distance, bound = np.frombuffer(self.distance, dtype=np.float64)[nodes], self.bound
+        return np.minimum(distance, bound), distance <= bound
+
+    def walk_to(self, node: int) -> list[int]:
+        """Returns the nodes on the shortest path from the closest source to node, both ends included."""
+        path = []
+        while node != -1:
+            path.append(node)
+            node = self.previous[node]
+        path.reverse()
+        return path
+
+
+class RegionPaths:
+    """
+    Short walks between the sources of a complete NearestSourceSearch, found without a search from each source.
+
+    Two sources whose regions touch are joined by the shortest walk that crosses from one region into the other
+    along a single edge, and sources further apart through the sources in between. Every distance is the length of
+    a walk that exists. It is the shortest distance whenever the shortest path only crosses the regions of its two
+    ends, which holds for most stops that are close to each other. Sources in separate parts of the graph are never
+    joined.
+    """
+
+    def __init__(self, search: NearestSourceSearch, sources: list[int]):
+        """sources: Every source of search, in the order of the rows and columns of distance."""
+        self.search = search
+        self.sources = sources
+        size = len(sources)
+        graph = search.graph
+        offsets = np.frombuffer(graph.offsets, dtype=np.int32)
+        tails = np.repeat(np.arange(graph.node_count), np.diff(offsets))
+        heads = np.frombuffer(graph.neighbors, dtype=np.int32)
+        node_distance = np.frombuffer(search.distance, dtype=np.float64)
+        position = np.full(graph.node_count, -1, dtype=np.intp)
+        position[sources] = np.arange(size)
+        source = np.frombuffer(search.source, dtype=np.int32)
+        region = np.where(source >= 0, position[source], -1)
+        a, b = region[tails], region[heads]
+        crossing = np.flatnonzero((a != b) & (a >= 0) & (b >= 0))
+        length = node_distance[tails[crossing]] + np.frombuffer(graph.weights, dtype=np.float64)[crossing] + \
+            node_distance[heads[crossing]]
+        pair = a[crossing] * size + b[crossing]
+        # The shortest crossing edge between each pair of touching regions.
+        by_length = np.lexsort((length, pair))
+        pairs, first = np.unique(pair[by_length], return_index=True)
+        shortest = crossing[by_length[first]]
+
+        self.distance = np.full((size, size), INFINITY)
+        np.fill_diagonal(self.distance, 0.0)
+        self.distance.flat[pairs] = length[by_length[first]]
+        self._crossing = np.full((size, size), -1, dtype=np.intp)
+        """The edge walked from one region into the other, for sources whose regions touch."""
+        self._crossing.flat[pairs] = shortest
+        self._tails, self._heads = tails, heads
+        self._via = np.full((size, size), -1, dtype=np.intp)
+        """The source walked through between two sources that are not joined directly, or -1."""
+        for k in range(size):
+            through = self.distance[:, k, None] + self.distance[None, k, :]
+            shorter = through < self.distance
+            self.distance[shorter] = through[shorter]
+            self._via[shorter] = k
+
+    def path(self, a: int, b: int) -> list[int]:
+        """Returns the nodes on the walk from source a to source b, both ends included."""
+        if self.distance[a, b] == INFINITY:
+            return []
+        if a == b:
+            return [self.sources[a]]
+        k = int(self._via[a, b])
+        if k >= 0:
+            return self.path(a, k) + self.path(k, b)[1:]
+        edge = int(self._crossing[a, b])
+        return self.search.walk_to(int(self._tails[edge])) + self.search.walk_to(int(self._heads[edge]))[::-1]
+
+
+class AllPairsPaths:
+    """
+    Shortest distances and next hops between every pair of nodes of a CompactGraph.
+
+    distance[a, b] is the shortest distance from a to b and next_hop[a, b] is the node after a on a shortest
+    path from a to b, or -1 if b is unreachable from a. Paths are walked by following next hops, so a lookup
+    costs the length of the path instead of a search.
+    The matrices are never changed once computed. Updates return new matrices, so lookups running on other
+    threads keep a consistent view.
+    """
+
+    def __init__(self, distance: np.ndarray, next_hop: np.ndarray, fingerprint: str):
+        self.distance = distance
+        self.next_hop = next_hop
+        self.fingerprint = fingerprint
+        """Identifies the graph the matrices were computed for. See fingerprint()."""
+
+    @staticmethod
+    def fingerprint(graph: CompactGraph, node_ids: Iterable[str]) -> str:
+        """Hashes a graph along with an identifier for every node index, so saved matrices are never mismatched."""
+        digest = hashlib.sha256()
+        for a in (graph.offsets, graph.neighbors, graph.weights):
+            digest.update(a.tobytes())
+        digest.update('\0'.join(node_ids).encode('utf8'))
+        return digest.hexdigest()
+
+    @classmethod
+    def compute(cls, graph: CompactGraph, fingerprint: str) -> 'AllPairsPaths':
+        """Runs a complete Dijkstra search from every node of the graph."""
+        node_count = graph.node_count
+        distance = np.full((node_count, node_count), INFINITY, dtype=np.float64)
+        next_hop = np.full((node_count, node_count), -1, dtype=np.int32)
+        for source in range(node_count):
+            tree = ShortestPathTree(graph, source)
+            tree.settle_all()
+            distance[source] = np.frombuffer(tree.distance, dtype=np.float64)
+            # The graph is undirected, so the node before b on a shortest path from source to b
+            # is the next hop on a shortest path from b back to source.
+            next_hop[:, source] = np.frombuffer(tree.previous, dtype=np.int32)
+        return cls(distance, next_hop, fingerprint)
+
+    def path(self, a: int, b: int) -> list[int]:
+        """Returns the nodes on a shortest path from a to b, both ends included, or an empty list if unreachable."""
+        if self.distance[a, b] == INFINITY:
+            return []
+        path = [a]
+        while a != b:
+            a = int(self.next_hop[a, b])
+            path.append(a)
+        return path
+
+    def grow(self, node_count: int) -> 'AllPairsPaths':
+        """Returns the matrices extended with nodes added to the graph after they were computed."""
+        added = node_count - len(self.distance)
+        if added <= 0:
+            return self
+        distance = np.pad(self.distance, (0, added), constant_values=INFINITY)
+        next_hop = np.pad(self.next_hop, (0, added), constant_values=-1)
+        distance[-added:, -added:][np.diag_indices(added)] = 0.0
+        return AllPairsPaths(distance, next_hop, self.fingerprint)
+
+    def edge_shortened(self, a: int, b: int, weight: float) -> 'AllPairsPaths':
+        """
+        Returns the matrices updated for every pair whose shortest path gets shorter through the added or shortened
+        edge a - b.
+        """
+        distance, next_hop = self.distance, self.next_hop.copy()
+        through_ab = distance[:, a, None] + weight + distance[None, b, :]
+        through_ba = distance[:, b, None] + weight + distance[None, a, :]
+        use_ab = (through_ab < distance) & (through_ab <= through_ba)
+        use_ba = (through_ba < distance) & ~use_ab
+        # The first hop towards a, or b itself when starting from a.
+        hop_to_a, hop_to_b = next_hop[:, a].copy(), next_hop[:, b].copy()
+        hop_to_a[a], hop_to_b[b] = b, a
+        next_hop[use_ab] = np.broadcast_to(hop_to_a[:, None], next_hop.shape)[use_ab]
+        next_hop[use_ba] = np.broadcast_to(hop_to_b[:, None], next_hop.shape)[use_ba]
+        return AllPairsPaths(np.minimum(distance, np.minimum(through_ab, through_ba)), next_hop, self.fingerprint)
+
+    def node_removed(self, node: int) -> Optional['AllPairsPaths']:
+        """
+        Returns the matrices updated after a node and its edges were removed from the graph.
+        Returns None if the node was in the middle of any other pair's shortest path.
+        """
+        passes_through = self.next_hop == node
+        passes_through[:, node] = False
+        if passes_through.any():
+            return None
+        distance, next_hop = self.distance.copy(), self.next_hop.copy()
+        distance[node, :] = distance[:, node] = INFINITY
+        next_hop[node, :] = next_hop[:, node] = -1
+        return AllPairsPaths(distance, next_hop, self.fingerprint)
+
+    def save(self, file_path: str):
+        np.savez(file_path, distance=self.distance, next_hop=self.next_hop, fingerprint=np.array(self.fingerprint))
+
+    @classmethod
+    def load(cls, file_path: str, fingerprint: str) -> Optional['AllPairsPaths']:
+        """Loads matrices saved by save(). Returns None if they were computed for a different graph."""
+        with np.load(file_path) as saved:
+            if str(saved['fingerprint']) != fingerprint:
+                return None
+            return cls(saved['distance'], saved['next_hop'], fingerprint)
+
+
+EXACT_ROUTE_LIMIT = 9
+"""The largest number of route points that plan_route solves exactly. Larger routes use a heuristic."""
+
+
+def route_length(route: list[int], matrix: list[list[float]]) -> float:
+    """Returns the total distance of walking the points of route in order."""
+    return sum(matrix[a][b] for a, b in zip(route, route[1:]))
+
+
+def plan_route(matrix: list[list[float]], fixed_start: bool = False) -> list[int]:
+    """
+    Returns an order in which to visit every point of a symmetric distance matrix that keeps the walk short.
+    The route is open: it ends at the last point visited instead of returning to where it started.
+
+    matrix: The distances between every pair of points. Must not contain float('inf').
+    fixed_start: If True, the route always starts at point 0.
+
+    Routes of up to EXACT_ROUTE_LIMIT points are solved exactly with Held-Karp dynamic programming.
+    Larger routes are built with nearest neighbour and improved with 2-opt until no reversal shortens them.
+    """
+    if len(matrix) <= 2:
+        return list(range(len(matrix)))
+    if len(matrix) <= EXACT_ROUTE_LIMIT:
+        return _held_karp(matrix, fixed_start)
+    starts = [0] if fixed_start else range(len(matrix))
+    route = min((_nearest_neighbor(matrix, start) for start in starts), key=lambda r: route_length(r, matrix))
+    return _two_opt(route, matrix, fixed_start)
+
+
+def _held_karp(matrix: list[list[float]], fixed_start: bool) -> list[int]:
+    """Exact open path over every point. cost[visited][last] is the shortest walk over visited that ends at last."""
+    n = len(matrix)
+    full = (1 << n) - 1
+    cost = [[INFINITY] * n for _ in range(1 << n)]
+    parent = [[-1] * n for _ in range(1 << n)]
+    for start in [0] if fixed_start else range(n):
+        cost[1 << start][start] = 0.0
+    for visited in range(1, full):
+        visited_cost = cost[visited]
+        for last in range(n):
+            walked = visited_cost[last]
+            if walked == INFINITY:
+                continue
+            from_last = matrix[last]
+            for nxt in range(n):
+                bit = 1 << nxt
+                if visited & bit:
+                    continue
+                new_cost = walked + from_last[nxt]
+                if new_cost < cost[visited | bit][nxt]:
+                    cost[visited | bit][nxt] = new_cost
+                    parent[visited | bit][nxt] = last
+    last = min(range(n), key=cost[full].__getitem__)
+    route = []
+    visited = full
+    while last != -1:
+        route.append(last)
+        last, visited = parent[visited][last], visited & ~(1 << last)
+    route.reverse()
+    return route
+
+
+def _nearest_neighbor(matrix: list[list[float]], start: int) -> list[int]:
+    """Greedy route that always walks to the closest point not yet visited."""
+    unvisited = set(range(len(matrix)))
+    unvisited.remove(start)
+    route = [start]
+    while unvisited:
+        from_last = matrix[route[-1]]
+        nxt = min(unvisited, key=from_last.__getitem__)
+        unvisited.remove(nxt)
+        route.append(nxt)
+    return route
+
+
+def _two_opt(route: list[int], matrix: list[list[float]], fixed_start: bool) -> list[int]:
+    """
+    Reverses segments of an open route for as long as a reversal makes the route shorter.
+    Reversing route[i:j + 1] only changes the edge entering route[i] and the edge leaving route[j].
+    """
+    n = len(route)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1 if fixed_start else 0, n - 1):
+            for j in range(i + 1, n):
+                first, last = route[i], route[j]
+                before = after = 0.0
+                if i > 0:
+                    before += matrix[route[i - 1]][first]
+                    after += matrix[route[i - 1]][last]
+                if j < n - 1:
+                    before += matrix[last][route[j + 1]]
+                    after += matrix[first][route[j + 1]]
+                if after < before - 1e-9:
+                    route[i:j + 1] = route[i:j + 1][::-1]
+                    improved = True
+    return route
@@ -0,0 +1,210 @@
+import bisect
+import dataclasses
+import itertools
+import re
+import uuid
+from typing import Optional
+
+from models.bin import Bin
+from models.market import MarketMap
+
+
+def normalize(text: str) -> list[str]:
+    """
+    Splits a product name or search query into lowercase alphanumeric tokens.
+    Plurals ending in a single 's' are reduced so that 'apples' and 'apple' match.
+    """
+    tokens = re.findall(r'[a-z0-9]+', text.lower())
+    return [t[:-1] if len(t) > 3 and t.endswith('s') and not t.endswith('ss') else t for t in tokens]
+
+
+def _deletions(token: str) -> set[str]:
+    """Every string that can be made by deleting at most one character from token."""
+    return {token} | {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """True if a can be turned into b with at most one insertion, deletion, substitution or adjacent swap."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    i = 0
+    while i < min(len(a), len(b)) and a[i] == b[i]:
+        i += 1
+    return a[i + 1:] == b[i + 1:] or a[i + 1:] == b[i:] or a[i:] == b[i + 1:] or \
+        (a[i + 2:] == b[i + 2:] and a[i:i + 2] == b[i:i + 2][::-1])
+
+
+class ProductIndex:
+    """
+    An in-memory inverted index from normalized product name tokens to the bins selling the product.
+    Answers "where can I buy X" without scanning the bins table. Whole bins are kept, so the index also serves
+    as an in-memory stock index.
+
+    Values contained in the index are managed by the Vendor class as bins are created, updated and removed,
+    the same way MarketMap._vendor_stalls is.
+    """
+
+    EXACT, PREFIX, FUZZY = range(3)
+    """How well a query token matched an indexed token. Lower is better."""
+
+    FUZZY_MIN_LENGTH = 4
+    """Query tokens shorter than this are not fuzzy matched. Short tokens are within one edit of too many words."""
+
+    def __init__(self):
+        self._bins: dict[str, Bin] = {}
+        self._postings: dict[str, set[str]] = {}
+        """Token -> ids of the bins whose product name contains the token."""
+        self._sorted_tokens: list[str] = []
+        """Every indexed token in order, for prefix matching."""
+        self._deletion_index: dict[str, set[str]] = {}
+        """Indexed tokens by every one character deletion of them, for fuzzy matching."""
+        self._vendor_versions: dict[int, int] = {}
+        """Vendor id -> a number that changes whenever one of the vendor's bins does."""
+        self._version_clock = itertools.count(1)
+        self.epoch = uuid.uuid4().hex
+        """
+        Differs between every index, and so between processes. Vendor versions restart with each index, so caches
+        kept outside the process, such as a browser's, pair them with the epoch.
+        """
+        self._cleared_version = 0
+        """The version of every vendor without a version of its own, changed whenever the index is cleared."""
+
+    def __len__(self) -> int:
+        return len(self._bins)
+
+    def get(self, bin_id: str) -> Optional[Bin]:
+        return self._bins.get(bin_id)
+
+    def vendor_version(self, vendor_id: int) -> int:
+        """
+        Returns a number that changes whenever a bin of the vendor is added, updated or removed, or vendor_changed is
+        called. Lets caches of anything derived from a vendor's bins tell whether they are stale.
+        """
+        return self._vendor_versions.get(vendor_id, self._cleared_version)
+
+    def vendor_changed(self, vendor_id: int):
+        """Changes the version of a vendor. Versions are never reused, even after the index is cleared."""
+        self._vendor_versions[vendor_id] = next(self._version_clock)
+
+    def add(self, _bin: Bin):
+        """
+        Indexes a bin, replacing any earlier version of it.
+        A copy is kept, so later changes to the given bin only reach the index through update().
+        """
+        self.remove(_bin.bin_id)
+        _bin = dataclasses.replace(_bin)
+        self._bins[_bin.bin_id] = _bin
+        self.vendor_changed(_bin.vendor_id)
+        for token in set(normalize(_bin.product_name)):
+            if token not in self._postings:
+                self._postings[token] = set()
+                bisect.insort(self._sorted_tokens, token)
+                for deletion in _deletions(token):
+                    self._deletion_index.setdefault(deletion, set()).add(token)
+            self._postings[token].add(_bin.bin_id)
+
+    def update(self, _bin: Bin):
+        self.add(_bin)
+
+    def remove(self, bin_id: str) -> Optional[Bin]:
+        """Removes a bin from the index. Returns the removed bin or None if it was not indexed."""
+        _bin = self._bins.pop(bin_id, None)
+        if _bin is None:
+            return None
+        self.vendor_changed(_bin.vendor_id)
+        for token in set(normalize(_bin.product_name)):
+            postings = self._postings[token]
+            postings.discard(bin_id)
+            if len(postings) == 0:
+                self._postings.pop(token)
+                self._sorted_tokens.pop(bisect.bisect_left(self._sorted_tokens, token))
+                for deletion in _deletions(token):
+                    tokens = self._deletion_index[deletion]
+                    tokens.discard(token)
+                    if len(tokens) == 0:
+                        self._deletion_index.pop(deletion)
+        return _bin
+
+    def clear(self):
+        self._bins.clear()
+        self._vendor_versions.clear()
+        self._cleared_version = next(self._version_clock)
+        self._postings.clear()
+        self._sorted_tokens.clear()
+        self._deletion_index.clear()
+
+    def _matching_tokens(self, query_token: str, prefix: bool, fuzzy: bool) -> dict[str, int]:
+        """Indexed tokens matching a query token, each with how well it matched."""
+        matches: dict[str, int] = {}
+        if fuzzy and len(query_token) >= ProductIndex.FUZZY_MIN_LENGTH:
+            for deletion in _deletions(query_token):
+                for token in self._deletion_index.get(deletion, ()):
+                    if _within_one_edit(query_token, token):
+                        matches[token] = ProductIndex.FUZZY
+        if prefix:
+            i = bisect.bisect_left(self._sorted_tokens, query_token)
+            while i < len(self._sorted_tokens) and self._sorted_tokens[i].startswith(query_token):
+                matches[self._sorted_tokens[i]] = ProductIndex.PREFIX
+                i += 1
+        if query_token in self._postings:
+            matches[query_token] = ProductIndex.EXACT
+        return matches
+
+    def search(self, query: str, *, prefix: bool = True, fuzzy: bool = True) -> list[Bin]:
+        """
+        Returns the bins whose product name matches every token of query, best matches first.
+        prefix: Also match product names with a word starting with a query token, e.g. 'app' finds 'apple'.
+        fuzzy: Also match product names with a word one typo away from a query token, e.g. 'aple' finds 'apple'.
+        """
+        scores: Optional[dict[str, int]] = None
+        for query_token in normalize(query):
+            token_scores: dict[str, int] = {}
+            for token, score in self._matching_tokens(query_token, prefix, fuzzy).items():
+                for bin_id in self._postings[token]:
+                    token_scores[bin_id] = min(score, token_scores.get(bin_id, score))
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {bin_id: scores[bin_id] + score for bin_id, score in token_scores.items() if bin_id in scores}
+        if not scores:
+            return []
+        return sorted((self._bins[bin_id] for bin_id in scores), key=lambda b: (scores[b.bin_id], b.product_name))
+
+    def search_near(
+            self,
+            query: str,
+            from_stall: MarketMap.VendorStall,
+            market_map: MarketMap, **kwargs
+    ) -> list[tuple[Bin, float]]:
+        """
+        Returns the bins matching query along with the walking distance to them from from_stall, closest first.
+        Bins that can not be walked to are listed last with a distance of float('inf').
+        Accepts the same keyword arguments as search().
+        """
+        bins = self.search(query, **kwargs)
+        stalls = [MarketMap.VendorStall(_bin.vendor_id, _bin.bin_id) for _bin in bins]
+        distances = market_map.distances_from(from_stall, stalls)
+        # sorted() is stable, so bins at the same distance keep their match order.
+        return sorted(((_bin, distances[stall]) for _bin, stall in zip(bins, stalls)), key=lambda match: match[1])
+
+    def nearest_in_stock(
+            self,
+            product: str,
+            quantity: float,
+            from_stall: MarketMap.VendorStall,
+            market_map: MarketMap,
+            k: int = 1
+    ) -> list[tuple[Bin, float]]:
+        """
+        Returns up to k of the closest bins to from_stall that sell product and still hold at least quantity units,
+        along with the walking distance to each, closest first. A bin sells product if its whole normalized name is
+        that of product, so 'apple' finds 'apples' but not 'apple juice'.
+        Stock is read from the index, so no bins are queried from the database.
+        """
+        name = normalize(product)
+        in_stock = {
+            MarketMap.VendorStall(_bin.vendor_id, _bin.bin_id): _bin
+            for _bin in self.search(product, prefix=False, fuzzy=False)
+            if normalize(_bin.product_name) == name and _bin.stock >= quantity
+        }
+        return [(in_stock[stall], distance) for stall, distance in market_map.nearest(from_stall, in_stock.keys(), k)]
@@ -1,15 +1,18 @@
 import json
 from dataclasses import dataclass, asdict
+from datetime import datetime
 from enum import Enum
-from typing import Union, Optional
+from typing import Iterable, Iterator, Union, Optional
 
 from flask_login import login_required, current_user
 
 import database
 import models
 from models import MarketMap, PriceCode, Bin
-from errors import UniquenessError
 from models.orders import Order, Transaction
+from models.analytics import SalesColumns, load_sales_columns
+from models.latency import LatencySummary
+from models.reports import SalesReport, sales_report
 
 
 @dataclass
@@ -18,28 +21,117 @@ class Vendor:
     vendor_name: str
     vendor_email: str
 
+    STOREFRONT_PAGE_SIZE = 50
+    """Default number of vendors on a page of the storefront."""
+
+    STOREFRONT_BIN_LIMIT = 20
+    """Default number of bins listed per vendor on the storefront."""
+
+    @dataclass
+    class Storefront:
+        """A vendor as listed on the shop's storefront."""
+        vendor: 'Vendor'
+        bins: list[Bin]
+        """The first of the vendor's bins by product name."""
+        bin_count: int
+        """How many bins the vendor has in total."""
+
+    PENDING_ORDERS_PAGE_SIZE = 100
+    """Default number of pending orders listed on a page of the sales dashboard."""
+
+    @dataclass
+    class PendingStock:
+        """The units of one of the vendor's bins that were sold but are still waiting to be filled."""
+        bin_id: str
+        product_name: str
+        stock: float
+        """The stock left in the bin for new orders. Checkout takes the units it sells out of it."""
+        pending_units: float
+        """Units sold from the bin across every unfilled transaction."""
+        reserved_units: float
+        """The pending units that checkout already took out of the bin's stock."""
+        pending_transactions: int
+
+        @property
+        def on_hand(self) -> float:
+            """The stock that should physically be in the bin: what is left for new orders plus what is reserved."""
+            return self.stock + self.reserved_units
+
+        @property
+        def shortfall(self) -> float:
+            """
+            Units the bin must be restocked by before every pending transaction can be filled. 0 if none.
+            Reserved units are always covered. Sales placed before checkout reserved stock were never taken out of
+            the bin's stock, so the bin falls short once they add up to more than its stock.
+            """
+            return max(self.pending_units - self.on_hand, 0.0)
+
     @login_required
-    def get_all_orders(self) -> Optional[dict[Order, list[Transaction]]]:
+    def get_all_orders(
+            self, *,
+            filled: Optional[bool] = None,
+            limit: Optional[int] = None,
+            offset: int = 0
+    ) -> Optional[dict[Order, list[Transaction]]]:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN NONE IF UNAUTHORIZED!
+        Returns the orders containing the vendor's bins mapped to all of their transactions, oldest order first.
+        See iter_orders for the arguments.
+        """
         # Owner Required in order to perform this transaction.
         if self.vendor_id != Vendor.current_user().vendor_id:
             return None
+        return dict(self.iter_orders(filled=filled, limit=limit, offset=offset))
+
+    @login_required
+    def iter_orders(
+            self, *,
+            filled: Optional[bool] = None,
+            limit: Optional[int] = None,
+            offset: int = 0
+    ) -> Iterator[tuple[Order, list[Transaction]]]:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. YIELDS NOTHING IF UNAUTHORIZED!
+        Streams the orders containing the vendor's bins along with all of their transactions, oldest order first.
+        filled: Only include filled orders if True, or unfilled orders if False.
+        limit, offset: Page through the orders. A page never splits an order's transactions.
+
+        Orders and transactions are loaded with a single query and grouped as the rows are read.
+        """
+        # Owner Required in order to perform this transaction.
+        if self.vendor_id != Vendor.current_user().vendor_id:
+            return
 
-        db = database.get_db()
-        transaction_map: dict[Order, list[Transaction]] = {}
-        order_items = db.execute(
+        rows = database.get_read_db().execute(
             """
-            SELECT orders.customer_id, orders.order_id, orders.order_filled, orders.order_filled_at FROM orders
-                INNER JOIN transactions ON orders.order_id = transactions.order_id
-                INNER JOIN bins ON transactions.bin_id = bins.bin_id
-            WHERE bins.vendor_id = ?
+            SELECT orders.customer_id, orders.order_id, orders.order_filled, orders.order_filled_at,
+                   transactions.order_id, transactions.bin_id, transactions.units_purchased,
+                   transactions.transaction_filled, transactions.time_of_sale, transactions.transaction_filled_at
+            FROM (
+                SELECT orders.order_id, MIN(transactions.time_of_sale) AS first_sale FROM orders
+                    INNER JOIN transactions ON orders.order_id = transactions.order_id
+                    INNER JOIN bins ON transactions.bin_id = bins.bin_id
+                WHERE bins.vendor_id = ? AND (? IS NULL OR orders.order_filled = ?)
+                GROUP BY orders.order_id
+                ORDER BY first_sale, orders.order_id
+                LIMIT ? OFFSET ?
+            ) AS page
+                INNER JOIN orders ON orders.order_id = page.order_id
+                INNER JOIN transactions ON transactions.order_id = page.order_id
+            ORDER BY page.first_sale, page.order_id
             """,
-            (self.vendor_id,)
-        ).fetchall()
-        orders = [Order(*data) for data in order_items]
-        for order in orders:
-            transaction_items = db.execute("""SELECT * FROM transactions WHERE order_id = ?""", (order.order_id,)).fetchall()
-            transaction_map[order] = [Transaction(*data) for data in transaction_items]
-        return transaction_map
+            (self.vendor_id, filled, filled, -1 if limit is None else limit, offset)
+        )
+        order: Optional[Order] = None
+        transactions: list[Transaction] = []
+        for row in rows:
+            if order is None or order.order_id != row[1]:
+                if order is not None:
+                    yield order, transactions
+                order, transactions = Order(*row[:4]), []
+            transactions.append(Transaction(*row[4:]))
+        if order is not None:
+            yield order, transactions
 
     @login_required
     def create_bin(
@@ -60,15 +152,17 @@ class Vendor:
 
         bin_id = database.gen_uuid()
         params = (bin_id, self.vendor_id, product_name, initial_stock, unit_price, price_code.name)
-        db = database.get_db()
-        db.execute(
-            """INSERT INTO bins(bin_id, vendor_id, product_name, stock, unit_price, price_code)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            params
-        )
-        db.commit()
+        with database.writer() as db:
+            db.execute(
+                """INSERT INTO bins(bin_id, vendor_id, product_name, stock, unit_price, price_code)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                params
+            )
         MarketMap.cache_stall(bin_id, self.vendor_id)
-        return Bin(*params)
+        _bin = Bin(*params)
+        database.identity_map('bins')[bin_id] = _bin
+        models.get_product_index().add(_bin)
+        return _bin
 
     @login_required
     def update_bin(
@@ -80,7 +174,7 @@ class Vendor:
     ) -> Optional[Bin]:
         """
         REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN NONE IF UNAUTHORIZED!
-        Updates a bin a vendor owns with specified values to be replaced with.
+        Updates a bin a vendor owns with specified values to be replaced with, using a single statement.
         Returns the updated bin.
         Returns None if no update was made or the current vendor was not authorized to update a bin.
         """
@@ -88,33 +182,183 @@ class Vendor:
         if self.vendor_id != Vendor.current_user().vendor_id:
             return None
 
-        _bin = self.get_bin(bin_id)
-        if _bin is None or not any((product_name, stock, price)):
+        if all(value is None for value in (product_name, stock, price)):
             return None
 
-        db = database.get_db()
-        if product_name is not None:
-            _bin.product_name = product_name
-            db.execute(
-                """UPDATE bins SET product_name = ? WHERE bin_id = ? AND vendor_id = ?""",
-                (product_name, bin_id, self.vendor_id)
-            )
-        if stock is not None:
-            _bin.stock = stock
-            db.execute(
-                """UPDATE bins SET stock = ? WHERE bin_id = ? AND vendor_id = ?""",
-                (stock, bin_id, self.vendor_id)
-            )
-        if price is not None:
-            unit_price, price_code = price
-            _bin.unit_price = unit_price
-            _bin.price_code = price_code
-            db.execute(
-                """UPDATE bins SET unit_price = ?, price_code = ? WHERE bin_id = ? AND vendor_id = ?""",
-                (unit_price, price_code.name, bin_id, self.vendor_id)
-            )
-        db.commit()
-        return _bin
+        unit_price, price_code = price if price is not None else (None, None)
+        with database.writer() as db:
+            data = db.execute(
+                """UPDATE bins SET product_name = COALESCE(?, product_name),
+                                   stock = COALESCE(?, stock),
+                                   unit_price = COALESCE(?, unit_price),
+                                   price_code = COALESCE(?, price_code)
+                   WHERE bin_id = ? AND vendor_id = ?
+                   RETURNING *""",
+                (product_name, stock, unit_price, price_code.name if price_code is not None else None, bin_id, self.vendor_id)
+            ).fetchone()
+        return models.bin_changed(data) if data is not None else None
+
+    @login_required
+    def adjust_stock(self, bin_id: str, delta: float) -> Optional[Bin]:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN NONE IF UNAUTHORIZED!
+        Adds delta to the stock of a bin the vendor owns, or removes stock if delta is negative. Returns the updated bin.
+        Returns None if the bin does not exist, would be left with negative stock, or the current vendor was not
+        authorized to update it.
+
+        The change is made relative to the stock held by the database, so concurrent adjustments never overwrite
+        each other.
+        """
+        # Owner Required in order to perform this transaction.
+        if self.vendor_id != Vendor.current_user().vendor_id:
+            return None
+
+        with database.writer() as db:
+            data = db.execute(
+                """UPDATE bins SET stock = stock + ? WHERE bin_id = ? AND vendor_id = ? AND stock + ? >= 0 RETURNING *""",
+                (delta, bin_id, self.vendor_id, delta)
+            ).fetchone()
+        return models.bin_changed(data) if data is not None else None
+
+    @login_required
+    def fill_transaction(self, order_id: str, bin_id: str) -> bool:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN FALSE IF UNAUTHORIZED!
+        Marks a pending transaction for one of the vendor's bins as filled, and its order as filled once every
+        transaction of the order is. Returns True if the transaction was filled by this call.
+        """
+        return len(self.fill_transactions([(order_id, bin_id)])) == 1
+
+    @login_required
+    def fill_transactions(self, transactions: Iterable[tuple[str, str]]) -> list[tuple[str, str]]:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN AN EMPTY LIST IF UNAUTHORIZED!
+        Marks many pending transactions for the vendor's bins as filled, given as (order_id, bin_id) pairs, and every
+        order among them as filled once all of its transactions are.
+        Returns the (order_id, bin_id) pairs that were filled by this call.
+        """
+        # Owner Required in order to perform this transaction.
+        if self.vendor_id != Vendor.current_user().vendor_id:
+            return []
+        pairs = json.dumps([list(pair) for pair in transactions])
+        return self._fill(
+            """(order_id, bin_id) IN (
+                   SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+               )""",
+            pairs
+        )
+
+    @login_required
+    def fill_orders(self, order_ids: Iterable[str]) -> list[tuple[str, str]]:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN AN EMPTY LIST IF UNAUTHORIZED!
+        Marks every pending transaction for the vendor's bins in the given orders as filled, along with the orders.
+        Returns the (order_id, bin_id) pairs that were filled by this call.
+        """
+        # Owner Required in order to perform this transaction.
+        if self.vendor_id != Vendor.current_user().vendor_id:
+            return []
+        return self._fill("""order_id IN (SELECT value FROM json_each(?))""", json.dumps(list(order_ids)))
+
+    def _fill(self, condition: str, parameter: str) -> list[tuple[str, str]]:
+        """
+        Fills the vendor's pending transactions matching condition, which takes parameter as its only argument.
+        Transactions and their orders are each updated with a single statement, however many there are.
+        """
+        filled_at = datetime.now()
+        with database.writer() as db:
+            filled = db.execute(
+                f"""UPDATE transactions SET transaction_filled = TRUE, transaction_filled_at = ?
+                    WHERE {condition} AND NOT transaction_filled
+                        AND EXISTS (SELECT 1 FROM bins WHERE bins.bin_id = transactions.bin_id AND bins.vendor_id = ?)
+                    RETURNING order_id, bin_id, time_of_sale""",
+                (filled_at, parameter, self.vendor_id)
+            ).fetchall()
+            if filled:
+                db.execute(
+                    """UPDATE orders SET order_filled = TRUE, order_filled_at = ?
+                       WHERE order_id IN (SELECT value FROM json_each(?)) AND NOT EXISTS (
+                           SELECT 1 FROM transactions WHERE transactions.order_id = orders.order_id AND NOT transaction_filled
+                       )""",
+                    (filled_at, json.dumps(list({row['order_id'] for row in filled})))
+                )
+        fill_latencies = models.get_fill_latencies()
+        for row in filled:
+            fill_latencies.add(self.vendor_id, row['bin_id'], row['time_of_sale'], filled_at)
+        return [(row['order_id'], row['bin_id']) for row in filled]
+
+    @login_required
+    def pending_stock(self) -> Optional[list[PendingStock]]:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN NONE IF UNAUTHORIZED!
+        Returns the units still waiting to be filled for each of the vendor's bins against the bin's stock on hand,
+        by product name. Bins without pending transactions are left out.
+        Aggregated by a single query over the pending_transactions index, so filled sales are never read.
+        """
+        # Owner Required in order to perform this transaction.
+        if self.vendor_id != Vendor.current_user().vendor_id:
+            return None
+        rows = database.get_read_db().execute(
+            """SELECT bins.bin_id, bins.product_name, bins.stock,
+                      SUM(transactions.units_purchased),
+                      SUM(CASE WHEN transactions.stock_reserved THEN transactions.units_purchased ELSE 0.0 END),
+                      COUNT(transactions.order_id)
+               FROM bins INNER JOIN transactions ON transactions.bin_id = bins.bin_id
+               WHERE bins.vendor_id = ? AND NOT transactions.transaction_filled
+               GROUP BY bins.bin_id
+               ORDER BY bins.product_name, bins.bin_id""",
+            (self.vendor_id,)
+        )
+        return [Vendor.PendingStock(*row) for row in rows]
+
+    @login_required
+    def plan_pick_waves(self, from_stall: MarketMap.VendorStall = None) -> Optional[list[MarketMap.PickWave]]:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN NONE IF UNAUTHORIZED!
+        Batches the vendor's unfilled orders into waves of nearby orders, each with a single pick route.
+        See MarketMap.plan_pick_waves.
+        """
+        # Owner Required in order to perform this transaction.
+        if self.vendor_id != Vendor.current_user().vendor_id:
+            return None
+        return models.plan_pick_waves(self.vendor_id, from_stall)
+
+    @login_required
+    def sales_columns(self, start: datetime, end: datetime) -> Optional[SalesColumns]:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN NONE IF UNAUTHORIZED!
+        Loads the vendor's filled sales made within [start, end) as NumPy columns for bulk analysis.
+        See models.analytics.load_sales_columns.
+        """
+        # Owner Required in order to perform this transaction.
+        if self.vendor_id != Vendor.current_user().vendor_id:
+            return None
+        return load_sales_columns(self.vendor_id, start, end)
+
+    @login_required
+    def fill_latency(self, bin_id: Optional[str] = None) -> Optional[LatencySummary]:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN NONE IF UNAUTHORIZED!
+        Summarizes how long the vendor takes to fill transactions, or transactions of one of its bins if bin_id is
+        given. Returns None if no transactions have been filled yet.
+        """
+        # Owner Required in order to perform this transaction.
+        if self.vendor_id != Vendor.current_user().vendor_id:
+            return None
+        if bin_id is None:
+            return models.get_fill_latencies().vendor(self.vendor_id)
+        return models.get_fill_latencies().bin(bin_id) if self.get_bin(bin_id) is not None else None
+
+    @login_required
+    def sales_report(self, start: datetime, end: datetime) -> Optional[SalesReport]:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN NONE IF UNAUTHORIZED!
+        Reports the vendor's filled sales made within [start, end). See models.reports.sales_report.
+        """
+        # Owner Required in order to perform this transaction.
+        if self.vendor_id != Vendor.current_user().vendor_id:
+            return None
+        return sales_report(self.vendor_id, start, end)
 
     @login_required
     def remove_bin(self, bin_id: str) -> Optional[Bin]:
@@ -130,25 +374,50 @@ class Vendor:
         if _bin is None:
             return None
 
-        db = database.get_db()
-        db.execute("""DELETE FROM bins WHERE bin_id = ? AND vendor_id = ?""", (_bin.bin_id, self.vendor_id))
-        db.commit()
+        with database.writer() as db:
+            db.execute("""DELETE FROM bins WHERE bin_id = ? AND vendor_id = ?""", (_bin.bin_id, self.vendor_id))
+        database.identity_map('bins').pop(_bin.bin_id, None)
         MarketMap.dump_stall(_bin.bin_id, update_map=models.get_market_map())
+        models.get_product_index().remove(_bin.bin_id)
         return _bin
 
-    def get_bin(self, bin_id: str) -> Optional[Bin]:
-        """Gets a bin belonging to vendor from given bin id."""
-        bins = self.bins
-        if bins is None:
+    @login_required
+    def update_details(self, *, vendor_name: str = None, vendor_email: str = None) -> Optional['Vendor']:
+        """
+        REQUIRES LOGIN AND AUTHENTICATION TO BE CALLED. WILL RETURN NONE IF UNAUTHORIZED!
+        Changes the vendor's name and/or email. Returns the updated vendor.
+        Returns None if no update was made or the current vendor was not authorized to update the vendor.
+        """
+        # Owner Required in order to perform this transaction.
+        if self.vendor_id != Vendor.current_user().vendor_id or not any((vendor_name, vendor_email)):
             return None
 
-        _bin = [b for b in bins if b.bin_id == bin_id]
-        if len(_bin) == 0:
-            return None
-        if len(_bin) == 1:
-            return _bin[0]
-        # This should not be reached. Most likely handled by the database since bin_id is a primary key.
-        raise UniquenessError(_bin, 'Queried for a single bin. Got multiple bins with the same id.')
+        with database.writer() as db:
+            db.execute(
+                """UPDATE vendors SET vendor_name = COALESCE(?, vendor_name), vendor_email = COALESCE(?, vendor_email)
+                   WHERE vendor_id = ?""",
+                (vendor_name, vendor_email, self.vendor_id)
+            )
+        Vendor.forget(self.vendor_id)
+        models.get_product_index().vendor_changed(self.vendor_id)
+        return Vendor.get(self.vendor_id)
+
+    def get_bin(self, bin_id: str) -> Optional[Bin]:
+        """
+        Gets a bin belonging to vendor from given bin id.
+        Only the requested bin is queried, and a bin already loaded during the current request is returned from the
+        request's identity map without querying it again.
+        """
+        bins = database.identity_map('bins')
+        _bin = bins.get(bin_id)
+        if _bin is None:
+            data = database.get_db().execute(
+                """SELECT * FROM bins WHERE bin_id = ? AND vendor_id = ?""", (bin_id, self.vendor_id)
+            ).fetchone()
+            if data is None:
+                return None
+            _bin = bins[bin_id] = Bin(*data)
+        return _bin if _bin.vendor_id == self.vendor_id else None
 
     @property
     def bins(self) -> Optional[list[Bin]]:
@@ -156,7 +425,7 @@ class Vendor:
         Returns a list of bins belonging to the vendor.
         Returns None is current user is not authorized to view bins.
         """
-        bins = database.get_db().execute("""SELECT * FROM bins WHERE vendor_id = ?""", (self.vendor_id,)).fetchall()
+        bins = database.get_read_db().execute("""SELECT * FROM bins WHERE vendor_id = ?""", (self.vendor_id,)).fetchall()
         return [Bin(*data) for data in bins]
 
     # ---------------------------------------
@@ -202,10 +471,24 @@ class Vendor:
         """
         if vendor_id is None:
             return None
-        vendor_data = database.get_db().execute(
-            """SELECT vendor_id, vendor_name, vendor_email FROM vendors WHERE vendor_id = ?""", (int(vendor_id),)
-        ).fetchone()
-        return cls(*vendor_data) if vendor_data is not None else None
+        vendors = database.identity_map('vendors')
+        vendor = vendors.get(int(vendor_id))
+        if vendor is None:
+            vendor_data = database.get_db().execute(
+                """SELECT vendor_id, vendor_name, vendor_email FROM vendors WHERE vendor_id = ?""", (int(vendor_id),)
+            ).fetchone()
+            if vendor_data is None:
+                return None
+            vendor = vendors[vendor_data[0]] = cls(*vendor_data)
+        return vendor
+
+    @staticmethod
+    def forget(vendor_id: Union[str, int]):
+        """
+        Drops a vendor from the current request's identity map so that the next Vendor.get queries it again.
+        Must be called whenever a vendor's details are changed in the database.
+        """
+        database.identity_map('vendors').pop(int(vendor_id), None)
 
     @classmethod
     def get_all_vendors(cls) -> Optional[list['Vendor']]:
@@ -213,10 +496,75 @@ class Vendor:
         Future considerations:
         - Omit email as that may be a security issue.
         """
-        vendor_data = database.get_db().execute("""SELECT vendor_id, vendor_name, vendor_email FROM vendors""").fetchall()
-        return [cls(*data) for data in vendor_data] if len(vendor_data) > 0 else None
+        vendor_data = database.get_read_db().execute("""SELECT vendor_id, vendor_name, vendor_email FROM vendors""").fetchall()
+        vendors = database.identity_map('vendors')
+        return [vendors.setdefault(data[0], cls(*data)) for data in vendor_data] if len(vendor_data) > 0 else None
+
+    @classmethod
+    def get_page(cls, page: int = 0, page_size: int = STOREFRONT_PAGE_SIZE) -> tuple[list['Vendor'], bool]:
+        """Returns a page of vendors in order of vendor id and whether there are more pages after this one."""
+        vendor_data = database.get_read_db().execute(
+            """SELECT vendor_id, vendor_name, vendor_email FROM vendors ORDER BY vendor_id LIMIT ? OFFSET ?""",
+            (page_size + 1, page * page_size)
+        ).fetchall()
+        vendors = database.identity_map('vendors')
+        return [vendors.setdefault(data[0], cls(*data)) for data in vendor_data[:page_size]], len(vendor_data) > page_size
+
+    @classmethod
+    def storefront(
+            cls, *,
+            page: int = 0,
+            page_size: int = STOREFRONT_PAGE_SIZE,
+            bin_limit: int = STOREFRONT_BIN_LIMIT,
+            vendor_ids: Optional[list[int]] = None
+    ) -> tuple[list['Vendor.Storefront'], bool]:
+        """
+        Loads a page of vendors along with their first bin_limit bins for the shop's storefront.
+        Returns the vendors in order of vendor id and whether there are more pages after this one.
+        vendor_ids: Load these vendors instead of a page. page and page_size are ignored.
+
+        Vendors and bins are loaded with a single query, so the cost of a page is bounded by page_size and bin_limit
+        regardless of how many vendors the market has.
+        """
+        if vendor_ids is None:
+            page_query = """SELECT vendor_id, vendor_name, vendor_email FROM vendors ORDER BY vendor_id LIMIT ? OFFSET ?"""
+            page_params = (page_size + 1, page * page_size)
+        else:
+            page_query = f"""SELECT vendor_id, vendor_name, vendor_email FROM vendors
+                             WHERE vendor_id IN ({', '.join('?' * len(vendor_ids))})"""
+            page_params = (*vendor_ids,)
+            page_size = len(vendor_ids)
+        rows = database.get_read_db().execute(
+            f"""
+            WITH page AS (
+                {page_query}
+            ), ranked AS (
+                SELECT bins.*,
+                       ROW_NUMBER() OVER (PARTITION BY bins.vendor_id ORDER BY bins.product_name, bins.bin_id) AS position,
+                       COUNT(*) OVER (PARTITION BY bins.vendor_id) AS bin_count
+                FROM bins WHERE bins.vendor_id IN (SELECT vendor_id FROM page)
+            )
+            SELECT page.vendor_id, page.vendor_name, page.vendor_email, ranked.bin_count,
+                   ranked.bin_id, ranked.vendor_id, ranked.product_name, ranked.stock, ranked.unit_price, ranked.price_code
+            FROM page LEFT JOIN ranked ON ranked.vendor_id = page.vendor_id AND ranked.position <= ?
+            ORDER BY page.vendor_id, ranked.position
+            """,
+            (*page_params, bin_limit)
+        )
+        vendors = database.identity_map('vendors')
+        storefront: list[Vendor.Storefront] = []
+        for row in rows:
+            if not storefront or storefront[-1].vendor.vendor_id != row[0]:
+                vendor = vendors.setdefault(row[0], cls(*row[:3]))
+                storefront.append(Vendor.Storefront(vendor, [], row[3] or 0))
+            if row[4] is not None:
+                storefront[-1].bins.append(Bin(*row[4:]))
+        return storefront[:page_size], len(storefront) > page_size
 
     @classmethod
     def current_user(cls) -> Optional['Vendor']:
-        """Convenience function for accessing the current logged in vendor."""
+        """
+        Convenience function for accessing the current logged in vendor.
+        The vendor loaded by Flask-Login is kept in the request's identity map, so this does not query the database.
+        """
         return cls.get(current_user.get_id())
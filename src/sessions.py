@@ -0,0 +1,89 @@
+import secrets
+from datetime import datetime
+from typing import Optional
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from itsdangerous import BadSignature, Signer
+
+import database
+
+
+class SQLiteSession(SecureCookieSession):
+    """A session whose data is kept in the database. Only its id is sent to the client."""
+
+    def __init__(self, initial=None, session_id: Optional[str] = None):
+        super().__init__(initial)
+        self.session_id = session_id
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """
+    Stores sessions in the sessions table of the app's database instead of the session cookie.
+    The cookie only holds the signed session id, so its size does not grow with the session, e.g. a large cart.
+    Sessions expire after the app's PERMANENT_SESSION_LIFETIME.
+    """
+
+    serializer = TaggedJSONSerializer()
+    session_class = SQLiteSession
+
+    @staticmethod
+    def _get_signer(app) -> Signer:
+        return Signer(app.secret_key, salt='sqlite-session')
+
+    def open_session(self, app, request) -> SQLiteSession:
+        signed_id = request.cookies.get(app.session_cookie_name)
+        if signed_id:
+            try:
+                session_id = self._get_signer(app).unsign(signed_id).decode()
+            except BadSignature:
+                return self.session_class()
+            data = database.get_db().execute(
+                """SELECT data FROM sessions WHERE session_id = ? AND expires_at > ?""", (session_id, datetime.now())
+            ).fetchone()
+            if data is not None:
+                return self.session_class(self.serializer.loads(data['data']), session_id)
+        return self.session_class()
+
+    def save_session(self, app, session: SQLiteSession, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                if session.session_id is not None:
+                    with database.writer() as db:
+                        db.execute("""DELETE FROM sessions WHERE session_id = ?""", (session.session_id,))
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        new_session = session.session_id is None
+        if new_session:
+            session.session_id = secrets.token_urlsafe(32)
+        if self.should_set_cookie(app, session):
+            with database.writer() as db:
+                if new_session:
+                    # New sessions are rare enough to also clear out the expired ones.
+                    db.execute("""DELETE FROM sessions WHERE expires_at <= ?""", (datetime.now(),))
+                db.execute(
+                    """INSERT INTO sessions(session_id, data, expires_at) VALUES (?, ?, ?)
+                       ON CONFLICT(session_id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at""",
+                    (session.session_id, self.serializer.dumps(dict(session)), datetime.now() + app.permanent_session_lifetime)
+                )
+            response.set_cookie(
+                app.session_cookie_name,
+                self._get_signer(app).sign(session.session_id.encode()).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+
+
+def init_app(app):
+    """Keeps sessions in the app's database if SESSION_BACKEND is 'sqlite'. Otherwise the default cookie sessions are used."""
+    if app.config.get('SESSION_BACKEND') == 'sqlite':
+        app.logger.info('Sessions are stored in the database.')
+        app.session_interface = SQLiteSessionInterface()
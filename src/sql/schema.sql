@@ -48,9 +48,9 @@ CREATE TABLE IF NOT EXISTS orders (
 CREATE TABLE IF NOT EXISTS transactions (
     -- Used as a store of all transactions from customers.
 
-    -- Other consideration: possibly store price of item and item purchased instead of the bin id
-    -- at the time of purchase to retain sales information regarding the transaction in case information
-    -- changes before a vendor goes to generate an analysis report.
+    -- The price is stored at the time of purchase so reports keep the price the item was sold at.
+    -- Other consideration: possibly store the item purchased instead of the bin id to retain the rest of the
+    -- sales information regarding the transaction in case it changes before a vendor generates an analysis report.
 
     order_id TEXT NOT NULL,                 -- The id of the order. Used to identify the customer as well.
     bin_id TEXT NOT NULL,                   -- The id of the bin. Used to identify the product purchased and what vendor was purchased from
@@ -59,7 +59,87 @@ CREATE TABLE IF NOT EXISTS transactions (
     time_of_sale DATETIME NOT NULL,         -- Time of transaction.
     transaction_filled_at DATETIME,         -- Indicates when the vendor completed filling this single transaction. Can be used in conjunction with time_of_purchase
                                             -- to find the average time it takes for a vendor to fill an order.
+    unit_price FLOAT,                       -- The bin's unit price at the time of sale. Recorded by the record_sale_price trigger.
+    price_code TEXT,                        -- The currency of unit_price. Both are NULL only for sales of bins removed before prices were recorded.
+    stock_reserved BOOLEAN NOT NULL DEFAULT FALSE,  -- TRUE if checkout took units_purchased out of the bin's stock. Sales placed before checkout
+                                                    -- reserved stock were never taken out of it.
     PRIMARY KEY(order_id, bin_id),
     FOREIGN KEY(order_id) REFERENCES orders(order_id),
     FOREIGN KEY(bin_id) REFERENCES bins(bin_id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    -- Server side sessions. Only used when the app's SESSION_BACKEND is 'sqlite'.
+    session_id TEXT PRIMARY KEY,        -- The random id of the session. The session cookie holds it signed.
+    data TEXT NOT NULL,                 -- The serialized session.
+    expires_at DATETIME NOT NULL        -- When the session stops being valid.
+);
+CREATE TABLE IF NOT EXISTS sales_hourly (
+    -- Filled sales of each bin rolled up per hour of sale. Maintained by the roll_up_* triggers below.
+    -- Revenue uses the price each transaction was sold at.
+    vendor_id INT NOT NULL,             -- The vendor that owns the bin
+    bin_id TEXT NOT NULL,               -- The bin sold from
+    hour DATETIME NOT NULL,             -- The start of the hour the sales were made in. i.e. 'YYYY-MM-DD HH:00:00'
+    price_code TEXT NOT NULL,           -- The currency of revenue
+    units_sold FLOAT NOT NULL,          -- Units sold from the bin within the hour
+    revenue FLOAT NOT NULL,             -- Money made from the units sold
+    PRIMARY KEY(vendor_id, hour, bin_id, price_code)
+);
+
+CREATE TABLE IF NOT EXISTS sales_daily (
+    -- Same as sales_hourly, rolled up per day of sale.
+    vendor_id INT NOT NULL,
+    bin_id TEXT NOT NULL,
+    day DATE NOT NULL,                  -- The day the sales were made on. i.e. 'YYYY-MM-DD'
+    price_code TEXT NOT NULL,
+    units_sold FLOAT NOT NULL,
+    revenue FLOAT NOT NULL,
+    PRIMARY KEY(vendor_id, day, bin_id, price_code)
+);
+
+-- Records the price a transaction was sold at, so later price changes never alter past sales.
+CREATE TRIGGER IF NOT EXISTS record_sale_price AFTER INSERT ON transactions
+WHEN NEW.unit_price IS NULL OR NEW.price_code IS NULL
+BEGIN
+    UPDATE transactions SET (unit_price, price_code) = (SELECT unit_price, price_code FROM bins WHERE bin_id = NEW.bin_id)
+    WHERE order_id = NEW.order_id AND bin_id = NEW.bin_id;
+END;
+
+-- Keeps the sales rollups up to date as transactions are filled, or unfilled again, at the price they were sold at.
+-- Dropped and created again so databases created with earlier versions of the triggers pick up changes to them.
+DROP TRIGGER IF EXISTS roll_up_filled_transaction;
+CREATE TRIGGER roll_up_filled_transaction AFTER UPDATE OF transaction_filled ON transactions
+WHEN NEW.transaction_filled AND NOT OLD.transaction_filled
+BEGIN
+    INSERT INTO sales_hourly(vendor_id, bin_id, hour, price_code, units_sold, revenue)
+    SELECT vendor_id, bin_id, strftime('%Y-%m-%d %H:00:00', NEW.time_of_sale), NEW.price_code, NEW.units_purchased, NEW.units_purchased * NEW.unit_price
+    FROM bins WHERE bin_id = NEW.bin_id
+    ON CONFLICT DO UPDATE SET units_sold = units_sold + excluded.units_sold, revenue = revenue + excluded.revenue;
+    INSERT INTO sales_daily(vendor_id, bin_id, day, price_code, units_sold, revenue)
+    SELECT vendor_id, bin_id, date(NEW.time_of_sale), NEW.price_code, NEW.units_purchased, NEW.units_purchased * NEW.unit_price
+    FROM bins WHERE bin_id = NEW.bin_id
+    ON CONFLICT DO UPDATE SET units_sold = units_sold + excluded.units_sold, revenue = revenue + excluded.revenue;
+END;
+
+DROP TRIGGER IF EXISTS roll_up_unfilled_transaction;
+CREATE TRIGGER roll_up_unfilled_transaction AFTER UPDATE OF transaction_filled ON transactions
+WHEN OLD.transaction_filled AND NOT NEW.transaction_filled
+BEGIN
+    UPDATE sales_hourly SET units_sold = units_sold - OLD.units_purchased, revenue = revenue - OLD.units_purchased * OLD.unit_price
+    WHERE (vendor_id, hour, bin_id, price_code) = (
+        SELECT vendor_id, strftime('%Y-%m-%d %H:00:00', OLD.time_of_sale), bin_id, OLD.price_code FROM bins WHERE bin_id = OLD.bin_id
+    );
+    UPDATE sales_daily SET units_sold = units_sold - OLD.units_purchased, revenue = revenue - OLD.units_purchased * OLD.unit_price
+    WHERE (vendor_id, day, bin_id, price_code) = (
+        SELECT vendor_id, date(OLD.time_of_sale), bin_id, OLD.price_code FROM bins WHERE bin_id = OLD.bin_id
+    );
+END;
+
+-- Secondary indexes. Every lookup issued by the models must be able to SEARCH instead of SCAN a table.
+-- tests/test_query_plans.py checks the query plan of each model query against these.
+CREATE INDEX IF NOT EXISTS bins_by_vendor ON bins(vendor_id, bin_id);                                  -- Vendor.bins, joins from a vendor to its bins
+CREATE INDEX IF NOT EXISTS transactions_by_bin ON transactions(bin_id, order_id, time_of_sale);        -- Joins from bins to the transactions selling them
+CREATE INDEX IF NOT EXISTS pending_transactions ON transactions(bin_id, order_id, units_purchased) WHERE NOT transaction_filled;  -- Vendor.pending_stock
+CREATE INDEX IF NOT EXISTS orders_by_customer ON orders(customer_id);                                  -- Orders belonging to a customer
+CREATE INDEX IF NOT EXISTS market_map_by_neighbor ON market_map(neighbor_bin_id, vendor_bin_id);       -- Edges ending at a bin. The primary key covers edges starting at a bin.
+CREATE INDEX IF NOT EXISTS sessions_by_expiry ON sessions(expires_at);                                 -- Clearing out expired sessions
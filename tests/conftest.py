@@ -6,6 +6,7 @@ import pytest
 from werkzeug.security import generate_password_hash
 
 import database
+import models
 from app import create_app
 from models import MarketMap
 
@@ -19,6 +20,7 @@ def app():
         database.init_db()
     yield app
 
+    database.close_pools(app)
     os.close(db_fd)
     os.unlink(db_path)
 
@@ -60,6 +62,7 @@ def mock_bins(mock_login):
                 data
             )
         db.commit()
+        models.init_product_index()
     yield mock_login
 
 
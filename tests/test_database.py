@@ -3,6 +3,7 @@ import sqlite3
 import pytest
 
 import database
+from app import create_app
 
 
 def test_get_close_db(app):
@@ -12,7 +13,71 @@ def test_get_close_db(app):
         db = database.get_db()
         assert db is database.get_db()
 
+    # The connection is kept open by the pool and handed to the thread's next request.
+    with app.app_context():
+        assert database.get_db() is db
+        db.execute('SELECT 1')
+
+    database.close_pools(app)
+    with pytest.raises(sqlite3.ProgrammingError) as err:
+        db.execute('SELECT 1')
+
+    assert 'closed' in str(err.value)
+
+
+def test_unpooled_close_db(app):
+    app.config['DATABASE_POOL_SIZE'] = 0
+    database.close_pools(app)
+    app.extensions.pop('database_pool')
+    app.extensions.pop('database_read_pool')
+    with app.app_context():
+        db = database.get_db()
+        assert db is database.get_db()
+
     with pytest.raises(sqlite3.ProgrammingError) as err:
         db.execute('SELECT 1')
 
     assert 'closed' in str(err.value)
+
+
+def test_pool(app):
+    pool = database.get_pool(app)
+    with app.app_context():
+        db = database.get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA synchronous').fetchone()[0] == 1     # NORMAL
+        db.execute("""INSERT INTO customers(customer_id, newsletter_subscription) VALUES ('left open', 0)""")
+
+    info = pool.pool_info()
+    with app.app_context():
+        # Uncommitted changes of a finished request are rolled back.
+        assert database.get_db().execute("""SELECT * FROM customers""").fetchall() == []
+    assert pool.pool_info() == info._replace(reused=info.reused + 1)
+    assert info.connections == 1 and info.maxsize == app.config['DATABASE_POOL_SIZE']
+
+
+def test_read_and_write_handles(app):
+    with app.app_context():
+        read_db = database.get_read_db()
+        assert read_db is not database.get_db()
+        with pytest.raises(sqlite3.OperationalError):
+            read_db.execute("""INSERT INTO customers(customer_id, newsletter_subscription) VALUES ('reader', 0)""")
+
+        with database.writer() as db:
+            db.execute("""INSERT INTO customers(customer_id, newsletter_subscription) VALUES ('writer', 0)""")
+        assert [row[0] for row in read_db.execute("""SELECT customer_id FROM customers""")] == ['writer']
+
+        # A failed write is rolled back as a whole.
+        with pytest.raises(sqlite3.IntegrityError):
+            with database.writer() as db:
+                db.execute("""INSERT INTO customers(customer_id, newsletter_subscription) VALUES ('failed', 0)""")
+                db.execute("""INSERT INTO customers(customer_id, newsletter_subscription) VALUES ('writer', 0)""")
+        assert read_db.execute("""SELECT COUNT(*) FROM customers""").fetchone()[0] == 1
+
+
+def test_read_handle_path_with_uri_characters(tmp_path):
+    db_path = tmp_path / 'market #1?%.sqlite'
+    app = create_app({'TESTING': True, 'DATABASE': str(db_path)})
+    with app.app_context():
+        assert database.get_read_db().execute("""SELECT COUNT(*) FROM bins""").fetchone()[0] == 0
+    database.close_pools(app)
@@ -1,8 +1,12 @@
+import re
+from datetime import datetime, timedelta
+
 import pytest
 
 import database
+import models
 from models import Bin, Vendor, PriceCode
-from models.orders import Order, Transaction
+from models.orders import CartItem, CustomerCart, Order, Transaction
 
 
 @pytest.mark.parametrize(
@@ -121,3 +125,268 @@ def test_get_all_orders(mock_orders, auth, client, vendor_id, login, orders):
                 for transaction in transactions:
                     assert transaction in orders_vendor_has[order]
             auth.logout()
+
+
+def test_get_all_orders_single_query(mock_orders, auth, client):
+    with mock_orders.app_context():
+        with client:
+            auth.login()
+            vendor = Vendor.current_user()
+            statements = []
+            database.get_read_db().set_trace_callback(statements.append)
+            orders = vendor.get_all_orders()
+            database.get_read_db().set_trace_callback(None)
+            assert len(orders) == 2
+            assert len([statement for statement in statements if 'transactions' in statement]) == 1
+            auth.logout()
+
+
+@pytest.mark.parametrize(
+    ('filled', 'limit', 'offset', 'order_ids'),
+    (
+        (None, None, 0, [database.gen_uuid(1), database.gen_uuid(2)]),
+        (None, 1, 0, [database.gen_uuid(1)]),
+        (None, 1, 1, [database.gen_uuid(2)]),
+        (False, None, 1, [database.gen_uuid(2)]),
+        (True, None, 0, [])
+    )
+)
+def test_get_all_orders_filtered(mock_orders, auth, client, filled, limit, offset, order_ids):
+    with mock_orders.app_context():
+        with client:
+            auth.login()
+            orders = Vendor.current_user().get_all_orders(filled=filled, limit=limit, offset=offset)
+            assert [order.order_id for order in orders] == order_ids
+            for order, transactions in orders.items():
+                assert all(transaction.order_id == order.order_id for transaction in transactions)
+            auth.logout()
+
+
+def test_get_bin_identity_map(mock_map, auth, client):
+    with mock_map.app_context():
+        with client:
+            auth.login()
+            vendor = Vendor.current_user()
+            statements = []
+            database.get_db().set_trace_callback(statements.append)
+            _bin = vendor.get_bin(database.gen_uuid(1))
+            assert vendor.get_bin(database.gen_uuid(1)) is _bin
+            assert len([statement for statement in statements if 'FROM bins' in statement]) == 1
+
+            # Bins of other vendors are never returned, even if they were loaded during the request.
+            assert Vendor.get(2).get_bin(database.gen_uuid(1)) is None
+            assert vendor.get_bin(database.gen_uuid(4)) is None
+
+            updated = vendor.update_bin(database.gen_uuid(1), stock=1.0)
+            assert updated is _bin and vendor.get_bin(database.gen_uuid(1)).stock == 1.0
+            vendor.remove_bin(database.gen_uuid(1))
+            assert vendor.get_bin(database.gen_uuid(1)) is None
+            database.get_db().set_trace_callback(None)
+            auth.logout()
+
+
+def test_vendor_identity_map(mock_bins, auth, client):
+    with mock_bins.app_context():
+        with client:
+            auth.login()
+            statements = []
+            database.get_db().set_trace_callback(statements.append)
+            vendor = Vendor.current_user()
+            vendor.create_bin('lemon', 1.0, 1.0, PriceCode.USD)
+            assert vendor.is_authenticated and Vendor.current_user() is vendor
+            assert not any('FROM vendors' in statement for statement in statements)
+
+            updated = vendor.update_details(vendor_name='Renamed')
+            assert updated.vendor_name == 'Renamed' and updated.vendor_email == vendor.vendor_email
+            assert Vendor.current_user().vendor_name == 'Renamed'
+            assert Vendor.get(2).update_details(vendor_name='Nope') is None
+            database.get_db().set_trace_callback(None)
+            auth.logout()
+
+
+def test_update_bin_single_statement(mock_bins, auth, client):
+    with mock_bins.app_context():
+        with client:
+            auth.login()
+            vendor = Vendor.current_user()
+            statements = []
+            database.get_db().set_trace_callback(statements.append)
+            _bin = vendor.update_bin(database.gen_uuid(1), product_name='green apple', stock=0.0)
+            database.get_db().set_trace_callback(None)
+            assert [s.split()[0] for s in statements if 'bins' in s] == ['UPDATE']
+            assert (_bin.product_name, _bin.stock, _bin.unit_price) == ('green apple', 0.0, 5.0)
+            assert vendor.update_bin(database.gen_uuid(4), stock=1.0) is None
+            auth.logout()
+
+
+@pytest.mark.parametrize(
+    ('delta', 'expected_stock'),
+    (
+        (2.5, 7.5),
+        (-5.0, 0.0),
+        (-5.5, None),
+    )
+)
+def test_adjust_stock(mock_bins, auth, client, delta, expected_stock):
+    with mock_bins.app_context():
+        with client:
+            auth.login()
+            vendor = Vendor.current_user()
+            _bin = vendor.adjust_stock(database.gen_uuid(1), delta)
+            if expected_stock is None:
+                assert _bin is None
+                assert vendor.get_bin(database.gen_uuid(1)).stock == 5.0
+            else:
+                assert _bin.stock == expected_stock
+                assert vendor.get_bin(database.gen_uuid(1)) is _bin
+                assert models.get_product_index().get(_bin.bin_id).stock == expected_stock
+            assert vendor.adjust_stock(database.gen_uuid(4), 1.0) is None
+            auth.logout()
+
+
+def test_pending_stock(mock_orders, auth, client):
+    with mock_orders.app_context():
+        with client:
+            auth.login()
+            vendor = Vendor.current_user()
+            statements = []
+            database.get_read_db().set_trace_callback(statements.append)
+            pending = vendor.pending_stock()
+            database.get_read_db().set_trace_callback(None)
+            assert len(statements) == 1
+            # The mock orders were placed without checkout, so none of their units were taken out of stock.
+            assert [(p.product_name, p.stock, p.pending_units, p.pending_transactions, p.on_hand, p.shortfall) for p in pending] == [
+                ('apple', 5.0, 6.0, 2, 5.0, 1.0),
+                ('grape', 3.0, 6.0, 1, 3.0, 3.0),
+                ('orange', 3.0, 5.0, 1, 3.0, 2.0),
+            ]
+            assert Vendor.get(3).pending_stock() is None
+
+            vendor.fill_transaction(database.gen_uuid(2), database.gen_uuid(1))
+            vendor.adjust_stock(database.gen_uuid(3), 3.0)
+            assert [(p.product_name, p.pending_units, p.on_hand, p.shortfall) for p in vendor.pending_stock()] == [
+                ('apple', 3.0, 5.0, 0.0),
+                ('grape', 6.0, 6.0, 0.0),
+                ('orange', 5.0, 3.0, 2.0),
+            ]
+            auth.logout()
+
+
+def test_pending_stock_after_checkout(mock_bins, auth, client):
+    with mock_bins.app_context():
+        with client:
+            apple = Vendor.get(1).get_bin(database.gen_uuid(1))
+            customer = CustomerCart()
+            customer.cart_items[apple.bin_id] = CartItem(item_bin=apple, quantity=4.0)
+            with client.session_transaction() as session:
+                session['customer'] = customer.compact()
+            client.post('/checkout')
+
+            # Checkout took the 4 units out of the bin's stock, so they are not counted against it a second time.
+            auth.login()
+            vendor = Vendor.current_user()
+            assert [(p.product_name, p.stock, p.pending_units, p.on_hand, p.shortfall) for p in vendor.pending_stock()] == [
+                ('apple', 1.0, 4.0, 5.0, 0.0)
+            ]
+            response = client.get('/inventory/sales')
+            assert b'On hand: 5.0, of which 1.0 left for new orders' in response.data
+            assert b'Restock needed' not in response.data
+
+            # A sale placed before checkout reserved stock still counts against the bin's stock.
+            with database.writer() as db:
+                db.execute(
+                    """INSERT INTO transactions(order_id, bin_id, units_purchased, transaction_filled, time_of_sale)
+                       VALUES (?, ?, 3.0, FALSE, ?)""",
+                    (database.gen_uuid(9), apple.bin_id, datetime.now())
+                )
+            assert [(p.product_name, p.stock, p.pending_units, p.on_hand, p.shortfall) for p in vendor.pending_stock()] == [
+                ('apple', 1.0, 7.0, 5.0, 2.0)
+            ]
+            assert b'Restock needed: 2.0 units short' in client.get('/inventory/sales').data
+            auth.logout()
+
+
+def test_fill_transactions(mock_orders, auth, client):
+    with mock_orders.app_context():
+        with client:
+            auth.login()
+            vendor = Vendor.current_user()
+            statements = []
+            database.get_db().set_trace_callback(statements.append)
+            filled = vendor.fill_transactions([
+                (database.gen_uuid(1), database.gen_uuid(1)),
+                (database.gen_uuid(1), database.gen_uuid(2)),
+                (database.gen_uuid(2), database.gen_uuid(1)),
+                (database.gen_uuid(3), database.gen_uuid(6)),     # Another vendor's bin.
+            ])
+            database.get_db().set_trace_callback(None)
+            assert sorted(filled) == sorted([
+                (database.gen_uuid(1), database.gen_uuid(1)),
+                (database.gen_uuid(1), database.gen_uuid(2)),
+                (database.gen_uuid(2), database.gen_uuid(1)),
+            ])
+            # Triggers report their statement again for every row, so only distinct statements are counted.
+            updates = dict.fromkeys(s for s in statements if re.match(r'UPDATE (transactions|orders)\b', s))
+            assert [s.split()[1] for s in updates] == ['transactions', 'orders']
+
+            db = database.get_db()
+            orders = {row['order_id']: row for row in db.execute("""SELECT * FROM orders""")}
+            assert orders[database.gen_uuid(2)]['order_filled'] and orders[database.gen_uuid(2)]['order_filled_at'] is not None
+            # Order 1 still has the grape transaction pending, and order 3 belongs to another vendor.
+            assert not orders[database.gen_uuid(1)]['order_filled'] and not orders[database.gen_uuid(3)]['order_filled']
+            assert db.execute(
+                """SELECT COUNT(*) FROM transactions WHERE transaction_filled AND transaction_filled_at IS NOT NULL"""
+            ).fetchone()[0] == 3
+            assert vendor.fill_latency().count == 3
+            assert vendor.sales_report(datetime(2000, 1, 1), datetime.now() + timedelta(days=1)).units_sold == 11.0
+
+            assert vendor.fill_orders([database.gen_uuid(1), database.gen_uuid(3)]) == [(database.gen_uuid(1), database.gen_uuid(3))]
+            assert db.execute("""SELECT order_filled FROM orders WHERE order_id = ?""", (database.gen_uuid(1),)).fetchone()[0]
+            assert vendor.fill_transactions([]) == [] and vendor.fill_orders([]) == []
+            assert Vendor.get(3).fill_orders([database.gen_uuid(3)]) == []
+            auth.logout()
+
+
+def test_sales_dashboard(mock_orders, auth, client):
+    with mock_orders.app_context():
+        with client:
+            auth.login()
+            response = client.get('/inventory/sales')
+            assert b'On hand: 5.0, of which 5.0 left for new orders' in response.data
+            assert b'Restock needed: 1.0 units short' in response.data
+            assert f'value="{database.gen_uuid(1)}/{database.gen_uuid(3)}"'.encode() in response.data
+            # Other vendors' transactions are never listed.
+            assert database.gen_uuid(3).encode() + b'/' not in response.data
+
+            response = client.post(
+                '/inventory/sales',
+                data={'order': [database.gen_uuid(2)], 'transaction': [f'{database.gen_uuid(1)}/{database.gen_uuid(3)}']},
+                follow_redirects=True
+            )
+            assert b'Filled 2 transactions.' in response.data
+            pending = Vendor.current_user().pending_stock()
+            assert [(p.product_name, p.pending_units) for p in pending] == [('apple', 3.0), ('orange', 5.0)]
+            auth.logout()
+            assert client.get('/inventory/sales').status_code == 302
+
+
+def test_plan_pick_waves(mock_map, mock_orders, auth, client):
+    with mock_orders.app_context():
+        models.init_market()
+        with client:
+            auth.login()
+            waves = Vendor.current_user().plan_pick_waves()
+            assert [wave.order_ids for wave in waves] == [[database.gen_uuid(1), database.gen_uuid(2)]]
+            assert {stall.bin_id: units for stall, units in waves[0].quantities.items()} == {
+                database.gen_uuid(1): 6.0, database.gen_uuid(2): 5.0, database.gen_uuid(3): 6.0
+            }
+            assert waves[0].route.distance == 15.5
+            assert Vendor.get(3).plan_pick_waves() is None
+
+            response = client.get('/inventory/waves')
+            assert b'2 orders, 15.5 to walk' in response.data and b'apple: pick 6.0 units' in response.data
+            auth.logout()
+
+        # The whole market is planned across vendors.
+        waves = models.plan_pick_waves()
+        assert sorted(order_id for wave in waves for order_id in wave.order_ids) == [database.gen_uuid(i) for i in (1, 2, 3)]
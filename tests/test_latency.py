@@ -0,0 +1,85 @@
+import random
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+import models
+from models import Vendor
+from models.latency import DDSketch, FillLatencies
+
+
+@pytest.mark.parametrize('q', (0.0, 0.25, 0.5, 0.95, 0.99, 1.0))
+def test_sketch_quantiles(q):
+    rng = random.Random(3)
+    values = sorted(rng.lognormvariate(6, 1.5) for _ in range(5000))
+    sketch = DDSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+    exact = values[int(q * (len(values) - 1))]
+    assert sketch.quantile(q) == pytest.approx(exact, rel=0.01)
+    assert sketch.mean == pytest.approx(sum(values) / len(values))
+
+
+def test_sketch_merge():
+    rng = random.Random(5)
+    whole, first, second = DDSketch(), DDSketch(), DDSketch()
+    for i in range(1000):
+        value = rng.expovariate(1 / 600)
+        whole.add(value)
+        (first if i % 3 else second).add(value)
+    first.merge(second)
+    assert [first.quantile(q) for q in (0.5, 0.95, 0.99)] == [whole.quantile(q) for q in (0.5, 0.95, 0.99)]
+    assert first.count == whole.count
+    assert DDSketch().quantile(0.5) is None
+    with pytest.raises(ValueError):
+        first.merge(DDSketch(relative_accuracy=0.05))
+
+
+def test_fill_latency(mock_orders, auth, client):
+    with mock_orders.app_context():
+        with client:
+            auth.login()
+            vendor = Vendor.current_user()
+            assert vendor.fill_latency() is None
+            for bin_number in (1, 2, 3):
+                assert vendor.fill_transaction(database.gen_uuid(1), database.gen_uuid(bin_number))
+            latency = vendor.fill_latency()
+            assert latency.count == 3 and 0 <= latency.p50 <= latency.p95 <= latency.p99
+            assert vendor.fill_latency(database.gen_uuid(1)).count == 1
+            assert vendor.fill_latency(database.gen_uuid(6)) is None
+            assert Vendor.get(2).fill_latency() is None
+
+            # Loading the sketches from the database gives the same result as updating them as transactions are filled.
+            loaded = FillLatencies()
+            loaded.load()
+            assert loaded.vendor(1) == latency
+            statements = []
+            for db in (database.get_db(), database.get_read_db()):
+                db.set_trace_callback(statements.append)
+            assert b'Fill time of all 3 filled transactions' in client.get('/inventory/report').data
+            for db in (database.get_db(), database.get_read_db()):
+                db.set_trace_callback(None)
+            # Fill times of the reported bins are read from the sketches, not by loading each bin.
+            assert not any(re.match(r'\s*SELECT \* FROM bins', statement) for statement in statements)
+            auth.logout()
+
+
+def test_fill_latency_load(mock_orders):
+    with mock_orders.app_context():
+        db = database.get_db()
+        sold_at = datetime(2021, 11, 20, 9)
+        for minutes, (order_number, bin_number) in zip((5, 10, 60), ((1, 1), (1, 2), (2, 1))):
+            db.execute(
+                """UPDATE transactions SET transaction_filled = TRUE, time_of_sale = ?, transaction_filled_at = ?
+                   WHERE order_id = ? AND bin_id = ?""",
+                (sold_at, sold_at + timedelta(minutes=minutes), database.gen_uuid(order_number), database.gen_uuid(bin_number))
+            )
+        db.commit()
+        models.init_fill_latencies()
+        latency = models.get_fill_latencies().vendor(1)
+        assert latency.count == 3
+        assert latency.mean == pytest.approx(25 * 60)
+        assert latency.p50 == pytest.approx(10 * 60, rel=0.01)
+        assert models.get_fill_latencies().bin(database.gen_uuid(1)).mean == pytest.approx(32.5 * 60)
@@ -1,5 +1,14 @@
+import os
+import random
+import sys
+import threading
+import time
+
+import pytest
+
 import database
-from models import MarketMap
+from models import MarketMap, routing
+from models.orders import Transaction
 
 
 def test_map_creation(mock_map):
@@ -53,3 +62,365 @@ def test_remove_stall(mock_map):
             MarketMap.VendorStall(2, database.gen_uuid(5)),     # Vendor b: soy sauce
             MarketMap.VendorStall(1, database.gen_uuid(3))      # Vendor a: grape
         ]
+
+
+def test_path_search_resumes(mock_map):
+    with mock_map.app_context():
+        m_map = MarketMap()
+        rice = MarketMap.VendorStall(2, database.gen_uuid(4))
+        # A near target only settles part of the map.
+        path, distance = m_map.path_to_bin(rice, MarketMap.VendorStall(1, database.gen_uuid(1)))
+        assert distance == 5.0
+        assert path == [rice, MarketMap.VendorStall(1, database.gen_uuid(1))]
+
+        # A far target resumes the search from the same starting stall.
+        path, distance = m_map.path_to_bin(rice, MarketMap.VendorStall(3, database.gen_uuid(6)))
+        assert distance == 14.5
+        assert path == [
+            rice,                                               # Vendor b: rice
+            MarketMap.VendorStall(1, database.gen_uuid(1)),     # Vendor a: apple
+            MarketMap.VendorStall(1, database.gen_uuid(2)),     # Vendor a: orange
+            MarketMap.VendorStall(3, database.gen_uuid(6))      # Vendor c: carrot
+        ]
+
+        distance_to_stall, _ = m_map.calc_paths(rice)
+        assert len(distance_to_stall) == 7
+        assert distance_to_stall[MarketMap.VendorStall(3, database.gen_uuid(7))] == 19.8
+
+
+def test_path_cache_invalidation(mock_map):
+    with mock_map.app_context():
+        m_map = MarketMap(path_cache_size=2)
+        rice = MarketMap.VendorStall(2, database.gen_uuid(4))
+        carrot = MarketMap.VendorStall(3, database.gen_uuid(6))
+        assert m_map.path_to_bin(rice, carrot)[1] == 14.5
+        assert m_map.path_to_bin(rice, carrot)[1] == 14.5
+        assert m_map.path_cache_info().hits == 1
+        assert m_map.path_cache_info().misses == 1
+
+        # Removing orange disconnects carrot from the rest of the map. The cached route must not be served.
+        version = m_map.version
+        assert m_map.remove_stall(MarketMap.VendorStall(1, database.gen_uuid(2)))
+        assert m_map.version > version
+        assert m_map.path_to_bin(rice, carrot) == ([], float('inf'))
+        assert m_map.path_cache_info().misses == 2
+
+        # The cache never grows past its size bound.
+        for stall in m_map.stalls:
+            m_map.path_to_bin(stall, carrot)
+        assert m_map.path_cache_info().currsize == 2
+
+
+def test_remove_stall_added_after_cached_paths(mock_map):
+    with mock_map.app_context():
+        m_map = MarketMap()
+        rice = MarketMap.VendorStall(2, database.gen_uuid(4))
+        carrot = MarketMap.VendorStall(3, database.gen_uuid(6))
+        assert m_map.path_to_bin(rice, carrot)[1] == 14.5
+
+        MarketMap.cache_stall('stand-alone', 3)
+        stall = MarketMap.stall_of('stand-alone')
+        assert m_map.add_stall(stall)
+        assert m_map.remove_stall(stall)
+        assert stall not in m_map.stalls
+        assert m_map.path_to_bin(rice, carrot)[1] == 14.5
+        assert m_map.path_cache_info().hits == 1
+
+
+def test_edges(mock_map):
+    with mock_map.app_context():
+        m_map = MarketMap()
+        distances = {frozenset((edge.vendor_bin_id, edge.neighbor_bin_id)): edge.distance for edge in m_map.edges}
+        assert distances[frozenset((database.gen_uuid(1), database.gen_uuid(4)))] == 5.0
+        assert distances[frozenset((database.gen_uuid(5), database.gen_uuid(7)))] == 12.3
+        assert sum(distances.values()) == 44.8
+
+
+def test_plan_pick_route(mock_map):
+    with mock_map.app_context():
+        m_map = MarketMap()
+        order_id = database.gen_uuid(1)
+        transactions = [
+            Transaction(order_id, database.gen_uuid(1), 3.0),   # Vendor a: apple
+            Transaction(order_id, database.gen_uuid(2), 5.0),   # Vendor a: orange
+            Transaction(order_id, database.gen_uuid(3), 6.0)    # Vendor a: grape
+        ]
+        route = m_map.plan_pick_route(transactions)
+        expected_path = [
+            MarketMap.VendorStall(1, database.gen_uuid(2)),     # Vendor a: orange
+            MarketMap.VendorStall(1, database.gen_uuid(1)),     # Vendor a: apple
+            MarketMap.VendorStall(2, database.gen_uuid(5)),     # Vendor b: soy sauce
+            MarketMap.VendorStall(1, database.gen_uuid(3))      # Vendor a: grape
+        ]
+        # Without a starting stall the route may be walked in either direction.
+        assert route.distance == 15.5
+        assert route.path in (expected_path, expected_path[::-1])
+        assert set(route.stops) == {expected_path[0], expected_path[1], expected_path[3]}
+
+        route = m_map.plan_pick_route(transactions, from_stall=MarketMap.VendorStall(3, database.gen_uuid(7)))
+        assert route.path[0] == MarketMap.VendorStall(3, database.gen_uuid(7))
+        assert route.distance == pytest.approx(12.3 + 5.5 + 8.0 + 7.5)
+        assert route.unreachable == []
+
+        m_map.remove_stall(MarketMap.VendorStall(1, database.gen_uuid(2)))
+        route = m_map.plan_pick_route(transactions)
+        assert route.unreachable == [MarketMap.VendorStall(1, database.gen_uuid(2))]
+        assert route.distance == 8.0
+
+
+def test_plan_route_heuristic():
+    # Fifty points on a line: the only shortest open route walks them from one end to the other.
+    positions = [(i * 37) % 50 for i in range(50)]
+    matrix = [[abs(a - b) for b in positions] for a in positions]
+    route = routing.plan_route(matrix)
+    assert routing.route_length(route, matrix) == 49
+    assert sorted(route) == list(range(50))
+
+
+def test_precompute_all_pairs(mock_map, tmp_path):
+    with mock_map.app_context():
+        cache_file = str(tmp_path / 'market_paths.npz')
+        searched = MarketMap()
+        m_map = MarketMap()
+        m_map.precompute_all_pairs(cache_file)
+        assert m_map.has_all_pairs
+        for from_stall in m_map.stalls:
+            for to_stall in m_map.stalls:
+                assert m_map.path_to_bin(from_stall, to_stall) == searched.path_to_bin(from_stall, to_stall)
+        assert m_map.path_cache_info().misses == 0
+
+        # The saved matrices are reused by a map with the same layout.
+        saved_at = os.path.getmtime(cache_file)
+        reloaded = MarketMap()
+        reloaded.precompute_all_pairs(cache_file)
+        assert reloaded.has_all_pairs
+        assert os.path.getmtime(cache_file) == saved_at
+
+        # Changing the map drops the precomputed paths and routing falls back to searching.
+        m_map.remove_stall(MarketMap.VendorStall(1, database.gen_uuid(2)))
+        assert not m_map.has_all_pairs
+        path, distance = m_map.path_to_bin(MarketMap.VendorStall(2, database.gen_uuid(4)), MarketMap.VendorStall(3, database.gen_uuid(6)))
+        assert distance == float('inf')
+
+
+def test_incremental_path_updates(mock_map):
+    with mock_map.app_context():
+        m_map = MarketMap()
+        m_map.precompute_all_pairs()
+        searched = MarketMap()
+        rice = MarketMap.VendorStall(2, database.gen_uuid(4))
+        carrot = MarketMap.VendorStall(3, database.gen_uuid(6))
+        grape = MarketMap.VendorStall(1, database.gen_uuid(3))
+        assert searched.path_to_bin(rice, carrot)[1] == 14.5
+        searched.calc_paths(rice)
+
+        # A shortcut updates the cached tree and the precomputed paths.
+        for market_map in (m_map, searched):
+            assert market_map.add_edge(MarketMap.MapEdge(database.gen_uuid(4), database.gen_uuid(6), 1.0))
+            assert market_map.path_to_bin(rice, carrot) == ([rice, carrot], 1.0)
+            assert market_map.path_to_bin(carrot, grape)[1] == 14.0
+        assert m_map.has_all_pairs
+        assert searched.path_cache_info().misses == 2
+
+        # Removing a stall no shortest path passes through keeps the cached paths.
+        for market_map in (m_map, searched):
+            assert market_map.remove_stall(MarketMap.VendorStall(3, database.gen_uuid(7)))
+            assert market_map.path_to_bin(rice, grape)[1] == 13.0
+        assert m_map.has_all_pairs
+        assert searched.path_cache_info().misses == 2
+
+        # Lengthening an edge only drops the paths that used it.
+        for market_map in (m_map, searched):
+            assert market_map.add_edge(MarketMap.MapEdge(database.gen_uuid(4), database.gen_uuid(6), 20.0))
+            assert market_map.path_to_bin(rice, carrot)[1] == 14.5
+        assert not m_map.has_all_pairs
+        assert searched.path_cache_info().misses == 3
+
+
+
+def test_shared_between_threads(mock_map):
+    # A 20 x 20 grid of stalls with uneven aisles, routed by several requests at once.
+    rng = random.Random(7)
+    size = 20
+    bin_ids = [f'grid-{i}' for i in range(size * size)]
+    with mock_map.app_context():
+        for i, bin_id in enumerate(bin_ids):
+            MarketMap.cache_stall(bin_id, i // size)
+        edges = []
+        for i in range(size * size):
+            if i % size < size - 1:
+                edges.append(MarketMap.MapEdge(bin_ids[i], bin_ids[i + 1], rng.uniform(5.0, 15.0)))
+            if i + size < size * size:
+                edges.append(MarketMap.MapEdge(bin_ids[i], bin_ids[i + size], rng.uniform(5.0, 15.0)))
+        m_map, expected_map = MarketMap(from_database=False), MarketMap(from_database=False)
+        for edge in edges:
+            m_map.add_edge(edge)
+            expected_map.add_edge(edge)
+        stalls = [MarketMap.stall_of(bin_id) for bin_id in bin_ids]
+        sources = stalls[:4]
+        expected = {(a, b): expected_map.path_to_bin(a, b)[1] for a in sources for b in stalls}
+        transactions = [
+            Transaction(f'order-{o}', bin_id, 1.0) for o in range(60) for bin_id in rng.sample(bin_ids, rng.randint(1, 3))
+        ]
+
+        found, errors = {}, []
+
+        def route(seed: int):
+            # Every thread grows the same cached trees, each towards the stalls in its own order.
+            try:
+                for b in random.Random(seed).sample(stalls, len(stalls)):
+                    for a in sources:
+                        found[(seed, a, b)] = m_map.path_to_bin(a, b)[1]
+            except Exception as e:
+                errors.append(e)
+
+        def plan():
+            try:
+                for _ in range(3):
+                    waves = m_map.plan_pick_waves(transactions)
+                    assert sorted(o for wave in waves for o in wave.order_ids) == sorted({t.order_id for t in transactions})
+            except Exception as e:
+                errors.append(e)
+
+        def run(threads: list[threading.Thread], edit=None):
+            for thread in threads:
+                thread.start()
+            if edit is not None:
+                edit()
+            for thread in threads:
+                thread.join()
+
+        def lengthen_and_restore():
+            for edge in edges[:40]:
+                m_map.add_edge(MarketMap.MapEdge(edge.vendor_bin_id, edge.neighbor_bin_id, edge.distance + 100.0))
+                m_map.add_edge(edge)
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            run([threading.Thread(target=route, args=(seed,)) for seed in range(6)])
+            assert errors == []
+            assert all(distance == expected[(a, b)] for (_, a, b), distance in found.items())
+
+            # Waves are planned while the map changes and other requests route on it.
+            found.clear()
+            run([threading.Thread(target=plan), threading.Thread(target=route, args=(6,))], lengthen_and_restore)
+            assert errors == []
+        finally:
+            sys.setswitchinterval(switch_interval)
+        assert all(m_map.path_to_bin(a, b)[1] == pytest.approx(expected[(a, b)]) for a in sources for b in stalls)
+        MarketMap.cache_stalls_from_database()
+
+def test_plan_pick_waves(mock_map):
+    with mock_map.app_context():
+        m_map = MarketMap()
+        stall = {i: MarketMap.stall_of(database.gen_uuid(i)) for i in range(1, 8)}
+        transactions = [
+            Transaction(database.gen_uuid(1), database.gen_uuid(1), 2.0),
+            Transaction(database.gen_uuid(1), database.gen_uuid(2), 1.0),
+            Transaction(database.gen_uuid(2), database.gen_uuid(6), 1.0),
+            Transaction(database.gen_uuid(3), database.gen_uuid(3), 4.0),
+            Transaction(database.gen_uuid(4), database.gen_uuid(1), 1.0),
+            Transaction(database.gen_uuid(4), database.gen_uuid(5), 1.0),
+        ]
+        waves = m_map.plan_pick_waves(transactions)
+        assert len(waves) == 1
+        assert waves[0].order_ids == [database.gen_uuid(i) for i in (1, 2, 4, 3)]
+        assert waves[0].quantities == {stall[1]: 3.0, stall[2]: 1.0, stall[6]: 1.0, stall[3]: 4.0, stall[5]: 1.0}
+        assert set(waves[0].route.stops) == set(waves[0].quantities)
+
+        # Orders are batched with the closest orders first, and the oldest waiting order seeds each wave.
+        waves = m_map.plan_pick_waves(transactions, order_limit=2)
+        assert [wave.order_ids for wave in waves] == [
+            [database.gen_uuid(1), database.gen_uuid(2)],
+            [database.gen_uuid(3), database.gen_uuid(4)]
+        ]
+        assert waves[1].quantities == {stall[3]: 4.0, stall[1]: 1.0, stall[5]: 1.0}
+        assert waves[1].route.distance == 8.0
+        assert [wave.order_ids for wave in m_map.plan_pick_waves(transactions, stop_limit=3)] == \
+               [[database.gen_uuid(1), database.gen_uuid(2)], [database.gen_uuid(3), database.gen_uuid(4)]]
+
+        # Orders that can not be walked to from a wave get a wave of their own.
+        m_map.remove_stall(stall[6])
+        waves = m_map.plan_pick_waves(transactions)
+        assert [wave.order_ids for wave in waves] == [[database.gen_uuid(i) for i in (1, 4, 3)], [database.gen_uuid(2)]]
+        assert waves[1].route.unreachable == [stall[6]]
+        assert m_map.plan_pick_waves([]) == []
+
+
+def test_plan_pick_waves_many_orders(mock_map):
+    # A 15 x 15 grid of stalls, 10 apart, with 400 orders of 1 to 3 random stalls each.
+    rng = random.Random(3)
+    size = 15
+    bin_ids = [f'grid-{i}' for i in range(size * size)]
+    with mock_map.app_context():
+        for i, bin_id in enumerate(bin_ids):
+            MarketMap.cache_stall(bin_id, i // size)
+        m_map = MarketMap(from_database=False)
+        for i in range(size * size):
+            if i % size < size - 1:
+                m_map.add_edge(MarketMap.MapEdge(bin_ids[i], bin_ids[i + 1], 10.0))
+            if i + size < size * size:
+                m_map.add_edge(MarketMap.MapEdge(bin_ids[i], bin_ids[i + size], 10.0))
+        transactions = [
+            Transaction(f'order-{o}', bin_id, float(rng.randint(1, 4)))
+            for o in range(400) for bin_id in rng.sample(bin_ids, rng.randint(1, 3))
+        ]
+
+        waves = m_map.plan_pick_waves(transactions)
+        assert sorted(order_id for wave in waves for order_id in wave.order_ids) == sorted({t.order_id for t in transactions})
+        assert all(len(wave.order_ids) <= MarketMap.WAVE_ORDER_LIMIT for wave in waves)
+        assert all(len(wave.route.stops) <= MarketMap.WAVE_STOP_LIMIT for wave in waves)
+        assert sum(sum(wave.quantities.values()) for wave in waves) == sum(t.units_purchased for t in transactions)
+
+        # Walking each wave once is shorter than walking every order on its own.
+        orders = {}
+        for transaction in transactions:
+            orders.setdefault(transaction.order_id, []).append(transaction)
+        assert sum(wave.route.distance for wave in waves) < \
+               0.75 * sum(m_map.plan_pick_route(order).distance for order in orders.values())
+        MarketMap.cache_stalls_from_database()
+
+
+def test_plan_pick_waves_whole_market(mock_map):
+    # A 40 x 40 grid of stalls with uneven aisles, the size of a whole market, with 400 orders of 1 to 3 stalls each.
+    rng = random.Random(5)
+    size = 40
+    bin_ids = [f'grid-{i}' for i in range(size * size)]
+    with mock_map.app_context():
+        for i, bin_id in enumerate(bin_ids):
+            MarketMap.cache_stall(bin_id, i // size)
+        m_map = MarketMap(from_database=False)
+        for i in range(size * size):
+            if i % size < size - 1:
+                m_map.add_edge(MarketMap.MapEdge(bin_ids[i], bin_ids[i + 1], rng.uniform(5.0, 15.0)))
+            if i + size < size * size:
+                m_map.add_edge(MarketMap.MapEdge(bin_ids[i], bin_ids[i + size], rng.uniform(5.0, 15.0)))
+        transactions = [
+            Transaction(f'order-{o}', bin_id, 1.0)
+            for o in range(400) for bin_id in rng.sample(bin_ids, rng.randint(1, 3))
+        ]
+
+        start = time.perf_counter()
+        waves = m_map.plan_pick_waves(transactions)
+        # Planning must stay under a second for several hundred pending orders.
+        assert time.perf_counter() - start < 1.0
+        assert sorted(order_id for wave in waves for order_id in wave.order_ids) == sorted({t.order_id for t in transactions})
+        # The waves are routed without a shortest path tree from each stall they visit.
+        assert m_map.path_cache_info().currsize == 0
+
+        start = time.perf_counter()
+        waves = m_map.plan_pick_waves(transactions, from_stall=MarketMap.stall_of(bin_ids[0]))
+        assert time.perf_counter() - start < 1.0
+
+        # The distance of each route is the length of its walk, which visits every stop and is never shorter than the
+        # shortest paths between them.
+        edges = {frozenset((edge.vendor_bin_id, edge.neighbor_bin_id)): edge.distance for edge in m_map.edges}
+        for wave in waves:
+            path = [stall.bin_id for stall in wave.route.path]
+            assert wave.route.distance == pytest.approx(sum(edges[frozenset(step)] for step in zip(path, path[1:])))
+            assert set(wave.route.stops) <= set(wave.route.path)
+        for wave in waves[:3]:
+            stops = [MarketMap.stall_of(bin_ids[0])] + wave.route.stops
+            assert wave.route.distance >= sum(m_map.path_to_bin(a, b)[1] for a, b in zip(stops, stops[1:])) - 1e-9
+        MarketMap.cache_stalls_from_database()
@@ -0,0 +1,82 @@
+import re
+from datetime import datetime, timedelta
+
+import database
+import models
+from models import MarketMap, PriceCode, Vendor
+from models.orders import CartItem, CustomerCart
+
+LARGE_TABLES = {'bins', 'transactions', 'orders', 'customers', 'market_map', 'sales_hourly', 'sales_daily'}
+"""Tables that grow with the market. A query filtering one of these must never scan it."""
+
+PARTIAL_INDEXES = {'pending_transactions'}
+"""Partial indexes only holding the rows still being worked on. Scanning one never reads the rest of its table."""
+
+
+def scans_large_table(step: str) -> bool:
+    """True if a step of a query plan reads every row of a large table."""
+    if not re.match(r'SCAN (\w+)', step) or step.split()[1] not in LARGE_TABLES:
+        return False
+    index = re.search(r'USING (?:COVERING )?INDEX (\w+)', step)
+    return index is None or index[1] not in PARTIAL_INDEXES
+
+
+def issue_model_queries(client, auth):
+    """Runs every model query the app issues. Add new model queries here so their plans are checked."""
+    auth.login()
+    vendor = Vendor.current_user()
+    _ = vendor.bins
+    vendor.get_bin(database.gen_uuid(1))
+    vendor.get_all_orders()
+    vendor.get_all_orders(filled=False, limit=1, offset=1)
+    _bin = vendor.create_bin('juice', 3.0, 1.11, PriceCode.USD)
+    vendor.update_bin(_bin.bin_id, product_name='apple juice', stock=2.0, price=(1.5, PriceCode.USD))
+    vendor.adjust_stock(_bin.bin_id, -1.0)
+    vendor.remove_bin(_bin.bin_id)
+    vendor.pending_stock()
+    vendor.fill_transaction(database.gen_uuid(1), database.gen_uuid(1))
+    vendor.fill_transactions([(database.gen_uuid(1), database.gen_uuid(2)), (database.gen_uuid(2), database.gen_uuid(1))])
+    vendor.fill_orders([database.gen_uuid(1)])
+    vendor.plan_pick_waves()
+    models.plan_pick_waves()
+    vendor.sales_report(datetime(2021, 11, 20, 9, 30), datetime.now() + timedelta(days=2, minutes=30))
+    vendor.sales_columns(datetime(2021, 11, 20, 9, 30), datetime.now())
+    Vendor.get_all_vendors()
+    MarketMap.cache_stalls_from_database()
+    MarketMap()
+    models.init_product_index()
+    client.get('/')
+    client.get('/inventory/')
+    client.get('/inventory/sales')
+    client.get('/inventory/waves')
+    auth.logout()
+
+    cart = CustomerCart()
+    cart.cart_items[database.gen_uuid(6)] = CartItem(item_bin=Vendor.get(3).get_bin(database.gen_uuid(6)), quantity=1.0)
+    with client.session_transaction() as session:
+        session['customer'] = cart.compact()
+    client.post('/checkout')
+
+
+def test_model_queries_use_indexes(mock_orders, auth, client):
+    with mock_orders.app_context():
+        with client:
+            statements = []
+            for db in (database.get_db(), database.get_read_db()):
+                db.set_trace_callback(statements.append)
+            issue_model_queries(client, auth)
+            for db in (database.get_db(), database.get_read_db()):
+                db.set_trace_callback(None)
+
+            checked = 0
+            for statement in set(statements):
+                if not re.match(r'\s*(WITH|SELECT|UPDATE|DELETE|INSERT\s+INTO\s+\w+\s*\(.*\)\s*SELECT)', statement, re.I | re.S):
+                    continue
+                if not re.search(r'\bWHERE\b', statement, re.I):
+                    # Deliberate full table loads, e.g. loading the market map.
+                    continue
+                checked += 1
+                plan = [row[3] for row in database.get_db().execute(f'EXPLAIN QUERY PLAN {statement}')]
+                scans = [step for step in plan if scans_large_table(step)]
+                assert not scans, f'Query scans a large table:\n{statement}\nPlan: {plan}'
+            assert checked > 0
@@ -0,0 +1,244 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from models import Vendor, PriceCode, analytics
+from models.reports import rebuild_sales_rollups, sales_report
+
+SOLD_FROM = datetime(2021, 11, 20, 9, 0)
+
+
+@pytest.fixture
+def mock_sales(mock_customers):
+    """Sells 200 transactions spread over 3 days from vendor 1's bins, filling every one but the last 20."""
+    rng = random.Random(7)
+    with mock_customers.app_context():
+        db = database.get_db()
+        for i in range(200):
+            order_id = database.gen_uuid(1000 + i)
+            db.execute(
+                """INSERT INTO orders(order_id, customer_id, order_filled, order_filled_at) VALUES (?, ?, ?, ?)""",
+                (order_id, database.gen_uuid(1), False, None)
+            )
+            db.execute(
+                """INSERT INTO transactions(order_id, bin_id, units_purchased, transaction_filled, time_of_sale, transaction_filled_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (order_id, database.gen_uuid(rng.randint(1, 3)), float(rng.randint(1, 4)), False,
+                 SOLD_FROM + timedelta(minutes=rng.randint(0, 3 * 24 * 60)), None)
+            )
+        db.commit()
+        yield mock_customers
+
+
+def fill_all(client, auth):
+    """Fills vendor 1's transactions of mock_sales through Vendor.fill_transaction, except for the last 20."""
+    auth.login()
+    vendor = Vendor.current_user()
+    for i in range(180):
+        assert vendor.fill_transaction(database.gen_uuid(1000 + i), pending_bin(1000 + i))
+    auth.logout()
+
+
+def pending_bin(order_number: int) -> str:
+    return database.get_db().execute(
+        """SELECT bin_id FROM transactions WHERE order_id = ?""", (database.gen_uuid(order_number),)
+    ).fetchone()[0]
+
+
+def raw_sales(start: datetime, end: datetime) -> dict[str, tuple[float, float]]:
+    """The sales of vendor 1 within [start, end) computed straight from the transactions table."""
+    rows = database.get_db().execute(
+        """SELECT bins.bin_id, SUM(units_purchased), SUM(units_purchased * transactions.unit_price) FROM transactions
+           INNER JOIN bins ON bins.bin_id = transactions.bin_id
+           WHERE bins.vendor_id = 1 AND transaction_filled AND time_of_sale >= ? AND time_of_sale < ?
+           GROUP BY bins.bin_id""",
+        (start, end)
+    )
+    return {row[0]: (row[1], pytest.approx(row[2])) for row in rows}
+
+
+@pytest.mark.parametrize(
+    ('start', 'end'),
+    (
+        (SOLD_FROM, SOLD_FROM + timedelta(days=3)),
+        (SOLD_FROM - timedelta(days=5), SOLD_FROM + timedelta(days=5)),
+        (SOLD_FROM + timedelta(hours=17, minutes=13), SOLD_FROM + timedelta(days=2, hours=2, minutes=7)),
+        (SOLD_FROM + timedelta(minutes=13), SOLD_FROM + timedelta(minutes=47)),
+        (SOLD_FROM + timedelta(hours=3, minutes=5), SOLD_FROM + timedelta(hours=9, seconds=1)),
+        (SOLD_FROM + timedelta(days=1), SOLD_FROM + timedelta(days=1)),
+    )
+)
+def test_sales_report_matches_transactions(mock_sales, auth, client, start, end):
+    with mock_sales.app_context():
+        with client:
+            fill_all(client, auth)
+            expected = raw_sales(start, end)
+            report = sales_report(1, start, end)
+            assert {b.bin_id: (b.units_sold, b.revenue) for b in report.bins} == expected
+
+            # Rebuilding the rollups from scratch gives the same result as maintaining them.
+            rebuild_sales_rollups()
+            report = sales_report(1, start, end)
+            assert {b.bin_id: (b.units_sold, b.revenue) for b in report.bins} == expected
+
+
+
+def test_sales_report_keeps_removed_bins(mock_sales, auth, client):
+    start, end = SOLD_FROM + timedelta(hours=17, minutes=13), SOLD_FROM + timedelta(days=2, hours=2, minutes=7)
+    with mock_sales.app_context():
+        with client:
+            fill_all(client, auth)
+            expected = raw_sales(start, end)
+            db = database.get_db()
+            db.execute("""DELETE FROM bins WHERE bin_id = ?""", (database.gen_uuid(2),))
+            db.commit()
+            # The removed bin's sales are still reported, for the partial hours at either end as for the rest.
+            report = sales_report(1, start, end)
+            assert {b.bin_id: (b.units_sold, b.revenue) for b in report.bins} == expected
+            assert [b.product_name for b in report.bins if b.bin_id == database.gen_uuid(2)] == [None]
+
+            rebuild_sales_rollups()
+            report = sales_report(1, start, end)
+            assert {b.bin_id: (b.units_sold, b.revenue) for b in report.bins} == expected
+
+def test_fill_transaction(mock_sales, auth, client):
+    with mock_sales.app_context():
+        with client:
+            auth.login()
+            vendor = Vendor.current_user()
+            bin_id = pending_bin(1000)
+            assert vendor.fill_transaction(database.gen_uuid(1000), bin_id)
+            assert not vendor.fill_transaction(database.gen_uuid(1000), bin_id)
+            order = database.get_db().execute("""SELECT * FROM orders WHERE order_id = ?""", (database.gen_uuid(1000),)).fetchone()
+            assert order['order_filled'] and order['order_filled_at'] is not None
+
+            # Transactions of other vendors' bins can not be filled.
+            assert not vendor.fill_transaction(database.gen_uuid(3), database.gen_uuid(6))
+
+            report = vendor.sales_report(SOLD_FROM, SOLD_FROM + timedelta(days=3))
+            assert report.units_sold == report.bins[0].units_sold > 0
+            assert report.revenue == {PriceCode.USD: report.bins[0].revenue}
+            assert Vendor.get(2).sales_report(SOLD_FROM, SOLD_FROM + timedelta(days=3)) is None
+
+            response = client.get('/inventory/report', query_string={'start': '2021-11-20', 'end': '2021-11-23'})
+            assert f'Total units sold: {report.units_sold}'.encode() in response.data
+            auth.logout()
+
+
+def test_sales_priced_at_time_of_sale(mock_orders, auth, client):
+    sold_at = datetime(2021, 11, 20, 10, 30)
+    with mock_orders.app_context():
+        db = database.get_db()
+        db.execute(
+            """UPDATE transactions SET time_of_sale = ? WHERE order_id = ? AND bin_id = ?""",
+            (sold_at, database.gen_uuid(3), database.gen_uuid(6))
+        )
+        db.commit()
+        with client:
+            auth.login('vendor.c@email.com', 'password3')
+            vendor = Vendor.current_user()
+            assert vendor.fill_transaction(database.gen_uuid(3), database.gen_uuid(6))
+            vendor.update_bin(database.gen_uuid(6), price=(1000.0, PriceCode.YEN))
+            day = vendor.sales_report(datetime(2021, 11, 20), datetime(2021, 11, 21))
+            edges = vendor.sales_report(sold_at - timedelta(minutes=15), sold_at + timedelta(minutes=15))
+            assert day.revenue == edges.revenue == {PriceCode.USD: 80.0}
+
+            # Unfilling takes the sale back out at the price it was sold at, whatever the bin costs now.
+            db.execute("""UPDATE transactions SET transaction_filled = FALSE WHERE order_id = ?""", (database.gen_uuid(3),))
+            db.commit()
+            assert db.execute("""SELECT SUM(units_sold), SUM(revenue) FROM sales_daily""").fetchone()[:] == (0.0, 0.0)
+            assert vendor.sales_report(datetime(2021, 11, 20), datetime(2021, 11, 21)).bins == []
+            auth.logout()
+
+
+def test_upgrade_schema_records_sale_prices(app):
+    with app.app_context():
+        db = database.get_db()
+        db.executescript(
+            """DROP TABLE transactions;
+               CREATE TABLE transactions (
+                   order_id TEXT NOT NULL, bin_id TEXT NOT NULL, units_purchased FLOAT NOT NULL,
+                   transaction_filled BOOLEAN NOT NULL, time_of_sale DATETIME NOT NULL, transaction_filled_at DATETIME,
+                   PRIMARY KEY(order_id, bin_id)
+               );
+               INSERT INTO bins VALUES ('bin', 1, 'apple', 5.0, 2.5, 'USD');
+               INSERT INTO transactions VALUES ('order', 'bin', 2.0, FALSE, '2021-11-20 10:30:00', NULL);"""
+        )
+        database.init_db()
+        row = db.execute("""SELECT unit_price, price_code, stock_reserved FROM transactions""").fetchone()
+        # The sale was placed before checkout took sold units out of stock.
+        assert tuple(row) == (2.5, 'USD', False)
+
+
+def test_upgrade_schema_rolls_up_filled_sales(mock_orders):
+    with mock_orders.app_context():
+        db = database.get_db()
+        sold_at = datetime(2021, 11, 20, 10, 30)
+        db.execute(
+            """UPDATE transactions SET transaction_filled = TRUE, time_of_sale = ? WHERE order_id = ?""",
+            (sold_at, database.gen_uuid(1))
+        )
+        # A database from before the rollups existed.
+        db.executescript("""DROP TABLE sales_hourly; DROP TABLE sales_daily;""")
+        database.init_db()
+        for start, end in ((sold_at, sold_at + timedelta(days=1)), (sold_at - timedelta(days=1), sold_at + timedelta(days=2))):
+            report = sales_report(1, start, end)
+            assert [(b.bin_id, b.units_sold) for b in report.bins] == [
+                (database.gen_uuid(1), 3.0), (database.gen_uuid(3), 6.0), (database.gen_uuid(2), 5.0)
+            ]
+
+
+@pytest.mark.parametrize(
+    ('start', 'end'),
+    (
+        (SOLD_FROM, SOLD_FROM + timedelta(days=3)),
+        (SOLD_FROM + timedelta(hours=17, minutes=13), SOLD_FROM + timedelta(days=2, hours=2, minutes=7)),
+        (SOLD_FROM - timedelta(days=2), SOLD_FROM - timedelta(days=1)),
+    )
+)
+def test_sales_columns_match_report(mock_sales, auth, client, monkeypatch, start, end):
+    # Small batches, so the buffer has to grow several times.
+    monkeypatch.setattr(analytics, 'FETCH_SIZE', 16)
+    with mock_sales.app_context():
+        with client:
+            fill_all(client, auth)
+            auth.login()
+            statements = []
+            database.get_read_db().set_trace_callback(statements.append)
+            columns = Vendor.current_user().sales_columns(start, end)
+            database.get_read_db().set_trace_callback(None)
+            auth.logout()
+            # The sales are read in a single pass.
+            assert sum('transactions.transaction_filled' in statement for statement in statements) == 1
+            report = sales_report(1, start, end)
+            assert len(columns) == sum(1 for _ in database.get_db().execute(
+                """SELECT 1 FROM transactions INNER JOIN bins ON bins.bin_id = transactions.bin_id
+                   WHERE vendor_id = 1 AND transaction_filled AND time_of_sale >= ? AND time_of_sale < ?""",
+                (start, end)
+            ))
+            assert [(b.bin_id, b.units_sold, pytest.approx(b.revenue)) for b in columns.by_bin(currency=None)] == \
+                   [(b.bin_id, b.units_sold, b.revenue) for b in report.bins]
+            if len(columns):
+                assert columns.sold_at.min() >= start.timestamp() - 1e-3 and columns.sold_at.max() < end.timestamp()
+
+
+def test_sales_columns_currency(mock_orders, auth, client):
+    with mock_orders.app_context():
+        with client:
+            auth.login('vendor.c@email.com', 'password3')
+            vendor = Vendor.current_user()
+            assert vendor.fill_transaction(database.gen_uuid(3), database.gen_uuid(6))
+            vendor.update_bin(database.gen_uuid(6), price=(1000.0, PriceCode.YEN))
+            columns = vendor.sales_columns(datetime(2000, 1, 1), datetime.now() + timedelta(days=1))
+            assert Vendor.get(1).sales_columns(datetime(2000, 1, 1), datetime.now()) is None
+            auth.logout()
+            # Sold at 20 USD a unit, before the price changed.
+            assert list(columns.revenue(currency=None)) == [80.0]
+            assert [(b.price_code, b.units_sold, b.revenue) for b in columns.by_bin(currency=None)] == [(PriceCode.USD, 4.0, 80.0)]
+            rates = {PriceCode.USD: 1.0, PriceCode.EURO: 2.0, PriceCode.YEN: 0.01}
+            euro = columns.by_bin(PriceCode.EURO, rates=rates)[0]
+            assert euro.price_code == PriceCode.EURO and euro.revenue == pytest.approx(40.0)
+            with pytest.raises(ValueError):
+                columns.by_bin(PriceCode.USD)
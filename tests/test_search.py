@@ -0,0 +1,91 @@
+import pytest
+
+import database
+import models
+from models import Bin, MarketMap, PriceCode, Vendor
+
+
+@pytest.mark.parametrize(
+    ('query', 'products'),
+    (
+        ('apple', ['apple']),
+        ('Apples', ['apple']),
+        ('ca', ['cabbage', 'carrot']),
+        ('carot', ['carrot']),
+        ('soy sau', ['soy sauce']),
+        ('sauce soy', ['soy sauce']),
+        ('banana', [])
+    )
+)
+def test_search(mock_bins, query, products):
+    with mock_bins.app_context():
+        assert [_bin.product_name for _bin in models.get_product_index().search(query)] == products
+
+
+def test_search_exact_before_fuzzy(mock_bins):
+    with mock_bins.app_context():
+        index = models.get_product_index()
+        assert [_bin.product_name for _bin in index.search('rice', fuzzy=False)] == ['rice']
+        assert index.search('ric', prefix=False) == []
+
+
+def test_search_near(mock_map):
+    with mock_map.app_context():
+        models.init_market()
+        matches = models.get_product_index().search_near(
+            'ca', MarketMap.VendorStall(2, database.gen_uuid(4)), models.get_market_map()
+        )
+        assert [(_bin.product_name, distance) for _bin, distance in matches] == [('carrot', 14.5), ('cabbage', 19.8)]
+
+
+def test_index_follows_bin_changes(mock_bins, auth, client):
+    with mock_bins.app_context():
+        with client:
+            auth.login()
+            vendor = Vendor.current_user()
+            index = models.get_product_index()
+            _bin = vendor.create_bin('Honeycrisp Apples', 10.0, 1.5, PriceCode.USD)
+            assert [b.bin_id for b in index.search('honeycrisp')] == [_bin.bin_id]
+
+            vendor.update_bin(_bin.bin_id, product_name='pear')
+            assert index.search('honeycrisp') == []
+            assert [b.bin_id for b in index.search('pear')] == [_bin.bin_id]
+
+            vendor.remove_bin(_bin.bin_id)
+            assert index.search('pear') == []
+            auth.logout()
+
+
+def test_find_route(mock_map, client):
+    with mock_map.app_context():
+        models.init_market()
+        response = client.get('/market/find', query_string={'product': 'carrot', 'from_bin': database.gen_uuid(4)})
+        assert response.status_code == 200
+        assert b'carrot' in response.data
+        assert b'14.5' in response.data
+
+
+@pytest.mark.parametrize(
+    ('product', 'quantity', 'k', 'expected'),
+    (
+        ('apple', 3.0, 1, [(database.gen_uuid(1), 5.0)]),
+        ('apple', 3.0, 2, [(database.gen_uuid(1), 5.0), (database.gen_uuid(3), 13.0)]),
+        ('apple', 4.0, 2, [(database.gen_uuid(1), 5.0)]),
+        ('apple', 6.0, 1, []),
+        ('soy sauce', 1.0, 3, [(database.gen_uuid(5), 7.5)])
+    )
+)
+def test_nearest_in_stock(mock_map, product, quantity, k, expected):
+    with mock_map.app_context():
+        index = models.get_product_index()
+        # Vendor A restocks the grape bin with a few apples.
+        index.update(Bin(database.gen_uuid(3), 1, 'apples', 3.5, 2.3, PriceCode.USD))
+        # Vendor C's carrot bin now holds apple juice, which is not what was asked for.
+        index.update(Bin(database.gen_uuid(6), 3, 'Apple Juice', 10.0, 4.0, PriceCode.USD))
+        m_map = MarketMap()
+        rice = MarketMap.VendorStall(2, database.gen_uuid(4))
+        for market_map in (m_map, MarketMap()):
+            matches = index.nearest_in_stock(product, quantity, rice, market_map, k)
+            assert [(_bin.bin_id, distance) for _bin, distance in matches] == expected
+            # The same query served from precomputed paths.
+            market_map.precompute_all_pairs()
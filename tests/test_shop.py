@@ -1,6 +1,11 @@
+from datetime import datetime, timedelta
+
 import database
+import models
 from models import Vendor
 from models.orders import CustomerCart, CartItem, Order, Transaction, Customer
+from models.search import ProductIndex
+from sessions import SQLiteSessionInterface
 
 
 def test_checkout(mock_bins, client):
@@ -8,9 +13,9 @@ def test_checkout(mock_bins, client):
         with client:
             _bin = Vendor.get(1).get_bin(database.gen_uuid(1))
             customer = CustomerCart()
-            customer.cart_items[_bin.bin_id] = CartItem(item_bin=_bin, quantity=12.0)
+            customer.cart_items[_bin.bin_id] = CartItem(item_bin=_bin, quantity=2.0)
             with client.session_transaction() as session:
-                session['customer'] = customer.dict()
+                session['customer'] = customer.compact()
             response = client.post(
                 '/checkout', content_type='multipart/form-data',
                 data={},
@@ -26,4 +31,264 @@ def test_checkout(mock_bins, client):
                 """SELECT * FROM transactions WHERE order_id = ? AND bin_id = ?""",
                 (order.order_id, _bin.bin_id)
             ).fetchone()
-            assert Transaction(order_id=order.order_id, bin_id=_bin.bin_id, units_purchased=12.0) == Transaction(*transaction_item)
+            assert Transaction(order_id=order.order_id, bin_id=_bin.bin_id, units_purchased=2.0) == Transaction(*transaction_item)
+
+            assert Vendor.get(1).get_bin(_bin.bin_id).stock == 3.0
+            assert models.get_product_index().get(_bin.bin_id).stock == 3.0
+
+
+def test_checkout_insufficient_stock(mock_bins, client):
+    with mock_bins.app_context():
+        with client:
+            apple = Vendor.get(1).get_bin(database.gen_uuid(1))
+            rice = Vendor.get(2).get_bin(database.gen_uuid(4))
+            customer = CustomerCart()
+            customer.cart_items[rice.bin_id] = CartItem(item_bin=rice, quantity=1.0)
+            customer.cart_items[apple.bin_id] = CartItem(item_bin=apple, quantity=6.0)
+            with client.session_transaction() as session:
+                session['customer'] = customer.compact()
+            response = client.post('/checkout')
+            assert response.headers['Location'].endswith('/cart')
+            with client.session_transaction() as session:
+                assert session['_flashes'] == [('message', 'Only 5 left of apple.')]
+                assert len(session['customer']['items']) == 2
+
+            # Nothing from the cart is written, including the items that were in stock.
+            db = database.get_db()
+            assert db.execute("""SELECT * FROM customers WHERE customer_id = ?""", (customer.customer_id,)).fetchone() is None
+            assert db.execute("""SELECT * FROM orders WHERE customer_id = ?""", (customer.customer_id,)).fetchone() is None
+            assert [row['stock'] for row in db.execute("""SELECT stock FROM bins WHERE bin_id IN (?, ?) ORDER BY bin_id""", (apple.bin_id, rice.bin_id))] == [5.0, 13.5]
+
+
+def test_checkout_one_order_per_vendor(mock_bins, client):
+    with mock_bins.app_context():
+        with client:
+            customer = CustomerCart()
+            for bin_id, vendor_id in ((1, 1), (2, 1), (4, 2)):
+                _bin = Vendor.get(vendor_id).get_bin(database.gen_uuid(bin_id))
+                customer.cart_items[_bin.bin_id] = CartItem(item_bin=_bin, quantity=1.0)
+            with client.session_transaction() as session:
+                session['customer'] = customer.compact()
+            client.post('/checkout')
+            rows = database.get_db().execute(
+                """SELECT bins.vendor_id, COUNT(DISTINCT orders.order_id), COUNT(*) FROM orders
+                   INNER JOIN transactions ON orders.order_id = transactions.order_id
+                   INNER JOIN bins ON transactions.bin_id = bins.bin_id
+                   WHERE orders.customer_id = ? GROUP BY bins.vendor_id ORDER BY bins.vendor_id""",
+                (customer.customer_id,)
+            ).fetchall()
+            assert [tuple(row) for row in rows] == [(1, 1, 2), (2, 1, 1)]
+
+
+def test_merge_orders(mock_orders, app):
+    sold_at = datetime(2021, 11, 20, 10, 30, 15)
+    split_orders = [
+        # order_id, bin_id, order_filled, time_of_sale
+        (10, 1, True, sold_at),
+        (11, 2, True, sold_at.replace(microsecond=5000)),
+        (12, 4, False, sold_at),                            # Another vendor.
+        (13, 3, False, sold_at + timedelta(seconds=1)),     # A later purchase.
+        (14, 1, False, sold_at),                            # The same bin again.
+    ]
+    with app.app_context():
+        db = database.get_db()
+        for order_id, bin_id, filled, time_of_sale in split_orders:
+            db.execute(
+                """INSERT INTO orders(order_id, customer_id, order_filled, order_filled_at) VALUES (?, ?, ?, ?)""",
+                (database.gen_uuid(order_id), database.gen_uuid(2), filled, time_of_sale if filled else None)
+            )
+            db.execute(
+                """INSERT INTO transactions(order_id, bin_id, units_purchased, transaction_filled, time_of_sale, transaction_filled_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (database.gen_uuid(order_id), database.gen_uuid(bin_id), 1.0, filled, time_of_sale, time_of_sale if filled else None)
+            )
+        db.commit()
+
+    result = app.test_cli_runner().invoke(args=['merge-orders'])
+    assert 'Merged 1 orders.' in result.output
+
+    with app.app_context():
+        db = database.get_db()
+        orders = db.execute(
+            """SELECT orders.order_id, orders.order_filled, group_concat(transactions.bin_id) FROM orders
+               INNER JOIN transactions ON orders.order_id = transactions.order_id
+               WHERE customer_id = ? GROUP BY orders.order_id ORDER BY orders.order_id""",
+            (database.gen_uuid(2),)
+        ).fetchall()
+        assert {row[0]: (row[1], sorted(row[2].split(','))) for row in orders} == {
+            database.gen_uuid(2): (False, [database.gen_uuid(1)]),
+            database.gen_uuid(10): (True, sorted([database.gen_uuid(1), database.gen_uuid(2)])),
+            database.gen_uuid(12): (False, [database.gen_uuid(4)]),
+            database.gen_uuid(13): (False, [database.gen_uuid(3)]),
+            database.gen_uuid(14): (False, [database.gen_uuid(1)]),
+        }
+
+
+def test_merge_orders_across_seconds(mock_orders, app):
+    # A cart whose items were sold either side of a second boundary, and a purchase made a second after the cart.
+    sold_at = datetime(2021, 11, 20, 10, 30, 15, 900000)
+    split_orders = [(20, 1, sold_at), (21, 2, sold_at + timedelta(milliseconds=200)), (22, 3, sold_at + timedelta(seconds=1))]
+    with app.app_context():
+        db = database.get_db()
+        for order_id, bin_id, time_of_sale in split_orders:
+            db.execute(
+                """INSERT INTO orders(order_id, customer_id, order_filled, order_filled_at) VALUES (?, ?, FALSE, NULL)""",
+                (database.gen_uuid(order_id), database.gen_uuid(3))
+            )
+            db.execute(
+                """INSERT INTO transactions(order_id, bin_id, units_purchased, transaction_filled, time_of_sale)
+                   VALUES (?, ?, 1.0, FALSE, ?)""",
+                (database.gen_uuid(order_id), database.gen_uuid(bin_id), time_of_sale)
+            )
+        db.commit()
+
+    result = app.test_cli_runner().invoke(args=['merge-orders'])
+    assert 'Merged 1 orders.' in result.output
+
+    with app.app_context():
+        orders = database.get_db().execute(
+            """SELECT order_id, group_concat(bin_id) FROM transactions WHERE order_id IN (?, ?, ?) GROUP BY order_id""",
+            tuple(database.gen_uuid(order_id) for order_id, *_ in split_orders)
+        ).fetchall()
+        assert {row[0]: sorted(row[1].split(',')) for row in orders} == {
+            database.gen_uuid(20): sorted([database.gen_uuid(1), database.gen_uuid(2)]),
+            database.gen_uuid(22): [database.gen_uuid(3)],
+        }
+
+
+def shop_for_apples(client):
+    """Clicks the apple bin in the shop and adds 2 of them to the cart."""
+    apple = Vendor.get(1).get_bin(database.gen_uuid(1))
+    client.post('/', data={'bin_data': apple.json_str})
+    client.post('/add-cart', data={'quantity': '2'})
+    return apple
+
+
+def test_compact_cart(mock_bins, client):
+    with mock_bins.app_context():
+        with client:
+            apple = shop_for_apples(client)
+            client.post('/', data={'bin_data': apple.json_str})
+            client.post('/add-cart', data={'quantity': '1.5'})
+            with client.session_transaction() as session:
+                assert session['customer']['items'] == {apple.bin_id: 3.5}
+
+            statements = []
+            database.get_db().set_trace_callback(statements.append)
+            response = client.get('/cart')
+            database.get_db().set_trace_callback(None)
+            assert b'Quantity: 3.5' in response.data
+            assert len([s for s in statements if 'FROM bins' in s]) <= 1
+
+            client.get('/remove-cart', query_string={'bin_id': apple.bin_id})
+            with client.session_transaction() as session:
+                assert session['customer']['items'] == {}
+
+
+def test_sqlite_sessions(mock_bins, client):
+    mock_bins.session_interface = SQLiteSessionInterface()
+    with mock_bins.app_context():
+        with client:
+            apple = shop_for_apples(client)
+            cookie = next(cookie for cookie in client.cookie_jar if cookie.name == mock_bins.session_cookie_name)
+            assert apple.bin_id not in cookie.value
+
+            data = database.get_db().execute("""SELECT data FROM sessions""").fetchall()
+            assert len(data) == 1 and apple.bin_id in data[0]['data']
+            assert b'Quantity: 2.0' in client.get('/cart').data
+
+            client.post('/checkout')
+            assert Vendor.get(1).get_bin(apple.bin_id).stock == 3.0
+            with client.session_transaction() as session:
+                assert session['customer']['items'] == {}
+
+            # A tampered cookie starts a new, empty session.
+            client.set_cookie('localhost', mock_bins.session_cookie_name, cookie.value + 'x')
+            assert b'No items in Cart' in client.get('/cart').data
+
+
+def test_storefront(mock_bins, client):
+    with mock_bins.app_context():
+        statements = []
+        database.get_read_db().set_trace_callback(statements.append)
+        shop, has_next = Vendor.storefront(page_size=2, bin_limit=2)
+        database.get_read_db().set_trace_callback(None)
+        assert len(statements) == 1
+        assert [(s.vendor.vendor_id, [b.product_name for b in s.bins], s.bin_count) for s in shop] == [
+            (1, ['apple', 'grape'], 3),
+            (2, ['rice', 'soy sauce'], 2)
+        ]
+        assert has_next
+
+        shop, has_next = Vendor.storefront(page=1, page_size=2, bin_limit=2)
+        assert [(s.vendor.vendor_id, [b.product_name for b in s.bins]) for s in shop] == [(3, ['cabbage', 'carrot'])]
+        assert not has_next
+        assert Vendor.storefront(page=2, page_size=2) == ([], False)
+
+        response = client.get('/')
+        assert b'Shop From Vendor A' in response.data and b'soy sauce' in response.data
+
+
+def test_storefront_fragment_cache(mock_bins, auth, client):
+    with mock_bins.app_context():
+        response = client.get('/')
+        etag = response.headers['ETag']
+        assert b'apple' in response.data
+
+        # Unchanged vendors are served from the fragment cache, and revalidating browsers get a 304.
+        statements = []
+        database.get_read_db().set_trace_callback(statements.append)
+        assert client.get('/').data == response.data
+        assert not any('FROM bins' in statement for statement in statements)
+        assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+        database.get_read_db().set_trace_callback(None)
+
+        with client:
+            auth.login()
+            assert 'ETag' not in client.get('/').headers
+            Vendor.current_user().update_bin(database.gen_uuid(1), product_name='green apple')
+            auth.logout()
+        client.get('/')     # Shows the logout message.
+
+        response = client.get('/', headers={'If-None-Match': etag})
+        assert response.status_code == 200 and response.headers['ETag'] != etag
+        assert b'green apple' in response.data
+
+
+def test_storefront_etag_after_restart(mock_bins, client, monkeypatch):
+    with mock_bins.app_context():
+        monkeypatch.setattr(models, '_product_index', ProductIndex())
+        models.init_product_index()
+        etag = client.get('/').headers['ETag']
+        # A restarted server indexes the same bins again, giving every vendor the same version as before.
+        versions = [models.get_product_index().vendor_version(vendor_id) for vendor_id in (1, 2, 3)]
+        monkeypatch.setattr(models, '_product_index', ProductIndex())
+        models.init_product_index()
+        assert [models.get_product_index().vendor_version(vendor_id) for vendor_id in (1, 2, 3)] == versions
+        response = client.get('/', headers={'If-None-Match': etag})
+        assert response.status_code == 200 and response.headers['ETag'] != etag
+
+
+def test_upgrade_old_session_cart(mock_bins, client):
+    with mock_bins.app_context():
+        apple = Vendor.get(1).get_bin(database.gen_uuid(1))
+        old_cart = CustomerCart()
+        old_cart.cart_items[apple.bin_id] = CartItem(item_bin=apple, quantity=2.0)
+        with client:
+            with client.session_transaction() as session:
+                session['customer'] = old_cart.dict()
+            assert b'Quantity: 2.0' in client.get('/cart').data
+            with client.session_transaction() as session:
+                assert session['customer'] == {'customer_id': old_cart.customer_id, 'items': {apple.bin_id: 2.0}}
+
+            # A bin clicked before the upgrade was kept whole in the session.
+            with client.session_transaction() as session:
+                session['bin_clicked'] = {'bin_id': apple.bin_id, 'product_name': 'apple'}
+            assert client.get('/add-cart').status_code == 200
+            client.post('/add-cart', data={'quantity': '1'})
+            with client.session_transaction() as session:
+                assert session['customer']['items'] == {apple.bin_id: 3.0}
+
+            with client.session_transaction() as session:
+                session['customer'] = {'cart_items': 'unreadable'}
+            assert b'No items in Cart' in client.get('/cart').data